@@ -0,0 +1,141 @@
+'''Times each test of the checker on a catalog database, and saves the number of catalog rows
+   processed per second, the peak RSS and the number of queries of each test as JSON, so that
+   results of different versions can be compared.
+
+   Options that are not recognized are passed on to the checker, e.g. --engine server. Memory of the
+   worker processes of sharded runs (--shards) is not included in the results.'''
+from argparse import ArgumentParser
+from benchmarks.catalog_generator import CatalogGenerator, TABLES, add_generator_arguments, load_catalog
+from icat_tools import dbcheck_command, metrics, utils
+from icat_tools.dbcheck_outputprocessors import CollectingOutputProcessor
+import datetime
+import json
+import multiprocessing
+import platform
+import subprocess
+import sys
+import traceback
+
+
+def _get_table_row_counts(connection):
+    cursor = connection.cursor()
+    row_counts = {}
+    for table in TABLES:
+        cursor.execute("SELECT count(*) FROM {}".format(table))
+        row_counts[table] = cursor.fetchone()[0]
+    cursor.close()
+    return row_counts
+
+
+def _get_version():
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _run_test(task):
+    '''Runs a single test. Every test runs in a fresh worker process, so that its peak RSS is not
+       affected by earlier tests.'''
+    test_name, checker_argv = task
+    args = dbcheck_command.get_arguments(checker_argv)
+    connection = utils.get_connection_database(utils.read_database_config(args.config_file))
+    output_processor = CollectingOutputProcessor()
+    detector = [detector for detector in (detector_class(args, connection, output_processor)
+                                          for detector_class in dbcheck_command.DETECTOR_CLASSES)
+                if detector.get_name() == test_name][0]
+    dbcheck_command.run_detector(args, detector)
+    connection.close()
+    return {'seconds': detector.stats.wall_time,
+            'database_seconds': detector.stats.db_time,
+            'peak_rss_kb': metrics.get_peak_rss(),
+            'queries': detector.stats.queries,
+            'rows_fetched': detector.stats.rows_fetched,
+            'issues': detector.stats.issues}
+
+
+def _run_test_process(task, result_queue):
+    try:
+        result_queue.put((True, _run_test(task)))
+    except BaseException:
+        result_queue.put((False, traceback.format_exc()))
+
+
+def _print_comparison(results, baseline_file):
+    with open(baseline_file) as baseline:
+        baseline_results = json.load(baseline)['results']
+    print("\nCompared with {}:".format(baseline_file))
+    for test_name, result in results.items():
+        if test_name in baseline_results and baseline_results[test_name]['seconds'] > 0:
+            print("{:18} {:7.2f}x time  {:7.2f}x peak RSS  {:+6d} queries".format(
+                test_name,
+                result['seconds'] / baseline_results[test_name]['seconds'],
+                result['peak_rss_kb'] / baseline_results[test_name]['peak_rss_kb'],
+                result['queries'] - baseline_results[test_name]['queries']))
+
+
+def main():
+    test_names = [str(test) for test in dbcheck_command.TestSubset if test != dbcheck_command.TestSubset.all]
+    parser = ArgumentParser(description='Benchmark of the tests of the checker')
+    parser.add_argument('--config-file', required=True,
+                        help='iRODS server_config file with the connection parameters of the database')
+    parser.add_argument('--tests', nargs='+', choices=test_names, default=test_names,
+                        help='Tests to run (default: all)')
+    parser.add_argument('--output', help='File to save the results to as JSON (default: only print them)')
+    parser.add_argument('--baseline', help='JSON file with results of an earlier run to compare with')
+    parser.add_argument('--generate', action='store_const', const=True,
+                        help='Generate a synthetic catalog first. This drops existing catalog tables.')
+    add_generator_arguments(parser)
+    args, checker_argv = parser.parse_known_args()
+    checker_argv = ['--config-file', args.config_file] + checker_argv
+    # Check the options of the checker before the catalog is generated
+    dbcheck_command.get_arguments(checker_argv)
+
+    connection = utils.get_connection_database(utils.read_database_config(args.config_file))
+    generator = None
+    if args.generate:
+        generator = CatalogGenerator(args)
+        load_catalog(connection, generator)
+    row_counts = _get_table_row_counts(connection)
+    connection.close()
+    catalog_rows = sum(row_counts.values())
+
+    results = {}
+    context = multiprocessing.get_context('spawn')
+    for test_name in args.tests:
+        # Pool workers are daemonic and cannot start the worker processes of sharded runs
+        result_queue = context.Queue()
+        process = context.Process(target=_run_test_process, args=((test_name, checker_argv), result_queue))
+        process.start()
+        success, result = result_queue.get()
+        process.join()
+        if not success:
+            print("Test {} failed:\n{}".format(test_name, result), file=sys.stderr)
+            sys.exit(1)
+        result['rows_per_second'] = catalog_rows / result['seconds'] if result['seconds'] > 0 else None
+        results[test_name] = result
+        print("{:18} {:8.2f} s  {:12.0f} rows/s  {:8} kB peak RSS  {:6} queries  {} issues".format(
+            test_name, result['seconds'], result['rows_per_second'] or 0, result['peak_rss_kb'],
+            result['queries'], result['issues']))
+
+    report = {
+        'date': datetime.datetime.now().isoformat(),
+        'version': _get_version(),
+        'python': platform.python_version(),
+        'checker_arguments': checker_argv[2:],
+        'catalog': {
+            'table_rows': row_counts,
+            'generator': generator.get_parameters() if generator is not None else None,
+            'injected_issues': generator.issue_counts if generator is not None else None},
+        'results': results}
+    if args.output is not None:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
+
+    if args.baseline is not None:
+        _print_comparison(results, args.baseline)
+
+
+if __name__ == '__main__':
+    main()
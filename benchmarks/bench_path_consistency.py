@@ -0,0 +1,125 @@
+'''Compares the per-row pathlib implementation of the path consistency check with the memoized
+   string-based implementation, using synthetic rows. No database is needed.
+
+   With --config-file, the implementations are compared on the rows of a catalog database instead,
+   together with complete runs of the test with the client engine and with the server engine, which
+   lets the database compare the paths in SQL. Use --generate to generate a synthetic catalog first.'''
+from argparse import ArgumentParser
+from benchmarks.catalog_generator import CatalogGenerator, add_generator_arguments, load_catalog
+from icat_tools import dbcheck_command, utils
+from icat_tools.dbcheck_outputprocessors import CollectingOutputProcessor
+from icat_tools.detectors.pathinconsistency_detector import (is_path_consistent, PathConsistencyChecker,
+                                                             PathInconsistencyDetector)
+import random
+import time
+
+
+def generate_rows(number_rows, number_collections, mismatch_rate, seed):
+    rng = random.Random(seed)
+    vault_path_lookup = {10010: "/var/lib/irods/Vault", 10011: "/data/vault2/"}
+    coll_path_lookup = {}
+    for coll_id in range(number_collections):
+        coll_path_lookup[coll_id] = "/tempZone/home/user{}/project{}/dir{}".format(
+            coll_id % 97, coll_id % 13, coll_id)
+    rows = []
+    for data_id in range(number_rows):
+        coll_id = rng.randrange(number_collections)
+        resc_id = rng.choice(list(vault_path_lookup))
+        collname = coll_path_lookup[coll_id]
+        if rng.random() < mismatch_rate:
+            collname = collname + "_moved"
+        data_path = str(vault_path_lookup[resc_id]).rstrip("/") + collname[len("/tempZone"):] + "/file{}.dat".format(data_id)
+        rows.append((coll_id, resc_id, data_path))
+    return vault_path_lookup, coll_path_lookup, rows
+
+
+def run_pathlib(vault_path_lookup, coll_path_lookup, rows):
+    return sum(1 for coll_id, resc_id, data_path in rows
+               if not is_path_consistent(vault_path_lookup[resc_id], coll_path_lookup[coll_id], data_path))
+
+
+def run_memoized(vault_path_lookup, coll_path_lookup, rows):
+    checker = PathConsistencyChecker(vault_path_lookup, coll_path_lookup)
+    return sum(1 for coll_id, resc_id, data_path in rows
+               if not checker.is_consistent(resc_id, coll_id, data_path))
+
+
+def get_database_rows(connection):
+    '''Returns the lookups and the rows of the data objects on unix file system resources of a catalog
+       database, like generate_rows does.'''
+    vault_path_lookup = utils.get_resource_vault_path_dict(connection)
+    coll_path_lookup = utils.get_coll_path_dict(connection)
+    rows = []
+    if len(vault_path_lookup) > 0:
+        cursor = utils.get_server_side_cursor(connection, 'bench_path_consistency')
+        cursor.execute("SELECT coll_id, resc_id, data_path FROM r_data_main WHERE resc_id IN ({})".format(
+            ",".join(str(resc_id) for resc_id in vault_path_lookup)))
+        rows = [row for row in cursor if row[0] in coll_path_lookup]
+        cursor.close()
+    return vault_path_lookup, coll_path_lookup, rows
+
+
+def run_detector(config_file, connection, engine):
+    '''Runs the path consistency test on a catalog database. Returns the wall time and the number of
+       issues.'''
+    args = dbcheck_command.get_arguments(['--config-file', config_file, '--run-test', 'path_consistency',
+                                          '--engine', engine])
+    detector = PathInconsistencyDetector(args, connection, CollectingOutputProcessor())
+    dbcheck_command.run_detector(args, detector)
+    connection.rollback()
+    return detector.stats.wall_time, detector.stats.issues
+
+
+def print_result(name, duration, number_rows, issues):
+    print("{:10} {:8.2f} s  {:12.0f} rows/s  {} issues".format(name, duration, number_rows / duration, issues))
+
+
+def main():
+    parser = ArgumentParser(description='Benchmark of the path consistency check implementations')
+    parser.add_argument('--rows', type=int, default=500000,
+                        help='Number of synthetic data object rows (default: 500000)')
+    parser.add_argument('--mismatch-rate', type=float, default=0.01,
+                        help='Fraction of inconsistent synthetic paths (default: 0.01)')
+    parser.add_argument('--config-file',
+                        help='iRODS server_config file with the connection parameters of a catalog database to ' +
+                             'benchmark on, instead of synthetic rows')
+    parser.add_argument('--generate', action='store_const', const=True,
+                        help='Generate a synthetic catalog in the database first. This drops existing catalog tables.')
+    add_generator_arguments(parser)
+    args = parser.parse_args()
+    if args.generate and args.config_file is None:
+        parser.error("--generate needs --config-file")
+
+    connection = None
+    if args.config_file is None:
+        lookups = generate_rows(args.rows, args.collections, args.mismatch_rate, args.seed)
+    else:
+        connection = utils.get_connection_database(utils.read_database_config(args.config_file))
+        if args.generate:
+            load_catalog(connection, CatalogGenerator(args))
+        lookups = get_database_rows(connection)
+        connection.rollback()
+    number_rows = len(lookups[2])
+
+    results = {}
+    for name, function in [('pathlib', run_pathlib), ('memoized', run_memoized)]:
+        start = time.perf_counter()
+        issues = function(*lookups)
+        duration = time.perf_counter() - start
+        results[name] = issues
+        print_result(name, duration, number_rows, issues)
+
+    if connection is not None:
+        # Complete runs of the test, including the queries and the lookup of the collection names
+        for engine in ['client', 'server']:
+            duration, issues = run_detector(args.config_file, connection, engine)
+            results[engine] = issues
+            print_result(engine, duration, number_rows, issues)
+        connection.close()
+
+    if len(set(results.values())) > 1:
+        print("Error: implementations report a different number of issues.")
+
+
+if __name__ == '__main__':
+    main()
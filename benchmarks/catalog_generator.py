@@ -0,0 +1,241 @@
+'''Generates synthetic iRODS 4.2 catalogs of configurable size, with issues injected at set rates,
+   and loads them into a PostgreSQL database. The database should not contain an actual catalog:
+   existing catalog tables are dropped.'''
+from argparse import ArgumentParser
+from icat_tools import utils
+import io
+import os
+import random
+
+SCHEMA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'icat_schema.sql')
+
+# Number of rows that are sent to the database per COPY statement
+COPY_BATCH_SIZE = 50000
+
+# Catalog tables, in the order in which they are loaded
+TABLES = ['r_zone_main', 'r_user_main', 'r_user_password', 'r_resc_main', 'r_coll_main', 'r_data_main',
+          'r_meta_main', 'r_objt_metamap', 'r_objt_access', 'r_rule_main', 'r_quota_main', 'r_quota_usage']
+
+ZONE_NAME = 'tempZone'
+ZONE_ID = 9000
+FIRST_USER_ID = 10000
+FIRST_RESOURCE_ID = 10010
+# Object ids of users and resources are below this value; collections and data objects get
+# ids from here on, like in a real catalog.
+FIRST_OBJECT_ID = 20000
+# Object ids of orphaned metadata map entries start here, so that they don't refer to any object
+FIRST_ORPHAN_ID = 10 ** 12
+
+# Characters that the names test reports
+BAD_NAME_CHARACTERS = ['`', '\x01', '\x1f']
+
+
+# Options of the generator, which describe the generated catalog
+GENERATOR_PARAMETERS = ['data_objects', 'collections', 'users', 'resources', 'replica_rate', 'metadata_rate',
+                        'hardlink_rate', 'orphan_metamap_rate', 'bad_name_rate', 'seed']
+
+
+def add_generator_arguments(parser):
+    parser.add_argument('--data-objects', type=int, default=100000,
+                        help='Number of data objects (default: 100000)')
+    parser.add_argument('--collections', type=int, default=1000,
+                        help='Number of collections, not including home collections (default: 1000)')
+    parser.add_argument('--users', type=int, default=10, help='Number of users (default: 10)')
+    parser.add_argument('--resources', type=int, default=2, help='Number of resources (default: 2)')
+    parser.add_argument('--replica-rate', type=float, default=0.5,
+                        help='Fraction of data objects with a second replica (default: 0.5)')
+    parser.add_argument('--metadata-rate', type=float, default=0.5,
+                        help='Fraction of data objects with a metadata entry (default: 0.5)')
+    parser.add_argument('--hardlink-rate', type=float, default=0.001,
+                        help='Fraction of replicas that share their physical path with another replica (default: 0.001)')
+    parser.add_argument('--orphan-metamap-rate', type=float, default=0.001,
+                        help='Fraction of metadata map entries that refer to a nonexistent object (default: 0.001)')
+    parser.add_argument('--bad-name-rate', type=float, default=0.001,
+                        help='Fraction of data objects with a problematic character in their name (default: 0.001)')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed (default: 1)')
+
+
+def _copy_value(value):
+    if value is None:
+        return '\\N'
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+class CatalogGenerator(object):
+
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.collections = []
+        self.resources = []
+        self.metadata = []
+        self.issue_counts = {'hardlinks': 0, 'orphaned_metamap_entries': 0, 'bad_names': 0}
+
+    def get_parameters(self):
+        return {parameter: getattr(self.args, parameter) for parameter in GENERATOR_PARAMETERS}
+
+    def _timestamps(self):
+        create_ts = self.rng.randrange(1300000000, 1600000000)
+        modify_ts = create_ts + self.rng.randrange(0, 10000000)
+        return "{:011d}".format(create_ts), "{:011d}".format(modify_ts)
+
+    def zones(self):
+        yield (ZONE_ID, ZONE_NAME, 'local') + self._timestamps()
+
+    def users(self):
+        yield (FIRST_USER_ID, 'rods', 'rodsadmin', ZONE_NAME) + self._timestamps()
+        for user_num in range(1, self.args.users + 1):
+            yield (FIRST_USER_ID + user_num, 'user{}'.format(user_num), 'rodsuser', ZONE_NAME) + self._timestamps()
+
+    def user_passwords(self):
+        yield (FIRST_USER_ID, 'password', '9999-12-31') + self._timestamps()
+
+    def resources_rows(self):
+        for resc_num in range(self.args.resources):
+            resc_id = FIRST_RESOURCE_ID + resc_num
+            resc_name = 'demoResc' if resc_num == 0 else 'resc{}'.format(resc_num)
+            vault_path = '/var/lib/irods/Vault{}'.format(resc_num if resc_num > 0 else '')
+            self.resources.append((resc_id, resc_name, vault_path))
+            yield (resc_id, resc_name, ZONE_NAME, 'unixfilesystem', 'cache', 'localhost', vault_path, '') + self._timestamps()
+
+    def collections_rows(self):
+        next_id = FIRST_OBJECT_ID
+        collections = [('/', '/'), ('/', '/' + ZONE_NAME), ('/' + ZONE_NAME, '/{}/home'.format(ZONE_NAME))]
+        collections += [('/{}/home'.format(ZONE_NAME), '/{}/home/{}'.format(ZONE_NAME, 'rods'))]
+        collections += [('/{}/home'.format(ZONE_NAME), '/{}/home/user{}'.format(ZONE_NAME, user_num))
+                        for user_num in range(1, self.args.users + 1)]
+        for parent_coll_name, coll_name in collections:
+            self.collections.append((next_id, coll_name))
+            yield (next_id, parent_coll_name, coll_name, 'rods', ZONE_NAME) + self._timestamps()
+            next_id += 1
+        for coll_num in range(self.args.collections):
+            # Build a random tree of collections below the home collections
+            _, parent_coll_name = self.rng.choice(self.collections[3:])
+            coll_name = "{}/coll{}".format(parent_coll_name, coll_num)
+            self.collections.append((next_id, coll_name))
+            yield (next_id, parent_coll_name, coll_name, 'rods', ZONE_NAME) + self._timestamps()
+            next_id += 1
+
+    def data_objects(self):
+        next_id = FIRST_OBJECT_ID + len(self.collections)
+        last_paths = {}
+        for _ in range(self.args.data_objects):
+            data_id = next_id
+            next_id += 1
+            coll_id, coll_name = self.rng.choice(self.collections[3:])
+            data_name = "file{}.dat".format(data_id)
+            if self.rng.random() < self.args.bad_name_rate:
+                data_name = "file{}{}.dat".format(data_id, self.rng.choice(BAD_NAME_CHARACTERS))
+                self.issue_counts['bad_names'] += 1
+            create_ts, modify_ts = self._timestamps()
+            number_replicas = 2 if self.rng.random() < self.args.replica_rate and len(self.resources) > 1 else 1
+            for repl_num, (resc_id, resc_name, vault_path) in enumerate(self.rng.sample(self.resources, number_replicas)):
+                data_path = "{}{}/{}".format(vault_path, coll_name[len(ZONE_NAME) + 1:], data_name)
+                if resc_id in last_paths and self.rng.random() < self.args.hardlink_rate:
+                    data_path = last_paths[resc_id]
+                    self.issue_counts['hardlinks'] += 1
+                last_paths[resc_id] = data_path
+                yield (data_id, coll_id, data_name, repl_num, 'generic', self.rng.randrange(0, 10 ** 9),
+                       resc_name, data_path, 'rods', ZONE_NAME, create_ts, modify_ts, resc_id)
+            if self.rng.random() < self.args.metadata_rate:
+                self.metadata.append(data_id)
+
+    def metadata_rows(self):
+        for meta_num, _ in enumerate(self.metadata):
+            yield (meta_num + 1, 'attribute{}'.format(meta_num % 100), 'value{}'.format(meta_num)) + self._timestamps()
+
+    def metamap_rows(self):
+        for meta_num, data_id in enumerate(self.metadata):
+            object_id = data_id
+            if self.rng.random() < self.args.orphan_metamap_rate:
+                object_id = FIRST_ORPHAN_ID + meta_num
+                self.issue_counts['orphaned_metamap_entries'] += 1
+            yield (object_id, meta_num + 1) + self._timestamps()
+
+    def access_rows(self):
+        for coll_id, _ in self.collections:
+            yield (coll_id, FIRST_USER_ID, 1200) + self._timestamps()
+        first_data_id = FIRST_OBJECT_ID + len(self.collections)
+        for data_id in range(first_data_id, first_data_id + self.args.data_objects):
+            yield (data_id, FIRST_USER_ID, 1200) + self._timestamps()
+
+    def rules(self):
+        yield (1, 'core', 'acPostProcForPut', 'acPostProcForPut', 'nop', 'nop', 'rods', ZONE_NAME) + self._timestamps()
+
+    def get_tables(self):
+        '''Returns (table, columns, rows) tuples in load order. Rows are generated while they are
+           loaded, and later tables depend on the rows of earlier ones.'''
+        timestamps = ['create_ts', 'modify_ts']
+        return [
+            ('r_zone_main', ['zone_id', 'zone_name', 'zone_type_name'] + timestamps, self.zones()),
+            ('r_user_main', ['user_id', 'user_name', 'user_type_name', 'zone_name'] + timestamps, self.users()),
+            ('r_user_password', ['user_id', 'rcat_password', 'pass_expiry_ts'] + timestamps, self.user_passwords()),
+            ('r_resc_main', ['resc_id', 'resc_name', 'zone_name', 'resc_type_name', 'resc_class_name', 'resc_net',
+                             'resc_def_path', 'resc_parent'] + timestamps, self.resources_rows()),
+            ('r_coll_main', ['coll_id', 'parent_coll_name', 'coll_name', 'coll_owner_name', 'coll_owner_zone'] +
+             timestamps, self.collections_rows()),
+            ('r_data_main', ['data_id', 'coll_id', 'data_name', 'data_repl_num', 'data_type_name', 'data_size',
+                             'resc_name', 'data_path', 'data_owner_name', 'data_owner_zone'] + timestamps +
+             ['resc_id'], self.data_objects()),
+            ('r_meta_main', ['meta_id', 'meta_attr_name', 'meta_attr_value'] + timestamps, self.metadata_rows()),
+            ('r_objt_metamap', ['object_id', 'meta_id'] + timestamps, self.metamap_rows()),
+            ('r_objt_access', ['object_id', 'user_id', 'access_type_id'] + timestamps, self.access_rows()),
+            ('r_rule_main', ['rule_id', 'rule_base_name', 'rule_name', 'rule_event', 'rule_body', 'rule_recovery',
+                             'rule_owner_name', 'rule_owner_zone'] + timestamps, self.rules())]
+
+
+def _copy_rows(cursor, table, columns, rows):
+    buffer = io.StringIO("".join("\t".join(_copy_value(value) for value in row) + "\n" for row in rows))
+    cursor.copy_from(buffer, table, columns=columns)
+
+
+def load_catalog(connection, generator, verbose=False):
+    '''Creates the catalog tables and loads the generated rows. Returns the number of rows per table.'''
+    cursor = connection.cursor()
+    for table in TABLES:
+        cursor.execute("DROP TABLE IF EXISTS {}".format(table))
+    with open(SCHEMA_FILE) as schema_file:
+        cursor.execute(schema_file.read())
+
+    row_counts = {table: 0 for table in TABLES}
+    for table, columns, rows in generator.get_tables():
+        if verbose:
+            print("Loading {}".format(table))
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == COPY_BATCH_SIZE:
+                _copy_rows(cursor, table, columns, batch)
+                row_counts[table] += len(batch)
+                batch = []
+        _copy_rows(cursor, table, columns, batch)
+        row_counts[table] += len(batch)
+
+    connection.commit()
+    connection.autocommit = True
+    cursor.execute("ANALYZE")
+    connection.autocommit = False
+    cursor.close()
+    return row_counts
+
+
+def main():
+    parser = ArgumentParser(description='Generates a synthetic iRODS catalog and loads it into a PostgreSQL database')
+    parser.add_argument('--config-file', required=True,
+                        help='iRODS server_config file with the connection parameters of the database')
+    add_generator_arguments(parser)
+    args = parser.parse_args()
+
+    connection = utils.get_connection_database(utils.read_database_config(args.config_file))
+    generator = CatalogGenerator(args)
+    row_counts = load_catalog(connection, generator, verbose=True)
+    connection.close()
+    for table in TABLES:
+        print("{:16} {:10} rows".format(table, row_counts[table]))
+    for issue_type, count in generator.issue_counts.items():
+        print("Injected {}: {}".format(issue_type.replace('_', ' '), count))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,26 @@
+-- Subset of the iRODS 4.2 catalog schema (icatSysTables.sql) with the tables and indexes that are
+-- used by the checker. Used by the benchmarks to create synthetic catalogs.
+create table R_ZONE_MAIN (zone_id bigint not null, zone_name varchar(250) not null, zone_type_name varchar(250) not null, zone_conn_string varchar(1000), r_comment varchar(1000), create_ts varchar(32), modify_ts varchar(32));
+create table R_USER_MAIN (user_id bigint not null, user_name varchar(250) not null, user_type_name varchar(250) not null, zone_name varchar(250) not null, user_info varchar(1000), r_comment varchar(1000), create_ts varchar(32), modify_ts varchar(32));
+create table R_USER_PASSWORD (user_id bigint not null, rcat_password varchar(250) not null, pass_expiry_ts varchar(32) not null, create_ts varchar(32), modify_ts varchar(32));
+create table R_RESC_MAIN (resc_id bigint not null, resc_name varchar(250) not null, zone_name varchar(250) not null, resc_type_name varchar(250) not null, resc_class_name varchar(250) not null, resc_net varchar(250) not null, resc_def_path varchar(1000) not null, free_space varchar(250), free_space_ts varchar(32), resc_info varchar(1000), r_comment varchar(1000), resc_status varchar(32), create_ts varchar(32), modify_ts varchar(32), resc_children varchar(1000), resc_context varchar(1000), resc_parent varchar(1000), resc_objcount bigint DEFAULT 0, resc_parent_context varchar(4000));
+create table R_COLL_MAIN (coll_id bigint not null, parent_coll_name varchar(2700) not null, coll_name varchar(2700) not null, coll_owner_name varchar(250) not null, coll_owner_zone varchar(250) not null, coll_map_id bigint DEFAULT 0, coll_inheritance varchar(1000), coll_type varchar(250) DEFAULT '0', coll_info1 varchar(2700) DEFAULT '0', coll_info2 varchar(2700) DEFAULT '0', coll_expiry_ts varchar(32), r_comment varchar(1000), create_ts varchar(32), modify_ts varchar(32));
+create table R_DATA_MAIN (data_id bigint not null, coll_id bigint not null, data_name varchar(1000) not null, data_repl_num INTEGER not null, data_version varchar(250) DEFAULT '0', data_type_name varchar(250) not null, data_size bigint not null, resc_group_name varchar(250), resc_name varchar(250) not null, data_path varchar(2700) not null, data_owner_name varchar(250) not null, data_owner_zone varchar(250) not null, data_is_dirty INTEGER DEFAULT 0, data_status varchar(250), data_checksum varchar(1000), data_expiry_ts varchar(32), data_map_id bigint DEFAULT 0, data_mode varchar(32), r_comment varchar(1000), create_ts varchar(32), modify_ts varchar(32), resc_hier varchar(1000), resc_id bigint);
+create table R_META_MAIN (meta_id bigint not null, meta_namespace varchar(250), meta_attr_name varchar(2700) not null, meta_attr_value varchar(2700) not null, meta_attr_unit varchar(250), r_comment varchar(1000), create_ts varchar(32), modify_ts varchar(32));
+create table R_OBJT_METAMAP (object_id bigint not null, meta_id bigint not null, create_ts varchar(32), modify_ts varchar(32));
+create table R_OBJT_ACCESS (object_id bigint not null, user_id bigint not null, access_type_id bigint not null, create_ts varchar(32), modify_ts varchar(32));
+create table R_RULE_MAIN (rule_id bigint not null, rule_version varchar(250) DEFAULT '0', rule_base_name varchar(250) not null, rule_name varchar(2700) not null, rule_event varchar(2700) not null, rule_condition varchar(2700), rule_body varchar(2700) not null, rule_recovery varchar(2700) not null, rule_status bigint DEFAULT 1, rule_owner_name varchar(250) not null, rule_owner_zone varchar(250) not null, rule_descr_1 varchar(2700), rule_descr_2 varchar(2700), input_params varchar(2700), output_params varchar(2700), dollar_vars varchar(2700), icss varchar(2700), r_comment varchar(1000), create_ts varchar(32), modify_ts varchar(32));
+create table R_QUOTA_MAIN (user_id bigint, resc_id bigint, quota_limit bigint, quota_over bigint, modify_ts varchar(32));
+create table R_QUOTA_USAGE (user_id bigint, resc_id bigint, quota_usage bigint, modify_ts varchar(32));
+create unique index idx_zone_main1 on R_ZONE_MAIN (zone_id);
+create unique index idx_user_main1 on R_USER_MAIN (user_id);
+create unique index idx_resc_main1 on R_RESC_MAIN (resc_id);
+create unique index idx_coll_main1 on R_COLL_MAIN (coll_id);
+create unique index idx_coll_main3 on R_COLL_MAIN (coll_name);
+create index idx_data_main1 on R_DATA_MAIN (data_id);
+create unique index idx_data_main2 on R_DATA_MAIN (coll_id,data_name,data_repl_num,data_version);
+create index idx_data_main3 on R_DATA_MAIN (coll_id);
+create index idx_data_main6 on R_DATA_MAIN (data_path);
+create unique index idx_meta_main1 on R_META_MAIN (meta_id);
+create unique index idx_objt_metamap1 on R_OBJT_METAMAP (object_id,meta_id);
+create unique index idx_objt_access1 on R_OBJT_ACCESS (object_id,user_id);
@@ -0,0 +1,471 @@
+'''Offline snapshots of the catalog, so that the tests can be run many times without loading the
+database.
+
+A snapshot contains the columns of the catalog tables that the tests need. They are exported with
+COPY in a single read-only transaction, and stored column by column: integer columns as arrays of
+64-bit integers, and text columns as an array of end offsets followed by the concatenated UTF-8
+values. The positions of the columns are stored in a JSON footer. Snapshots are memory-mapped when
+they are read, so that only the columns that a test uses are loaded, a batch at a time.'''
+from array import array
+import bisect
+import itertools
+import json
+import mmap
+import os
+import re
+import shutil
+import struct
+import sys
+import tempfile
+import time
+
+MAGIC = b'ICATSNP1'
+
+# Number of bytes of COPY output that are converted to columns at a time
+COPY_BUFFER_SIZE = 4 * 1024 * 1024
+
+# Maximum number of rows of a key column that is loaded into a set for lookups. Larger key columns
+# are searched in the snapshot file, which needs less memory but is slower.
+LOOKUP_SET_MAX_ROWS = 1000000
+
+# Columns of each table, as (column, type, SQL expression) tuples. Types are 'int' and 'text';
+# 'condition' columns are conditions that are stored as 0 or 1. Tables with a key column are
+# exported in the order of the key, so that values can be looked up without an index.
+SNAPSHOT_TABLES = {
+    'r_data_main': {
+        'key': 'data_id',
+        'columns': [
+            ('data_id', 'int', 'data_id'),
+            ('coll_id', 'int', 'coll_id'),
+            ('data_name', 'text', 'data_name'),
+            ('resc_id', 'int', 'resc_id'),
+            ('data_path', 'text', 'data_path'),
+            ('create_ts', 'text', 'create_ts'),
+            ('modify_ts', 'text', 'modify_ts')]},
+    'r_coll_main': {
+        'key': 'coll_id',
+        'columns': [
+            ('coll_id', 'int', 'coll_id'),
+            ('coll_name', 'text', 'coll_name'),
+            ('parent_coll_name', 'text', 'parent_coll_name'),
+            ('create_ts', 'text', 'create_ts'),
+            ('modify_ts', 'text', 'modify_ts')]},
+    'r_objt_access': {
+        'columns': [
+            ('object_id', 'int', 'object_id'),
+            ('user_id', 'int', 'user_id'),
+            ('create_ts', 'text', 'create_ts'),
+            ('modify_ts', 'text', 'modify_ts')]},
+    'r_objt_metamap': {
+        'columns': [
+            ('object_id', 'int', 'object_id'),
+            ('meta_id', 'int', 'meta_id'),
+            ('create_ts', 'text', 'create_ts'),
+            ('modify_ts', 'text', 'modify_ts')]},
+    'r_meta_main': {
+        'key': 'meta_id',
+        'columns': [
+            ('meta_id', 'int', 'meta_id')]},
+    'r_resc_main': {
+        'key': 'resc_id',
+        'columns': [
+            ('resc_id', 'int', 'resc_id'),
+            ('resc_name', 'text', 'resc_name'),
+            ('resc_type_name', 'text', 'resc_type_name'),
+            ('resc_def_path', 'text', 'resc_def_path'),
+            ('create_ts', 'text', 'create_ts'),
+            ('modify_ts', 'text', 'modify_ts'),
+            # Condition and column of the parent resource check of the referential integrity test
+            ("r_resc_main.resc_parent <> ''", 'condition', "r_resc_main.resc_parent <> ''"),
+            ("CAST(NULLIF(r_resc_main.resc_parent, '') AS bigint)", 'int',
+             "CAST(NULLIF(r_resc_main.resc_parent, '') AS bigint)")]},
+    'r_rule_main': {
+        'columns': [
+            ('rule_id', 'int', 'rule_id'),
+            ('create_ts', 'text', 'create_ts'),
+            ('modify_ts', 'text', 'modify_ts')]},
+    'r_user_main': {
+        'key': 'user_id',
+        'columns': [
+            ('user_id', 'int', 'user_id'),
+            ('user_name', 'text', 'user_name'),
+            ('zone_name', 'text', 'zone_name')]},
+    'r_zone_main': {
+        'columns': [
+            ('zone_id', 'int', 'zone_id'),
+            ('zone_name', 'text', 'zone_name'),
+            ('create_ts', 'text', 'create_ts'),
+            ('modify_ts', 'text', 'modify_ts')]},
+    'r_quota_main': {
+        'columns': [
+            ('user_id', 'int', 'user_id'),
+            ('resc_id', 'int', 'resc_id')]},
+    'r_quota_usage': {
+        'columns': [
+            ('user_id', 'int', 'user_id'),
+            ('resc_id', 'int', 'resc_id')]},
+    'r_user_password': {
+        'columns': [
+            ('user_id', 'int', 'user_id')]},
+    'pg_indexes': {
+        'condition': "schemaname = 'public'",
+        'columns': [
+            ('indexname', 'text', 'indexname')]}}
+
+# Escape sequences of the COPY text format
+_COPY_ESCAPE_PATTERN = re.compile(rb'\\(.)', re.DOTALL)
+_COPY_ESCAPES = {b'b': b'\b', b'f': b'\f', b'n': b'\n', b'r': b'\r', b't': b'\t', b'v': b'\v'}
+_COPY_NULL = b'\\N'
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def _contains_sorted(values, value):
+    position = bisect.bisect_left(values, value)
+    return position < len(values) and values[position] == value
+
+
+def _unescape(field):
+    return _COPY_ESCAPE_PATTERN.sub(lambda match: _COPY_ESCAPES.get(match.group(1), match.group(1)), field)
+
+
+class _IntColumnWriter(object):
+
+    def __init__(self, directory):
+        self.values = tempfile.TemporaryFile(dir=directory)
+        self.nulls = array('q')
+        self.rows = 0
+
+    def extend(self, fields):
+        values = array('q')
+        for row, field in enumerate(fields, self.rows):
+            if field == _COPY_NULL:
+                self.nulls.append(row)
+                values.append(0)
+            else:
+                values.append(int(field))
+        values.tofile(self.values)
+        self.rows += len(values)
+
+    def get_sections(self):
+        return [('values', self.values), ('nulls', self.nulls)]
+
+
+class _TextColumnWriter(object):
+
+    def __init__(self, directory):
+        self.offsets = tempfile.TemporaryFile(dir=directory)
+        self.data = tempfile.TemporaryFile(dir=directory)
+        self.nulls = array('q')
+        self.rows = 0
+        self.length = 0
+        array('q', [0]).tofile(self.offsets)
+
+    def extend(self, fields):
+        values = []
+        for row, field in enumerate(fields, self.rows):
+            if field == _COPY_NULL:
+                self.nulls.append(row)
+                field = b''
+            elif b'\\' in field:
+                field = _unescape(field)
+            values.append(field)
+        offsets = array('q', (self.length + offset for offset in itertools.accumulate(map(len, values))))
+        offsets.tofile(self.offsets)
+        self.data.write(b''.join(values))
+        if len(offsets) > 0:
+            self.length = offsets[-1]
+        self.rows += len(values)
+
+    def get_sections(self):
+        return [('offsets', self.offsets), ('data', self.data), ('nulls', self.nulls)]
+
+
+class _CopyTableWriter(object):
+    '''File-like object that receives the COPY output of a table and converts it to columns.'''
+
+    def __init__(self, column_types, directory):
+        self.columns = [_TextColumnWriter(directory) if column_type == 'text' else _IntColumnWriter(directory)
+                        for column_type in column_types]
+        self.buffer = []
+        self.buffer_size = 0
+
+    def write(self, data):
+        self.buffer.append(data)
+        self.buffer_size += len(data)
+        if self.buffer_size >= COPY_BUFFER_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.buffer_size == 0:
+            return
+        # COPY passes complete lines, which end with a newline
+        lines = b''.join(self.buffer)[:-1].split(b'\n')
+        self.buffer = []
+        self.buffer_size = 0
+        for column, fields in zip(self.columns, zip(*(line.split(b'\t') for line in lines))):
+            column.extend(fields)
+
+
+class _SnapshotFileWriter(object):
+
+    def __init__(self, filename):
+        self.file = open(filename, 'wb')
+        self.file.write(MAGIC)
+
+    def add_section(self, source):
+        '''Appends a temporary file or an array, aligned to 8 bytes, and returns its position.'''
+        padding = -self.file.tell() % 8
+        self.file.write(b'\0' * padding)
+        offset = self.file.tell()
+        if isinstance(source, array):
+            source.tofile(self.file)
+        else:
+            source.seek(0)
+            shutil.copyfileobj(source, self.file)
+            source.close()
+        return [offset, self.file.tell() - offset]
+
+    def close(self, footer):
+        footer_data = json.dumps(footer).encode()
+        self.file.write(footer_data)
+        self.file.write(struct.pack('<Q', len(footer_data)))
+        self.file.write(MAGIC)
+        self.file.close()
+
+
+def _get_export_query(table, table_spec):
+    select_list = []
+    for _, column_type, expression in table_spec['columns']:
+        if column_type == 'condition':
+            select_list.append("CAST(( {} ) IS TRUE AS integer)".format(expression))
+        else:
+            select_list.append(expression)
+    query = "SELECT {} FROM {}".format(",".join(select_list), table)
+    if 'condition' in table_spec:
+        query += " WHERE {}".format(table_spec['condition'])
+    if 'key' in table_spec:
+        query += " ORDER BY {}".format(table_spec['key'])
+    return query
+
+
+def export_snapshot(connection, filename, print_progress=None):
+    '''Exports the catalog tables to a snapshot file. All tables are read in one transaction, so that
+       the snapshot is consistent.'''
+    connection.set_session(isolation_level='REPEATABLE READ', readonly=True)
+    connection.set_client_encoding('UTF8')
+    directory = os.path.dirname(os.path.abspath(filename))
+    temp_filename = filename + ".tmp"
+    snapshot_file = _SnapshotFileWriter(temp_filename)
+    footer = {'exported_at': time.time(), 'byteorder': sys.byteorder, 'tables': {}}
+    try:
+        cursor = connection.cursor()
+        for table, table_spec in SNAPSHOT_TABLES.items():
+            if print_progress is not None:
+                print_progress("Exporting {}".format(table))
+            column_types = ['text' if column_type == 'text' else 'int' for _, column_type, _ in table_spec['columns']]
+            table_writer = _CopyTableWriter(column_types, directory)
+            cursor.copy_expert("COPY ( {} ) TO STDOUT".format(_get_export_query(table, table_spec)), table_writer)
+            table_writer.flush()
+
+            table_footer = {'key': table_spec.get('key'), 'rows': table_writer.columns[0].rows, 'columns': {}}
+            for (column, _, _), column_type, column_writer in zip(table_spec['columns'], column_types,
+                                                                   table_writer.columns):
+                table_footer['columns'][column] = {'type': column_type}
+                for section, source in column_writer.get_sections():
+                    table_footer['columns'][column][section] = snapshot_file.add_section(source)
+            footer['tables'][table] = table_footer
+        cursor.close()
+        connection.rollback()
+        snapshot_file.close(footer)
+        os.replace(temp_filename, filename)
+    except BaseException:
+        snapshot_file.file.close()
+        os.remove(temp_filename)
+        raise
+
+
+class _IntColumn(object):
+
+    def __init__(self, values, nulls):
+        self.values = values
+        self.nulls = nulls
+
+    def get(self, row):
+        if _contains_sorted(self.nulls, row):
+            return None
+        return self.values[row]
+
+    def get_slice(self, start, end):
+        values = self.values[start:end].tolist()
+        for row in self.nulls[bisect.bisect_left(self.nulls, start):bisect.bisect_left(self.nulls, end)]:
+            values[row - start] = None
+        return values
+
+
+class _TextColumn(object):
+
+    def __init__(self, offsets, data, nulls):
+        self.offsets = offsets
+        self.data = data
+        self.nulls = nulls
+
+    def get(self, row):
+        if _contains_sorted(self.nulls, row):
+            return None
+        return str(self.data[self.offsets[row]:self.offsets[row + 1]], 'utf-8', 'replace')
+
+    def get_slice(self, start, end):
+        offsets = self.offsets[start:end + 1].tolist()
+        base = offsets[0]
+        data = bytes(self.data[base:offsets[-1]])
+        values = [str(data[value_start - base:value_end - base], 'utf-8', 'replace')
+                  for value_start, value_end in zip(offsets, offsets[1:])]
+        for row in self.nulls[bisect.bisect_left(self.nulls, start):bisect.bisect_left(self.nulls, end)]:
+            values[row - start] = None
+        return values
+
+
+class _SortedColumnLookup(object):
+    '''Membership test on a column that is sorted, by binary search.'''
+
+    def __init__(self, column):
+        self.column = column
+
+    def __contains__(self, value):
+        return _contains_sorted(self.column.values, value)
+
+
+class Snapshot(object):
+    '''Read access to a snapshot file. Detectors use a snapshot in place of a database connection.'''
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as snapshot_file:
+            self.mmap = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.mmap) < 2 * len(MAGIC) + 8 or self.mmap[:len(MAGIC)] != MAGIC or \
+                self.mmap[-len(MAGIC):] != MAGIC:
+            raise SnapshotError("{} is not a complete snapshot file".format(filename))
+        footer_end = len(self.mmap) - len(MAGIC) - 8
+        footer_length = struct.unpack('<Q', self.mmap[footer_end:footer_end + 8])[0]
+        footer = json.loads(self.mmap[footer_end - footer_length:footer_end].decode())
+        if footer['byteorder'] != sys.byteorder:
+            raise SnapshotError("{} has been exported on a system with another byte order".format(filename))
+        self.exported_at = footer['exported_at']
+        self.tables = footer['tables']
+        self.view = memoryview(self.mmap)
+        self.columns = {}
+        self.lookups = {}
+
+    def _get_section(self, section, item_format='q'):
+        offset, length = section
+        return self.view[offset:offset + length].cast(item_format)
+
+    def get_row_count(self, table):
+        return self.tables[table]['rows']
+
+    def get_column(self, table, column):
+        if (table, column) not in self.columns:
+            if table not in self.tables or column not in self.tables[table]['columns']:
+                raise SnapshotError("Column {} of table {} is not in the snapshot".format(column, table))
+            sections = self.tables[table]['columns'][column]
+            if sections['type'] == 'text':
+                self.columns[(table, column)] = _TextColumn(
+                    self._get_section(sections['offsets']), self._get_section(sections['data'], 'B'),
+                    self._get_section(sections['nulls']))
+            else:
+                self.columns[(table, column)] = _IntColumn(
+                    self._get_section(sections['values']), self._get_section(sections['nulls']))
+        return self.columns[(table, column)]
+
+    def scan_columns(self, table, columns, batch_size):
+        '''Yields batches of at most batch_size rows of a table, as a list of values per column.'''
+        table_columns = [self.get_column(table, column) for column in columns]
+        rows = self.get_row_count(table)
+        for start in range(0, rows, batch_size):
+            end = min(start + batch_size, rows)
+            yield [column.get_slice(start, end) for column in table_columns]
+
+    def scan(self, table, columns, batch_size):
+        '''Yields the rows of a table as lists of tuples of at most batch_size rows.'''
+        for column_values in self.scan_columns(table, columns, batch_size):
+            yield list(zip(*column_values))
+
+    def get_lookup(self, table, column):
+        '''Returns a container of the values of a column, for membership tests.'''
+        if (table, column) not in self.lookups:
+            if self.tables[table]['key'] == column and self.get_row_count(table) > LOOKUP_SET_MAX_ROWS:
+                self.lookups[(table, column)] = _SortedColumnLookup(self.get_column(table, column))
+            else:
+                values = set()
+                for rows in self.scan(table, [column], 100000):
+                    values.update(value for value, in rows)
+                values.discard(None)
+                self.lookups[(table, column)] = values
+        return self.lookups[(table, column)]
+
+    def find_row(self, table, key):
+        '''Returns the position of the first row of a table with a key value, or None if there is no such row.'''
+        values = self.get_column(table, self.tables[table]['key']).values
+        position = bisect.bisect_left(values, key)
+        if position < len(values) and values[position] == key:
+            return position
+        return None
+
+    def get_rows_by_key(self, table, keys, columns):
+        '''Returns the rows of a table with the given key values, as a dictionary with a list of rows
+           per key.'''
+        key_values = self.get_column(table, self.tables[table]['key']).values
+        table_columns = [self.get_column(table, column) for column in columns]
+        rows = {}
+        for key in keys:
+            position = bisect.bisect_left(key_values, key)
+            while position < len(key_values) and key_values[position] == key:
+                rows.setdefault(key, []).append(tuple(column.get(position) for column in table_columns))
+                position += 1
+        return rows
+
+    def get_resource_name_dict(self):
+        return dict(row for rows in self.scan('r_resc_main', ['resc_id', 'resc_name'], 100000) for row in rows)
+
+    def get_resource_vault_path_dict(self):
+        return {resc_id: resc_def_path
+                for rows in self.scan('r_resc_main', ['resc_id', 'resc_type_name', 'resc_def_path'], 100000)
+                for resc_id, resc_type_name, resc_def_path in rows
+                if resc_type_name in ('unixfilesystem', 'unix file system')}
+
+    def get_coll_path_dict(self, batch_size):
+        return dict(row for rows in self.scan('r_coll_main', ['coll_id', 'coll_name'], batch_size) for row in rows)
+
+
+class SnapshotNameResolver(object):
+    '''Resolves ids to names with the sorted key columns of a snapshot. It has the interface of
+       NameResolver, but does not need a cache.'''
+
+    def get_collection_names(self, snapshot, coll_ids):
+        coll_names = {}
+        for coll_id in coll_ids:
+            row = snapshot.find_row('r_coll_main', coll_id)
+            coll_names[coll_id] = None if row is None else snapshot.get_column('r_coll_main', 'coll_name').get(row)
+        return coll_names
+
+    def get_dataobject_names(self, snapshot, data_ids):
+        data_object_names = {}
+        for data_id in data_ids:
+            data_object_names[data_id] = None
+            row = snapshot.find_row('r_data_main', data_id)
+            if row is None:
+                continue
+            coll_id = snapshot.get_column('r_data_main', 'coll_id').get(row)
+            coll_name = self.get_collection_names(snapshot, [coll_id])[coll_id]
+            if coll_name is not None:
+                data_object_names[data_id] = coll_name + "/" + snapshot.get_column('r_data_main', 'data_name').get(row)
+        return data_object_names
+
+    def prefetch_collection_names(self, snapshot, coll_ids):
+        pass
+
+    def get_stats(self):
+        return None
@@ -0,0 +1,148 @@
+'''Support for chunked runs, which check r_data_main in consecutive ranges of data_id values. Every
+chunk is checked in a separate short transaction, so that a run does not keep a snapshot open for
+hours, and progress is saved in a checkpoint file after each chunk, so that an interrupted run can
+be resumed.
+
+Tests that check r_data_main together with other tables, such as the names test, first check the
+other tables in a transaction of their own, and then r_data_main in chunks. Tests that cannot be split
+by data_id are run as a whole, each in a separate transaction. Issues of a chunk that was interrupted
+are reported again when the run is resumed.'''
+import json
+import os
+import time
+
+# Default maximum number of r_data_main rows per chunk
+DEFAULT_CHUNK_SIZE = 100000
+
+# Options that affect which issues are found. A checkpoint can only be resumed with the same values.
+CHECKPOINT_ARGUMENTS = ['run_test', 'data_object_prefix', 'min_replicas', 'engine']
+
+
+class CheckpointMismatchError(Exception):
+    pass
+
+
+class Checkpoint(object):
+    '''Progress of a chunked run: the tests that have completed, and for tests that are in progress
+       the last data_id that has been checked, and whether the tables other than r_data_main have
+       been checked.'''
+
+    def __init__(self, checkpoint_file, args, resume):
+        self.checkpoint_file = checkpoint_file
+        self.arguments = {argument: self._get_argument_value(args, argument) for argument in CHECKPOINT_ARGUMENTS}
+        self.tests = {}
+        self.issue_found = False
+        if resume and os.path.isfile(checkpoint_file):
+            with open(checkpoint_file) as checkpointfile:
+                checkpoint = json.load(checkpointfile)
+            if checkpoint['arguments'] != self.arguments:
+                raise CheckpointMismatchError(
+                    "Checkpoint file {} was written by a run with other options: {}".format(
+                        checkpoint_file, checkpoint['arguments']))
+            self.tests = checkpoint['tests']
+            self.issue_found = checkpoint['issue_found']
+
+    def _get_argument_value(self, args, argument):
+        value = getattr(args, argument)
+        return None if value is None else str(value)
+
+    def is_completed(self, test):
+        return self.tests.get(test, {}).get('completed', False)
+
+    def get_last_data_id(self, test):
+        return self.tests.get(test, {}).get('last_data_id')
+
+    def are_other_tables_completed(self, test):
+        return self.tests.get(test, {}).get('other_tables_completed', False)
+
+    def record_progress(self, test, last_data_id=None, completed=False, issue_found=False,
+                        other_tables_completed=False):
+        '''Records that a test has been checked up to and including last_data_id, or completely,
+           and saves the checkpoint. Whether the tables other than r_data_main have been checked is
+           kept once it has been recorded.'''
+        self.tests[test] = {'last_data_id': last_data_id, 'completed': completed,
+                            'other_tables_completed': other_tables_completed or self.are_other_tables_completed(test)}
+        if issue_found:
+            self.issue_found = True
+        self.save()
+
+    def save(self):
+        temp_filename = self.checkpoint_file + ".tmp"
+        with open(temp_filename, "w") as checkpointfile:
+            json.dump({'arguments': self.arguments, 'tests': self.tests, 'issue_found': self.issue_found},
+                      checkpointfile, indent=2)
+        os.replace(temp_filename, self.checkpoint_file)
+
+
+def get_chunk_end(connection, last_data_id, chunk_size):
+    '''Returns the last data_id of the chunk of at most chunk_size rows that follows last_data_id,
+       or None if there are no rows left. The chunk is found by walking the primary key index,
+       so that no rows need to be skipped.'''
+    cursor = connection.cursor()
+    if last_data_id is None:
+        cursor.execute("""SELECT max(data_id) FROM
+                          ( SELECT data_id FROM r_data_main ORDER BY data_id LIMIT %s ) AS chunk""",
+                       (chunk_size,))
+    else:
+        cursor.execute("""SELECT max(data_id) FROM
+                          ( SELECT data_id FROM r_data_main WHERE data_id > %s ORDER BY data_id LIMIT %s ) AS chunk""",
+                       (last_data_id, chunk_size))
+    chunk_end = cursor.fetchone()[0]
+    cursor.close()
+    return chunk_end
+
+
+def run_chunked(detector, checkpoint, deadline=None):
+    '''Runs a detector chunk by chunk, starting after the last chunk in the checkpoint. Detectors
+       that cannot be split by data_id are run as a whole. Stops before the next chunk once the
+       deadline (a time.time() value) has passed. Returns whether an issue has been found, and
+       whether the test has been completed.'''
+    connection = detector.connection
+    test = detector.get_name()
+    issue_found = False
+
+    if detector.shard_by != 'data_id' and not detector.chunk_data_objects:
+        if deadline is not None and time.time() >= deadline:
+            return issue_found, False
+        issue_found = detector.run()
+        connection.commit()
+        checkpoint.record_progress(test, completed=True, issue_found=issue_found)
+        return issue_found, True
+
+    if detector.chunk_data_objects:
+        if not checkpoint.are_other_tables_completed(test):
+            if deadline is not None and time.time() >= deadline:
+                return issue_found, False
+            if detector.args.v:
+                detector.print_progress("Checking tables other than r_data_main for test {}".format(test))
+            detector.checked_tables = 'other'
+            issue_found = detector.run()
+            connection.commit()
+            checkpoint.record_progress(test, issue_found=issue_found, other_tables_completed=True)
+        detector.checked_tables = 'r_data_main'
+
+    while True:
+        if deadline is not None and time.time() >= deadline:
+            return issue_found, False
+        last_data_id = checkpoint.get_last_data_id(test)
+        chunk_end = get_chunk_end(connection, last_data_id, detector.args.chunk_size)
+        if chunk_end is None:
+            break
+        if last_data_id is None:
+            detector.shard_condition = "r_data_main.data_id <= {}".format(int(chunk_end))
+        else:
+            detector.shard_condition = "r_data_main.data_id > {} AND r_data_main.data_id <= {}".format(
+                int(last_data_id), int(chunk_end))
+        if detector.args.v:
+            detector.print_progress("Checking data objects up to data_id {} for test {}".format(chunk_end, test))
+        chunk_issue_found = detector.run()
+        if chunk_issue_found:
+            issue_found = True
+        # End the transaction, so that the database can clean up rows that have been deleted since
+        connection.commit()
+        checkpoint.record_progress(test, last_data_id=chunk_end, issue_found=chunk_issue_found)
+
+    detector.shard_condition = None
+    detector.checked_tables = None
+    checkpoint.record_progress(test, last_data_id=checkpoint.get_last_data_id(test), completed=True)
+    return issue_found, True
@@ -0,0 +1,150 @@
+'''Runs independent queries concurrently over a small number of asynchronous database connections,
+using asyncio. The rows of each query are passed on while the query runs, so that the total time is
+about the time of the slowest query rather than the sum of all queries.
+
+Asynchronous connections are always in autocommit mode and do not support named cursors, so every
+query runs in its own transaction with an explicitly declared cursor, from which fetch_size rows are
+fetched at a time. All transactions import the snapshot of the connection of the test, so that the
+queries see the same data as the other queries of the test.'''
+from icat_tools import utils
+import asyncio
+import psycopg2
+import psycopg2.extensions
+import time
+
+
+async def _wait_ready(connection):
+    '''Polls an asynchronous connection until its connection attempt or query has completed.
+       Errors of the query are raised here.'''
+    loop = asyncio.get_event_loop()
+    while True:
+        state = connection.poll()
+        if state == psycopg2.extensions.POLL_OK:
+            return
+        ready = loop.create_future()
+        fileno = connection.fileno()
+        if state == psycopg2.extensions.POLL_READ:
+            loop.add_reader(fileno, ready.set_result, None)
+            remove_watcher = loop.remove_reader
+        elif state == psycopg2.extensions.POLL_WRITE:
+            loop.add_writer(fileno, ready.set_result, None)
+            remove_watcher = loop.remove_writer
+        else:
+            raise psycopg2.OperationalError("Unexpected state of asynchronous connection: {}".format(state))
+        try:
+            await ready
+        finally:
+            remove_watcher(fileno)
+
+
+class ConcurrentQueryRunner(object):
+
+    def __init__(self, config, max_connections, fetch_size=utils.DEFAULT_FETCH_SIZE, snapshot_id=None):
+        '''snapshot_id is the id of a snapshot that has been exported with pg_export_snapshot(), which
+           all queries use, or None if every query uses its own snapshot.'''
+        self.config = config
+        self.max_connections = max_connections
+        self.fetch_size = fetch_size
+        self.snapshot_id = snapshot_id
+
+    async def _execute(self, connection, cursor, statement, parameters=None):
+        cursor.execute(statement, parameters)
+        await _wait_ready(connection)
+
+    async def _begin(self, connection, cursor):
+        await self._execute(connection, cursor, "BEGIN ISOLATION LEVEL REPEATABLE READ READ ONLY")
+        if self.snapshot_id is not None:
+            await self._execute(connection, cursor, "SET TRANSACTION SNAPSHOT %s", (self.snapshot_id,))
+
+    async def _run_query(self, idle_connections, key, alternatives, output_rows, skip_repeated_rows):
+        '''Runs the first of the alternative queries, and passes its rows to output_rows in batches.
+           If it fails because of invalid data, such as a value that cannot be cast, the next
+           alternative is run instead, provided that the failed alternative has not passed on any rows
+           or that output_rows skips rows that have already been passed on. Returns the key, the number
+           of rows, the alternative, the time spent waiting for the database and the error if all
+           alternatives that could be run have failed, otherwise None.'''
+        connection = await idle_connections.get()
+        try:
+            duration = 0.0
+            for alternative, query in enumerate(alternatives):
+                cursor = connection.cursor()
+                number_rows = 0
+                try:
+                    start = time.perf_counter()
+                    await self._begin(connection, cursor)
+                    await self._execute(connection, cursor, "DECLARE query_cursor NO SCROLL CURSOR FOR " + query)
+                    while True:
+                        await self._execute(connection, cursor, "FETCH {} FROM query_cursor".format(self.fetch_size))
+                        rows = cursor.fetchall()
+                        duration += time.perf_counter() - start
+                        number_rows += len(rows)
+                        if len(rows) > 0:
+                            output_rows(key, rows, alternative)
+                        if len(rows) < self.fetch_size:
+                            break
+                        start = time.perf_counter()
+                    await self._execute(connection, cursor, "COMMIT")
+                    return key, number_rows, alternative, duration, None
+                except psycopg2.DataError as error:
+                    duration += time.perf_counter() - start
+                    await self._execute(connection, cursor, "ROLLBACK")
+                    if alternative == len(alternatives) - 1 or (number_rows > 0 and not skip_repeated_rows):
+                        return key, number_rows, alternative, duration, error
+                finally:
+                    cursor.close()
+        finally:
+            idle_connections.put_nowait(connection)
+
+    async def _run(self, queries, output_rows, query_completed, query_failed, skip_repeated_rows):
+        connections = []
+        tasks = []
+        try:
+            for _ in range(min(self.max_connections, len(queries))):
+                connections.append(utils.get_async_connection(self.config))
+            await asyncio.gather(*[_wait_ready(connection) for connection in connections])
+            idle_connections = asyncio.Queue()
+            for connection in connections:
+                idle_connections.put_nowait(connection)
+            tasks = [asyncio.ensure_future(self._run_query(idle_connections, key, alternatives, output_rows,
+                                                           skip_repeated_rows))
+                     for key, alternatives in queries]
+            for task in asyncio.as_completed(tasks):
+                key, number_rows, alternative, duration, error = await task
+                if error is None:
+                    query_completed(key, number_rows, alternative, duration)
+                else:
+                    query_failed(key, error, duration)
+        finally:
+            # Stop the queries that are still running, e.g. when another query has failed
+            for task in tasks:
+                task.cancel()
+            for connection in connections:
+                if connection.isexecuting():
+                    connection.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for connection in connections:
+                connection.close()
+
+    def run(self, queries, output_rows, query_completed, query_failed, skip_repeated_rows=False):
+        '''Runs queries, which is a list of (key, alternative queries) tuples. While the queries run,
+           output_rows(key, rows, alternative) is called for every batch of rows, where alternative is
+           the index of the alternative query that returned the rows. Batches of different queries can
+           alternate. When a query has completed, query_completed(key, number_rows, alternative, duration)
+           is called. When a query has failed because of invalid data, query_failed(key, error, duration)
+           is called, and the other queries go on. Set skip_repeated_rows if output_rows skips rows of an
+           alternative that a failed alternative has already passed on, so that a query can also fall back
+           to the next alternative after rows of the failed one have been passed on.'''
+        loop = asyncio.new_event_loop()
+        run_task = loop.create_task(self._run(queries, output_rows, query_completed, query_failed, skip_repeated_rows))
+        try:
+            loop.run_until_complete(run_task)
+        except BaseException:
+            # When the user interrupts the script, let the task stop the queries and close the connections
+            run_task.cancel()
+            try:
+                loop.run_until_complete(run_task)
+            except BaseException:
+                pass
+            raise
+        finally:
+            loop.close()
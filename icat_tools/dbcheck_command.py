@@ -1,7 +1,13 @@
-from argparse import ArgumentParser, FileType
+from argparse import ArgumentParser, ArgumentTypeError, FileType
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
-from icat_tools import utils
-from icat_tools.dbcheck_outputprocessors import CheckOutputProcessorCSV, CheckOutputProcessorHuman
+from icat_tools import catalog_snapshot, chunking, duplicate_finder, metrics, name_resolver, sampling, sharding, utils, vectorized
+from icat_tools.detectors.detector import RunContext
+from icat_tools.explain import QueryExplainer
+from icat_tools.incremental import IncrementalState
+from icat_tools.issue_store import IssueStore
+from icat_tools.scan_pipeline import ScanPipeline, SnapshotScanPipeline
+from icat_tools.dbcheck_outputprocessors import CheckOutputProcessorCSV, CheckOutputProcessorHuman, CheckOutputProcessorJSONL, SynchronizedOutputProcessor
 from icat_tools.detectors.hardlink_detector import HardlinkDetector
 from icat_tools.detectors.minreplicaissue_detector import MinreplicaIssueDetector
 from icat_tools.detectors.nameissue_detector import NameIssueDetector
@@ -9,8 +15,18 @@ from icat_tools.detectors.pathinconsistency_detector import PathInconsistencyDet
 from icat_tools.detectors.refintegrityissue_detector import RefIntegrityIssueDetector
 from icat_tools.detectors.timestampissue_detector import TimestampIssueDetector
 from icat_tools.detectors.missingindex_detector import MissingIndexDetector
+import sqlite3
 import sys
+import time
 
+DETECTOR_CLASSES = [
+    PathInconsistencyDetector,
+    HardlinkDetector,
+    MinreplicaIssueDetector,
+    RefIntegrityIssueDetector,
+    TimestampIssueDetector,
+    NameIssueDetector,
+    MissingIndexDetector]
 
 class TestSubset(Enum):
     ref_integrity = 'ref_integrity'
@@ -25,14 +41,37 @@ class TestSubset(Enum):
     def __str__(self):
         return self.name
 
+class Engine(Enum):
+    client = 'client'
+    server = 'server'
+
+    def __str__(self):
+        return self.name
+
+class SampleMethod(Enum):
+    system = 'system'
+    bernoulli = 'bernoulli'
+
+    def __str__(self):
+        return self.name
+
+class ReportMode(Enum):
+    new = 'new'
+    resolved = 'resolved'
+    all = 'all'
+
+    def __str__(self):
+        return self.name
+
 class OutputMode(Enum):
     human = 'human'
     csv = 'csv'
+    jsonl = 'jsonl'
 
     def __str__(self):
         return self.name
 
-def get_arguments():
+def get_arguments(argv=None):
     desc = 'Performs a number of sanity checks on the iRODS ICAT database'
     parser = ArgumentParser(description=desc)
     parser.add_argument(
@@ -52,9 +91,9 @@ def get_arguments():
         help='Verbose mode')
     parser.add_argument(
         '-o','--output',
-        type=FileType('w'),
-        default=sys.stdout,
-        help='Output file (default: standard output)')
+        default='-',
+        help='Output file (default: standard output). JSON Lines output (-m jsonl) is compressed if the name of ' +
+             'the file ends with .gz (gzip) or .zst (zstd).')
     parser.add_argument(
         '--run-test',
         help='Test to run (default: all)',
@@ -66,11 +105,216 @@ def get_arguments():
         help='Minimum number of replicas that a dataobject must have (default: 1).',
         default=1,
         type=int)
+    parser.add_argument(
+        '--engine',
+        help='Where to process data for tests that support both options: "client" processes rows in the checker, ' +
+             '"server" lets the database aggregate them and only retrieves issues (default: depends on test).',
+        default=None,
+        type=Engine,
+        choices=list(Engine))
     parser.add_argument(
         '--data-object-prefix',
-        help='Only check data objects with a particular prefix. The referential integrity and hard links tests do not support this option yet, and will ignore it. ',
+        help='Only check data objects with a particular prefix. This option only limits checks of data objects; ' +
+             'checks of other objects, such as collections, are not affected by it.',
+        default=None)
+    parser.add_argument(
+        '--jobs',
+        help='Number of tests to run in parallel, each on its own database connection (default: 1).',
+        default=1,
+        type=int)
+    parser.add_argument(
+        '--incremental',
+        metavar='STATE_FILE',
+        help='Only check rows that have been created or modified since the last completed run of the test ' +
+             'with the same state file, for the timestamps, names and path consistency tests. The minimum ' +
+             'replicas test always checks all data objects, since removing a replica leaves no modified row.',
+        default=None)
+    parser.add_argument(
+        '--fetch-size',
+        help='Number of rows that are fetched from the database at a time. Results are kept on the database ' +
+             'server until they are fetched, so this limits the memory usage of the checker (default: {}).'.format(
+                 utils.DEFAULT_FETCH_SIZE),
+        default=utils.DEFAULT_FETCH_SIZE,
+        type=int)
+    parser.add_argument(
+        '--name-cache-size',
+        help='Maximum number of collection names and of data object names that are kept in memory for ' +
+             'reporting issues. The hit and miss counts of the caches are printed in verbose mode and included ' +
+             'in stats files (default: {}).'.format(name_resolver.DEFAULT_CACHE_SIZE),
+        default=name_resolver.DEFAULT_CACHE_SIZE,
+        type=int)
+    parser.add_argument(
+        '--timestamp-index-advice',
+        action='store_const',
+        const=True,
+        help='Report for each table of the timestamps test whether expression indexes on the timestamps ' +
+             'would speed up the test, with the statements to create them.')
+    parser.add_argument(
+        '--stats-file',
+        action='append',
+        help='Write runtime metrics of each test to a file: in the Prometheus textfile format if the name ' +
+             'ends with .prom, and as JSON otherwise. Can be specified more than once.',
+        default=[])
+    parser.add_argument(
+        '--shared-scan',
+        action='store_const',
+        const=True,
+        help='Let tests that check rows one by one (timestamps, names, path consistency, and with the client ' +
+             'engine also minimum replicas and hard links) share a single scan of each table.')
+    parser.add_argument(
+        '--shards',
+        help='Number of worker processes that each check a part of the data objects for the path consistency ' +
+             'and minimum replicas tests, or a part of the resources for the hard links test (default: 1).',
+        default=1,
+        type=int)
+    parser.add_argument(
+        '--checkpoint',
+        metavar='CHECKPOINT_FILE',
+        help='Check data objects in chunks, each in a separate short transaction, and save the progress in ' +
+             'this file after every chunk. The referential integrity, timestamps and names tests check their ' +
+             'other tables first, in a separate transaction; the hard links and missing indexes tests are run ' +
+             'as a whole. Cannot be combined with --jobs, --shards, --shared-scan, --incremental and ' +
+             '--timestamp-index-advice.',
+        default=None)
+    parser.add_argument(
+        '--chunk-size',
+        help='Maximum number of data object rows per chunk (default: {}).'.format(chunking.DEFAULT_CHUNK_SIZE),
+        default=chunking.DEFAULT_CHUNK_SIZE,
+        type=int)
+    parser.add_argument(
+        '--resume',
+        action='store_const',
+        const=True,
+        help='Continue the run that has been saved in the checkpoint file, rather than starting from the beginning.')
+    parser.add_argument(
+        '--time-budget',
+        metavar='SECONDS',
+        help='Stop before the next chunk or test once the tests have run for this number of seconds. The run ' +
+             'can be continued later with --resume.',
+        default=None,
+        type=float)
+    parser.add_argument(
+        '--concurrent-queries',
+        help='Number of database connections over which the referential integrity, timestamps and names ' +
+             '(server engine) tests send their queries concurrently, instead of one after another (default: 1).',
+        default=1,
+        type=int)
+    parser.add_argument(
+        '--snapshot',
+        metavar='SNAPSHOT_FILE',
+        help='Run the tests on a snapshot file that has been created with the export command, instead of on ' +
+             'the database. Cannot be combined with --data-object-prefix, --incremental, --checkpoint, --jobs, ' +
+             '--shards and --concurrent-queries.',
+        default=None)
+    parser.add_argument(
+        '--vectorized',
+        action='store_const',
+        const=True,
+        help='Process the rows of shared scans (--shared-scan or --snapshot) in batches with NumPy, for the ' +
+             'timestamps test, and with the client engine also the minimum replicas and hard links tests. ' +
+             'Needs the numpy module.')
+    parser.add_argument(
+        '--hardlinks-memory-limit',
+        metavar='MEGABYTES',
+        help='Memory that the hard links test (client engine) may use to index paths, per resource. Once the ' +
+             'limit is reached, the index is written to temporary files in sorted runs (default: {}).'.format(
+                 duplicate_finder.DEFAULT_MEMORY_LIMIT_MB),
+        default=duplicate_finder.DEFAULT_MEMORY_LIMIT_MB,
+        type=int)
+    parser.add_argument(
+        '--explain',
+        action='store_const',
+        const=True,
+        help='Do not run the tests, but let the database plan the queries that they would send, and report ' +
+             'the estimated number of rows, the estimated cost and the sequential scans of each query, per test ' +
+             'and in total. Cannot be combined with --snapshot, --shared-scan, --checkpoint and --shards.')
+    parser.add_argument(
+        '--sample',
+        metavar='PERCENT',
+        help='Only check a random sample of this percentage of the rows of each table, and estimate the number ' +
+             'of issues of each check in the whole table, with a 95%% confidence interval. This applies to the ' +
+             'referential integrity, timestamps, names and path consistency tests; other tests are skipped. ' +
+             'Cannot be combined with --snapshot, --shared-scan, --shards, --checkpoint, --incremental, ' +
+             '--concurrent-queries and --timestamp-index-advice.',
+        default=None,
+        type=float)
+    parser.add_argument(
+        '--sample-method',
+        help='How the sample is selected: "system" reads a random sample of the blocks of each table, which ' +
+             'is fast, "bernoulli" selects rows independently, which reads the whole table but gives more ' +
+             'reliable confidence intervals (default: system).',
+        default='system',
+        type=SampleMethod,
+        choices=list(SampleMethod))
+    parser.add_argument(
+        '--sample-seed',
+        help='Seed of the sample. Runs with the same seed check the same rows, as long as the tables have not ' +
+             'changed (default: {}).'.format(sampling.DEFAULT_SEED),
+        default=sampling.DEFAULT_SEED,
+        type=int)
+    parser.add_argument(
+        '--issue-store',
+        metavar='STORE_FILE',
+        help='Keep the issues that have been found in this SQLite database, so that later runs can report ' +
+             'only new or resolved issues. Cannot be combined with --shards, --checkpoint and --sample.',
         default=None)
-    args = parser.parse_args()
+    parser.add_argument(
+        '--report',
+        help='Issues to report with --issue-store: "new" reports issues that earlier runs have not found, ' +
+             '"resolved" reports issues that earlier runs have found, but this run does not, and "all" ' +
+             'reports all issues that this run finds (default: all).',
+        default='all',
+        type=ReportMode,
+        choices=list(ReportMode))
+    subparsers = parser.add_subparsers(dest='command', metavar='COMMAND')
+    export_parser = subparsers.add_parser(
+        'export',
+        help='Export the catalog tables to a snapshot file, which can be checked with --snapshot without ' +
+             'loading the database.')
+    export_parser.add_argument('snapshot_file', metavar='SNAPSHOT_FILE', help='Snapshot file to write')
+    args = parser.parse_args(argv)
+    # JSON Lines output is written in binary mode, since it can be compressed
+    binary_output = args.m.value == 'jsonl'
+    if args.output == '-':
+        args.output = sys.stdout.buffer if binary_output else sys.stdout
+    else:
+        try:
+            args.output = FileType('wb' if binary_output else 'w')(args.output)
+        except ArgumentTypeError as error:
+            parser.error("argument -o/--output: {}".format(error))
+    if args.checkpoint is None and (args.resume or args.time_budget is not None):
+        parser.error("--resume and --time-budget require --checkpoint")
+    if args.checkpoint is not None and (args.jobs > 1 or args.shards > 1 or args.shared_scan or
+                                        args.incremental is not None or args.timestamp_index_advice):
+        parser.error("--checkpoint cannot be combined with --jobs, --shards, --shared-scan, --incremental or " +
+                     "--timestamp-index-advice")
+    if args.snapshot is not None and (args.data_object_prefix is not None or args.incremental is not None or
+                                      args.checkpoint is not None or args.jobs > 1 or args.shards > 1 or
+                                      args.concurrent_queries > 1):
+        parser.error("--snapshot cannot be combined with --data-object-prefix, --incremental, --checkpoint, " +
+                     "--jobs, --shards or --concurrent-queries")
+    if args.vectorized and not args.shared_scan and args.snapshot is None:
+        parser.error("--vectorized requires --shared-scan or --snapshot")
+    if args.command == 'export' and args.snapshot is not None:
+        parser.error("--snapshot cannot be combined with the export command")
+    if args.sample is not None and not 0 < args.sample <= 100:
+        parser.error("--sample must be more than 0 and at most 100")
+    if args.sample is not None and (args.snapshot is not None or args.shared_scan or args.shards > 1 or
+                                    args.checkpoint is not None or args.incremental is not None or
+                                    args.concurrent_queries > 1 or args.timestamp_index_advice):
+        parser.error("--sample cannot be combined with --snapshot, --shared-scan, --shards, --checkpoint, " +
+                     "--incremental, --concurrent-queries or --timestamp-index-advice")
+    if args.issue_store is None and args.report.value != 'all':
+        parser.error("--report requires --issue-store")
+    if args.issue_store is not None and (args.shards > 1 or args.checkpoint is not None or args.sample is not None):
+        parser.error("--issue-store cannot be combined with --shards, --checkpoint or --sample")
+    if args.report.value == 'resolved' and (args.data_object_prefix is not None or args.incremental is not None):
+        parser.error("--report resolved cannot be combined with --data-object-prefix or --incremental, " +
+                     "since issues of rows that are not checked would be reported as resolved")
+    if args.explain and (args.snapshot is not None or args.shared_scan or args.checkpoint is not None or
+                         args.shards > 1 or args.command == 'export'):
+        parser.error("--explain cannot be combined with --snapshot, --shared-scan, --checkpoint, --shards " +
+                     "or the export command")
     return args
 
 def entry():
@@ -79,36 +323,252 @@ def entry():
     except KeyboardInterrupt:
         print("Script interrupted by user.", file=sys.stderr)
 
+def run_detector(args, detector):
+    with detector.measure():
+        if args.shards > 1 and detector.shard_by is not None:
+            return sharding.run_sharded(detector)
+        else:
+            return detector.run()
+
+def run_detectors(args, output_processor, detectors):
+    issue_found = False
+
+    for detector in detectors:
+        if args.v:
+            output_processor.print_progress("Starting test {}".format(detector.get_name()))
+        if run_detector(args, detector):
+            issue_found = True
+
+    return issue_found
+
+def run_detectors_chunked(args, output_processor, detectors, checkpoint):
+    '''Runs detectors one by one in chunks, skipping tests that have been completed according to the
+       checkpoint. Returns whether an issue has been found in this run or in earlier runs with the
+       same checkpoint, and whether all tests have been completed.'''
+    deadline = None if args.time_budget is None else time.time() + args.time_budget
+
+    for detector in detectors:
+        if checkpoint.is_completed(detector.get_name()):
+            if args.v:
+                output_processor.print_progress("Skipping test {}, which has been completed before".format(
+                    detector.get_name()))
+            continue
+        if args.v:
+            output_processor.print_progress("Starting test {}".format(detector.get_name()))
+        with detector.measure():
+            _, completed = chunking.run_chunked(detector, checkpoint, deadline)
+        if not completed:
+            return checkpoint.issue_found, False
+
+    return checkpoint.issue_found, True
+
+def run_detectors_parallel(args, config, output_processor, detectors):
+    '''Runs detectors in parallel threads. Each detector gets its own database connection from a pool,
+       and output is serialized, so that output of different detectors does not get mixed up.'''
+    synchronized_output_processor = SynchronizedOutputProcessor(output_processor)
+    number_jobs = min(args.jobs, len(detectors))
+    pool = utils.get_connection_pool(config, number_jobs)
+    active_connections = set()
+
+    def run_job(detector):
+        connection = pool.getconn()
+        active_connections.add(connection)
+        try:
+            job_detector = type(detector)(args, connection, synchronized_output_processor, detector.context)
+            job_detector.stats = detector.stats
+            job_detector.sample_estimator = detector.sample_estimator
+            job_detector.failed_sub_checks = detector.failed_sub_checks
+            if args.v:
+                synchronized_output_processor.print_progress("Starting test {}".format(job_detector.get_name()))
+            return run_detector(args, job_detector)
+        finally:
+            active_connections.discard(connection)
+            connection.rollback()
+            pool.putconn(connection)
+
+    try:
+        with ThreadPoolExecutor(max_workers=number_jobs) as executor:
+            futures = [executor.submit(run_job, detector) for detector in detectors]
+            try:
+                results = [future.result() for future in futures]
+            except BaseException:
+                # Stop queries of other detectors, e.g. when the user interrupts the script
+                for future in futures:
+                    future.cancel()
+                for connection in list(active_connections):
+                    connection.cancel()
+                raise
+    finally:
+        pool.closeall()
+
+    return any(results)
+
 def main():
     args = get_arguments()
-    config = utils.read_database_config(args.config_file)
-    connection = utils.get_connection_database(config)
 
     if args.m.value == 'human':
         output_processor = CheckOutputProcessorHuman(args.output)
     elif args.m.value == 'csv':
         output_processor = CheckOutputProcessorCSV(args.output)
+    elif args.m.value == 'jsonl':
+        output_processor = CheckOutputProcessorJSONL(args.output)
     else:
         print("Error: unknown output processor selected.")
         sys.exit(1)
 
-    detectors = [
-        PathInconsistencyDetector(args, connection, output_processor),
-        HardlinkDetector(args, connection, output_processor),
-        MinreplicaIssueDetector(args, connection, output_processor),
-        RefIntegrityIssueDetector(args, connection, output_processor),
-        TimestampIssueDetector(args, connection, output_processor),
-        NameIssueDetector(args, connection, output_processor),
-        MissingIndexDetector(args, connection, output_processor)]
+    # Buffered output is also written when the script exits early, e.g. on errors or when interrupted
+    try:
+        run_checks(args, output_processor)
+    finally:
+        output_processor.close()
+
+def run_checks(args, output_processor):
+    if args.vectorized and vectorized.numpy is None:
+        output_processor.exit_error("Error: the numpy module is needed for --vectorized.")
+
+    if args.snapshot is not None:
+        try:
+            connection = catalog_snapshot.Snapshot(args.snapshot)
+        except (OSError, ValueError, catalog_snapshot.SnapshotError) as error:
+            output_processor.exit_error("Error: cannot read snapshot file {}: {}".format(args.snapshot, error))
+    else:
+        config = utils.read_database_config(args.config_file)
+        connection = utils.get_connection_database(config)
+
+    if args.command == 'export':
+        catalog_snapshot.export_snapshot(connection, args.snapshot_file,
+                                         output_processor.print_progress if args.v else None)
+        connection.close()
+        sys.exit(0)
+
+    context = RunContext(args)
+    if args.incremental is not None:
+        incremental_state = IncrementalState(args.incremental)
+        incremental_state.begin(connection)
+        context.incremental_conditions = incremental_state.get_conditions(connection)
+
+    detectors = [detector_class(args, connection, output_processor, context) for detector_class in DETECTOR_CLASSES]
+
+    selected_detectors = [detector for detector in detectors
+                          if args.run_test.value == 'all' or args.run_test.value == detector.get_name()]
+
+    if args.sample is not None:
+        for detector in selected_detectors:
+            if not detector.sampled and args.v:
+                output_processor.print_progress("Skipping test {}, which cannot check a sample".format(
+                    detector.get_name()))
+        selected_detectors = [detector for detector in selected_detectors if detector.sampled]
+
+    if args.explain:
+        missing_index_detector = next(detector for detector in detectors if isinstance(detector, MissingIndexDetector))
+        missing_indexes = missing_index_detector.get_missing_index_definitions()
+        if missing_indexes is None:
+            output_processor.print_progress("Index SQL file not found, missing indexes are not taken into account.")
+        QueryExplainer(connection, output_processor, args.v, missing_indexes).explain_detectors(selected_detectors)
+        connection.close()
+        sys.exit(0)
+
+    if args.issue_store is not None:
+        try:
+            context.issue_store = IssueStore(args.issue_store)
+        except sqlite3.Error as error:
+            output_processor.exit_error("Error: cannot open issue store {}: {}".format(args.issue_store, error))
+    checked_detectors = list(selected_detectors)
 
     issue_found = False
+    completed = True
 
-    for detector in detectors:
-        if args.run_test.value == 'all' or args.run_test.value == detector.get_name():
-            if args.v:
-                output_processor.print_progress("Starting test {}".format(detector.get_name()))
-            if detector.run():
-                issue_found = True
+    all_stats = [detector.stats for detector in selected_detectors]
+
+    if args.checkpoint is not None:
+        try:
+            checkpoint = chunking.Checkpoint(args.checkpoint, args, args.resume)
+        except chunking.CheckpointMismatchError as error:
+            output_processor.exit_error("Error: {}".format(error))
+
+    if args.snapshot is not None:
+        # All tests that check rows one by one read the snapshot in a shared scan
+        pipeline = SnapshotScanPipeline(connection, output_processor, args.v, args.fetch_size)
+    elif args.shared_scan:
+        pipeline = ScanPipeline(connection, output_processor, args.v, args.fetch_size)
+    else:
+        pipeline = None
+
+    if pipeline is not None:
+        pipeline_detectors = [detector for detector in selected_detectors if detector.register_scans(pipeline)]
+        pipeline.run()
+        all_stats.append(pipeline.stats)
+        if any(detector.scan_issue_found for detector in pipeline_detectors):
+            issue_found = True
+        selected_detectors = [detector for detector in selected_detectors if detector not in pipeline_detectors]
+
+    if args.checkpoint is not None:
+        try:
+            issue_found, completed = run_detectors_chunked(args, output_processor, selected_detectors, checkpoint)
+        except KeyboardInterrupt:
+            output_processor.close()
+            output_processor.print_error("Progress has been saved in {}. Use --resume to continue.".format(
+                args.checkpoint))
+            raise
+    elif args.jobs > 1 and len(selected_detectors) > 1:
+        if run_detectors_parallel(args, config, output_processor, selected_detectors):
+            issue_found = True
+    elif run_detectors(args, output_processor, selected_detectors):
+        issue_found = True
+
+    if context.issue_store is not None:
+        resolved_issue_found = False
+        # Only tests that have checked all rows can tell whether an issue has been resolved
+        if args.data_object_prefix is None and args.incremental is None:
+            for detector in checked_detectors:
+                if not detector.can_check() or len(detector.failed_sub_checks) > 0:
+                    continue
+                if args.report.value == 'resolved':
+                    for values in context.issue_store.get_resolved_issues(detector.get_name()):
+                        output_processor.output_item(detector.get_name(), values)
+                        resolved_issue_found = True
+                context.issue_store.remove_resolved_issues(detector.get_name())
+        # The exit status is based on the issues that have been reported
+        if args.report.value == 'new':
+            issue_found = context.issue_store.has_new_issues()
+        elif args.report.value == 'resolved':
+            issue_found = resolved_issue_found
+        context.issue_store.commit()
+        context.issue_store.close()
+
+    output_processor.close()
+
+    for detector in selected_detectors:
+        if detector.sample_estimator is not None:
+            detector.sample_estimator.print_estimates(output_processor, detector.get_name())
+
+    name_cache_stats = context.get_name_cache_stats()
+    if args.v and name_cache_stats is not None:
+        for cache, cache_stats in sorted(name_cache_stats.items()):
+            output_processor.print_progress("Name cache {}: {} hits, {} misses, {} of {} entries used".format(
+                cache, cache_stats['hits'], cache_stats['misses'], cache_stats['size'], cache_stats['max_size']))
+
+    for stats_file in args.stats_file:
+        metrics.write_stats_file(stats_file, all_stats, name_cache_stats)
+
+    # Tests with failed sub-checks have not checked all rows
+    failed_tests = [detector.get_name() for detector in checked_detectors if len(detector.failed_sub_checks) > 0]
+
+    # All other tests have completed, so their next incremental run can start from here
+    if args.incremental is not None:
+        incremental_state.save([detector.get_name() for detector in checked_detectors
+                                if detector.get_name() not in failed_tests])
+
+    if len(failed_tests) > 0:
+        output_processor.print_error("Error: not all rows have been checked by test(s) {}, since queries have failed.".format(
+            ", ".join(failed_tests)))
+        sys.exit(1)
+
+    if not completed:
+        output_processor.print_progress(
+            "Time budget used up before all tests have completed. Progress has been saved in {}. ".format(
+                args.checkpoint) + "Use --resume to continue.")
+        sys.exit(3)
 
     if issue_found:
         if args.v:
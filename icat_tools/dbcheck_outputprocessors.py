@@ -1,6 +1,68 @@
 import csv
+import functools
+import gzip
+import json
 import operator
 import sys
+import threading
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Number of bytes of JSON Lines output that are collected before they are written
+JSONL_BUFFER_SIZE = 1024 * 1024
+
+# Output of each check and item type. Items of checks that only have one type of item have type None.
+# The message of human-readable output contains the values of the item as named fields. CSV rows contain
+# the name of the check, the CSV type if any and the fields, and JSON Lines records contain the name of
+# the check, the item type if any and the fields. The report columns of an item, i.e. the values of the
+# catalog row with the issue, are listed below the message, added to CSV rows as column/value pairs, and
+# nested in JSON Lines records.
+OUTPUT_ITEM_FORMATS = {
+    ('hardlinks', 'duplicate_dataobject_entry'): {
+        'message': "Duplicate dataobject entry found for data object {object_name}\n  Resource: {resource_name}\n" +
+                   "   Path: {phy_path}",
+        'csv_type': 'duplicate_dataobject',
+        'fields': ['phy_path', 'resource_name', 'object_name']},
+    ('hardlinks', 'hardlink'): {
+        'message': "Hard link found for path {phy_path} on resource {resource_name}:\n  Data object 1: {object1}\n" +
+                   "  Data object 2: {object2}\n",
+        'csv_type': 'hardlink',
+        'fields': ['phy_path', 'resource_name', 'object1', 'object2']},
+    ('minreplicas', None): {
+        'message': "Number of replicas for data object {object_name} is {number_replicas} (less than {min_replicas})",
+        'csv_type': None,
+        'fields': ['object_name', 'number_replicas', 'min_replicas']},
+    ('names', 'empty_name'): {
+        'message': "Empty name for {check_name}",
+        'csv_type': 'empty_name',
+        'fields': ['check_name', 'report_columns']},
+    ('names', 'buggy_characters'): {
+        'message': "Name with characters that iRODS processes incorrectly for {check_name}",
+        'csv_type': 'buggy_characters',
+        'fields': ['check_name', 'report_columns']},
+    ('path_consistency', None): {
+        'message': "Inconsistent directory name in resource {resource_name} for {phy_path} :\n  Data object: {data_name}",
+        'csv_type': None,
+        'fields': ['resource_name', 'phy_path', 'data_name']},
+    ('ref_integrity', None): {
+        'message': "Potential referential integrity issue found for {check_name}.",
+        'csv_type': None,
+        'fields': ['check_name', 'report_columns']},
+    ('timestamps', 'order'): {
+        'message': "Timestamps in unexpected order for {check_name}",
+        'csv_type': 'order',
+        'fields': ['check_name', 'report_columns']},
+    ('timestamps', 'future'): {
+        'message': "Timestamp from the future for {check_name}",
+        'csv_type': 'future',
+        'fields': ['check_name', 'report_columns']},
+    ('indexes', 'missing_index'): {
+        'message': "Missing index: {index}",
+        'csv_type': 'missing_index',
+        'fields': ['index']}}
 
 
 class OutputProcessor:
@@ -23,6 +85,64 @@ class OutputProcessor:
         self.print_error(message)
         sys.exit(1)
 
+    def get_item_format(self, check, values):
+        '''Returns the output format of an item of a check, see OUTPUT_ITEM_FORMATS.'''
+        item_format = OUTPUT_ITEM_FORMATS.get((check, values.get('type')))
+        if item_format is None:
+            if all(item_check != check for item_check, _ in OUTPUT_ITEM_FORMATS):
+                self.exit_error("Error: unknown output check type: {}".format(check))
+            self.exit_error("Error: unknown output item type for {} check: {}".format(check, values.get('type')))
+        return item_format
+
+    def close(self):
+        '''Writes any output that has not been written yet.'''
+        pass
+
+
+class CollectingOutputProcessor(OutputProcessor):
+    '''Collects items and messages in a list, so that they can be passed on to another output
+       processor later.'''
+
+    def __init__(self):
+        super().__init__(None)
+        self.output_list = []
+
+    def output_message(self, message):
+        self.output_list.append(('message', message))
+
+    def output_item(self, check, values):
+        self.output_list.append(('item', values))
+
+
+class SynchronizedOutputProcessor(OutputProcessor):
+    '''Wraps another output processor, so that it can be used by detectors that run in parallel
+       threads. Every item or message is written completely before the next one is started.'''
+
+    def __init__(self, processor):
+        super().__init__(processor.output)
+        self.processor = processor
+        self.lock = threading.Lock()
+
+    def output_message(self, message):
+        with self.lock:
+            self.processor.output_message(message)
+
+    def output_item(self, check, values):
+        with self.lock:
+            self.processor.output_item(check, values)
+
+    def print_progress(self, message):
+        with self.lock:
+            self.processor.print_progress(message)
+
+    def print_error(self, message):
+        with self.lock:
+            self.processor.print_error(message)
+
+    def close(self):
+        with self.lock:
+            self.processor.close()
+
 
 class CheckOutputProcessorHuman(OutputProcessor):
     def __init__(self, output):
@@ -39,83 +159,11 @@ class CheckOutputProcessorHuman(OutputProcessor):
         self._prnln(message)
 
     def output_item(self, check, values):
-
-        if check == 'hardlinks':
-            if values['type'] == 'duplicate_dataobject_entry':
-                self._prnln(
-                    "Duplicate dataobject entry found for data object {}\n  Resource: {}\n   Path: {}".format(
-                        values['object_name'],
-                        values['resource_name'],
-                        values['phy_path']))
-            elif values['type'] == 'hardlink':
-                self._prnln(
-                    "Hard link found for path {} on resource {}:\n  Data object 1: {}\n  Data object 2: {}\n".format(
-                        values['phy_path'],
-                        values['resource_name'],
-                        values['object1'],
-                        values['object2']))
-            else:
-                self.exit_error("Error: unknown output item type for hardlink check: {}".format(
-                        values['type']))
-
-        elif check == 'minreplicas':
-            self._prnln("Number of replicas for data object {} is {} (less than {})".format(
-                values['object_name'],
-                values['number_replicas'],
-                values['min_replicas']))
-
-        elif check == 'names':
-            if values['type'] == 'empty_name':
-                self._prnln("Empty name for " + values['check_name'])
-                self._print_report_column_table(values['report_columns'])
-            elif values['type'] == 'buggy_characters':
-                self._prnln(
-                    "Name with characters that iRODS processes incorrectly for " +
-                    values['check_name'])
-                self._print_report_column_table(values['report_columns'])
-            else:
-                self.exit_error("Error: unknown output item type for names check: {}".format(
-                        values['type']))
-
-        elif check == 'path_consistency':
-            self._prnln(
-                "Inconsistent directory name in resource {} for {} :\n  Data object: {}".format(
-                    values['resource_name'],
-                    values['phy_path'],
-                    values['data_name']))
-
-        elif check == 'ref_integrity':
-            self._prnln(
-                "Potential referential integrity issue found for {}.".format(
-                    values['check_name']))
+        item_format = self.get_item_format(check, values)
+        self._prnln(item_format['message'].format(**values))
+        if 'report_columns' in item_format['fields']:
             self._print_report_column_table(values['report_columns'])
 
-        elif check == 'timestamps':
-            if values['type'] == 'order':
-                self._prnln(
-                    "Timestamps in unexpected order for " +
-                    values['check_name'])
-                self._print_report_column_table(values['report_columns'])
-            elif values['type'] == 'future':
-                self._prnln("Timestamp from the future for " +
-                            values['check_name'])
-                self._print_report_column_table(values['report_columns'])
-            else:
-                self.exit_error(
-                    "Error: unknown output item type for timestamps check: {}".format(
-                        values['type']))
-
-        elif check == 'indexes':
-            if values['type'] == 'missing_index':
-                self._prnln("Missing index: {}".format(values['index']))
-            else:
-                self.exit_error(
-                    "Error: unknown output item type for index check: {}".format(
-                        values['type']))
-
-        else:
-            self.exit_error("Error: unknown output check type: {}".format(check))
-
 
 class CheckOutputProcessorCSV(OutputProcessor):
 
@@ -132,55 +180,67 @@ class CheckOutputProcessorCSV(OutputProcessor):
         return result
 
     def output_item(self, check, values):
-
-        if check == 'hardlinks':
-            if values['type'] == 'duplicate_dataobject_entry':
-                self.writer.writerow(
-                    [check, 'duplicate_dataobject', values['phy_path'], values['resource_name'], values['object_name']])
-            elif values['type'] == 'hardlink':
-                self.writer.writerow([check, 'hardlink', values['phy_path'],
-                                      values['resource_name'], values['object1'], values['object2']])
+        item_format = self.get_item_format(check, values)
+        row = [check]
+        if item_format['csv_type'] is not None:
+            row.append(item_format['csv_type'])
+        for field in item_format['fields']:
+            if field == 'report_columns':
+                row += self._column_value_to_list(values['report_columns'])
             else:
-                self.exit_error("Error: unknown output item type for hardlink check: {}".format(
-                    values['type']))
+                row.append(values[field])
+        self.writer.writerow(row)
 
-        elif check == 'minreplicas':
-            self.writer.writerow(
-                [check, values['object_name'], values['number_replicas'], values['min_replicas']])
 
-        elif check == 'names':
-            if values['type'] == 'empty_name' or values['type'] == 'buggy_characters':
-                self.writer.writerow([check, values['type'], values['check_name']] +
-                                     self._column_value_to_list(values['report_columns']))
-            else:
-                self.exit_error(
-                    "Error: unknown output item type for names check: {}".format(
-                        values['type']))
-
-        elif check == 'path_consistency':
-            self.writer.writerow(
-                [check, values['resource_name'], values['phy_path'], values['data_name']])
-
-        elif check == 'ref_integrity':
-            self.writer.writerow([check, values['check_name']] +
-                                 self._column_value_to_list(values['report_columns']))
-
-        elif check == 'timestamps':
-            if values['type'] == 'order' or values['type'] == 'future':
-                self.writer.writerow([check, values['type'], values['check_name']] +
-                                     self._column_value_to_list(values['report_columns']))
-            else:
-                self.exit_error(
-                    "Error: unknown output item type for timestamps check: {}".format(
-                        values['type']))
+class CheckOutputProcessorJSONL(OutputProcessor):
+    '''Writes every item as a JSON object on a separate line, to a binary output file. Output is
+       written in large blocks, and compressed if the name of the output file ends with .gz or .zst.'''
 
-        elif check == 'indexes':
-            if values['type'] == 'missing_index':
-                self.writer.writerow([check, values['type'], values['index']])
-            else:
-                self.exit_error(
-                    "Error: unknown output item type for index check: {}".format(
-                        values['type']))
+    def __init__(self, output):
+        super().__init__(output)
+        self.buffer = []
+        self.buffer_size = 0
+        self.closed = False
+        name = getattr(output, 'name', '')
+        self.stream = output
+        # Function that writes the end of the compressed stream, without closing the output file
+        self.finish_compression = None
+        if name.endswith('.gz'):
+            self.stream = gzip.GzipFile(fileobj=self.stream, mode='wb')
+            self.finish_compression = self.stream.close
+        elif name.endswith('.zst'):
+            if zstandard is None:
+                self.exit_error("Error: the zstandard module is needed for zstd-compressed output.")
+            self.stream = zstandard.ZstdCompressor().stream_writer(self.stream)
+            self.finish_compression = functools.partial(self.stream.flush, zstandard.FLUSH_FRAME)
+
+    def _get_record(self, check, values):
+        item_format = self.get_item_format(check, values)
+        record = {'check': check}
+        if values.get('type') is not None:
+            record['type'] = values['type']
+        for field in item_format['fields']:
+            record[field] = values[field]
+        return record
+
+    def _flush(self):
+        self.stream.write(b"".join(self.buffer))
+        self.buffer = []
+        self.buffer_size = 0
 
-        else:
-            self.exit_error("Error: unknown output check type: {}".format(check))
+    def output_item(self, check, values):
+        line = (json.dumps(self._get_record(check, values), ensure_ascii=False) + "\n").encode('utf-8')
+        self.buffer.append(line)
+        self.buffer_size += len(line)
+        if self.buffer_size >= JSONL_BUFFER_SIZE:
+            self._flush()
+
+    def close(self):
+        # Can be called more than once, e.g. when the script is interrupted after output has been closed
+        if self.closed:
+            return
+        self.closed = True
+        self._flush()
+        if self.finish_compression is not None:
+            self.finish_compression()
+        self.output.flush()
@@ -1,12 +1,124 @@
+from icat_tools import metrics, sampling, utils
+from icat_tools.catalog_snapshot import SnapshotNameResolver
+from icat_tools.concurrent_queries import ConcurrentQueryRunner
+from icat_tools.issue_store import get_fingerprint
+from icat_tools.name_resolver import NameResolver
+import threading
+import time
+
+
+class RunContext(object):
+    '''State that is shared by the detectors of a run, including detectors that run in parallel
+       threads. Worker processes of sharded runs have their own context.'''
+
+    def __init__(self, args, incremental_conditions=None, prefix_conditions=None):
+        self.args = args
+        # Conditions that limit tables to the rows that have been created or modified since the last
+        # completed run of a test, by test and table. These are only set in incremental mode.
+        self.incremental_conditions = {} if incremental_conditions is None else incremental_conditions
+        # Data object prefix conditions, by prefix, so that the prefix only needs to be resolved once
+        self.prefix_conditions = {} if prefix_conditions is None else dict(prefix_conditions)
+        self.prefix_conditions_lock = threading.Lock()
+        # Store of the issues that have been found by earlier runs, with --issue-store
+        self.issue_store = None
+        # Resolver of collection and data object names. It is created when it is first needed.
+        self.name_resolver = None
+        self.name_resolver_lock = threading.Lock()
+
+    def get_data_object_prefix_condition(self, connection, prefix):
+        with self.prefix_conditions_lock:
+            if prefix not in self.prefix_conditions:
+                self.prefix_conditions[prefix] = utils.get_data_object_prefix_condition(connection, prefix)
+            return self.prefix_conditions[prefix]
+
+    def get_name_resolver(self):
+        with self.name_resolver_lock:
+            if self.name_resolver is None:
+                if self.args.snapshot is not None:
+                    self.name_resolver = SnapshotNameResolver()
+                else:
+                    self.name_resolver = NameResolver(self.args.name_cache_size)
+            return self.name_resolver
+
+    def get_name_cache_stats(self):
+        '''Returns the hit and miss counters of the name caches, or None if no names have been
+           resolved.'''
+        if self.name_resolver is None:
+            return None
+        return self.name_resolver.get_stats()
+
+
 class Detector(object):
-    def __init__(self, args, connection, output_processor):
+    # Whether the detector checks rows independently of each other, so that it only needs to check
+    # new and modified rows in incremental mode.
+    incremental = False
+
+    # Key that can be used to split r_data_main in shards that can be processed independently
+    # ('data_id' or 'resc_id'), or None if the detector does not support this. Detectors that
+    # support data_id shards can also be run in chunks.
+    shard_by = None
+
+    # Whether the detector checks r_data_main and other tables in separate sub-checks, so that chunked
+    # runs can check the other tables at once and r_data_main in chunks.
+    chunk_data_objects = False
+
+    # Whether the detector can check a sample of the rows of its tables with --sample, and estimate
+    # the number of issues in the whole tables.
+    sampled = False
+
+    def __init__(self, args, connection, output_processor, context=None):
         self.args = args
         self.connection = connection
         self.output_processor = output_processor
+        # State shared with the other detectors of the run
+        self.context = RunContext(args) if context is None else context
+        # Condition on r_data_main that selects the shard or chunk to check, if the detector runs on
+        # a shard or chunk of data_id values.
+        self.shard_condition = None
+        # Ids of the resources to check, if the detector runs on a shard of resources.
+        self.shard_resources = None
+        # Tables that the sub-checks of the detector check: None for all tables, 'r_data_main' or 'other'
+        # for the parts of a chunked run.
+        self.checked_tables = None
+        # Whether the row-level checks that the detector has registered with a shared scan pipeline
+        # have found an issue.
+        self.scan_issue_found = False
+        # Sub-checks that have not checked all rows, because their query has failed
+        self.failed_sub_checks = []
+        self.stats = metrics.TestStats(self.get_name())
+        # Counts of sampled rows and of issues in sampled runs
+        self.sample_estimator = None
+        if args.sample is not None and self.sampled:
+            self.sample_estimator = sampling.SampleEstimator(args.sample)
 
-    def output_item(self, values):
+    def output_item(self, values, key=None):
+        '''Reports an issue. The key identifies the issue in the issue store; by default, the reported
+           values are used. Issues that are known from earlier runs are not reported with --report new,
+           and no issues are reported with --report resolved.'''
+        self.stats.record_issue()
+        if self.sample_estimator is not None:
+            self.sample_estimator.add_issue(values.get('check_name'), values.get('type'))
+        if self.context.issue_store is not None:
+            known = self.context.issue_store.record(
+                self.get_name(), get_fingerprint(self.get_name(), values if key is None else key), values)
+            if self.args.report.value == 'resolved' or (known and self.args.report.value == 'new'):
+                return
         self.output_processor.output_item(self.get_name(), values)
 
+    def filter_known_issues(self, issues, get_key):
+        '''Returns the issues of a list that still need to be passed to output_item, given a function
+           that returns the key of an issue. With --report new or resolved, known issues are not reported,
+           so they are only recorded as found, before their names are looked up.'''
+        if self.context.issue_store is None or self.args.report.value == 'all':
+            return issues
+        new_issues = []
+        for issue in issues:
+            if self.context.issue_store.mark_known(get_fingerprint(self.get_name(), get_key(issue))):
+                self.stats.record_issue()
+            else:
+                new_issues.append(issue)
+        return new_issues
+
     def output_message(self, message):
         self.output_processor.output_message(message)
 
@@ -19,5 +131,187 @@ class Detector(object):
     def exit_error(self, message):
         self.output_processor.exit_error(message)
 
+    def measure(self, sub_check=None):
+        '''Returns a context manager that records runtime metrics of the test, or of one of its
+           sub-checks.'''
+        return self.stats.measure(self.connection, sub_check)
+
+    def get_cursor(self, name=None):
+        '''Returns a server-side cursor that fetches --fetch-size rows at a time. The name of the
+           test is used as the name of the cursor, unless another name is specified.'''
+        return utils.get_server_side_cursor(
+            self.connection, self.get_name() if name is None else name, self.args.fetch_size)
+
+    def run_queries_concurrently(self, queries, output_rows, skip_repeated_rows=False):
+        '''Runs independent queries concurrently over --concurrent-queries connections. queries is a
+           list of (sub-check, alternative queries) tuples, see ConcurrentQueryRunner. The rows of each
+           query are passed to output_rows(sub_check, rows, alternative) in batches of --fetch-size rows
+           while it runs. Returns a dictionary with the number of rows and the alternative that
+           returned them, by sub-check. Sub-checks whose query has failed are reported as errors and
+           added to failed_sub_checks.'''
+        if self.args.v:
+            self.print_progress("Running {} queries of test {} over {} connections".format(
+                len(queries), self.get_name(), min(self.args.concurrent_queries, len(queries))))
+
+        def output_query_rows(sub_check, rows, alternative):
+            with self.measure(sub_check):
+                output_rows(sub_check, rows, alternative)
+
+        results = {}
+
+        def query_completed(sub_check, number_rows, alternative, duration):
+            self.stats.record_query(sub_check, duration, number_rows, alternative + 1)
+            results[sub_check] = (number_rows, alternative)
+
+        def query_failed(sub_check, error, duration):
+            self.stats.record_query(sub_check, duration, 0)
+            self.failed_sub_checks.append(sub_check)
+            self.print_error("Error: the query of {} of test {} has failed: {}".format(
+                sub_check, self.get_name(), str(error).strip()))
+
+        # The queries see the same data as the connection of the test, which keeps the snapshot valid
+        # until its transaction ends
+        cursor = self.connection.cursor()
+        cursor.execute("SELECT pg_export_snapshot()")
+        snapshot_id = cursor.fetchone()[0]
+        cursor.close()
+
+        runner = ConcurrentQueryRunner(utils.read_database_config(self.args.config_file),
+                                       self.args.concurrent_queries, self.args.fetch_size, snapshot_id)
+        runner.run(queries, output_query_rows, query_completed, query_failed, skip_repeated_rows)
+        return results
+
+    def get_name_resolver(self):
+        return self.context.get_name_resolver()
+
+    def get_collection_names(self, coll_ids):
+        '''Returns a dictionary with the names of collections, by id.'''
+        return self.get_name_resolver().get_collection_names(self.connection, coll_ids)
+
+    def get_dataobject_names(self, data_ids):
+        '''Returns a dictionary with the full names of data objects, by id.'''
+        return self.get_name_resolver().get_dataobject_names(self.connection, data_ids)
+
+    def get_resource_name_dict(self):
+        '''Returns a dictionary with the names of resources, by id.'''
+        if self.args.snapshot is not None:
+            return self.connection.get_resource_name_dict()
+        return utils.get_resource_name_dict(self.connection)
+
+    def get_resource_vault_path_dict(self):
+        '''Returns a dictionary with the vault paths of unix file system resources, by id.'''
+        if self.args.snapshot is not None:
+            return self.connection.get_resource_vault_path_dict()
+        return utils.get_resource_vault_path_dict(self.connection)
+
+    def get_coll_path_dict(self):
+        '''Returns a dictionary with the names of all collections, by id.'''
+        if self.args.snapshot is not None:
+            return self.connection.get_coll_path_dict(self.args.fetch_size)
+        return utils.get_coll_path_dict(self.connection, self.args.fetch_size)
+
+    def get_current_time(self):
+        '''Returns the current time, or the time at which the snapshot was exported when the tests
+           run on a snapshot.'''
+        if self.args.snapshot is not None:
+            return self.connection.exported_at
+        return time.time()
+
+    def get_engine(self, default):
+        '''Returns the engine ('client' or 'server') selected by the user, or the default
+           engine of the detector if no engine has been selected. Tests on a snapshot always use
+           the client engine.'''
+        if self.args.snapshot is not None:
+            return 'client'
+        if self.args.engine is None:
+            return default
+        else:
+            return self.args.engine.value
+
+    def get_data_object_prefix_condition(self):
+        '''Returns an SQL condition on r_data_main for the --data-object-prefix option, or None
+           if no prefix has been specified.'''
+        prefix = self.args.data_object_prefix
+        if prefix is None:
+            return None
+        return self.context.get_data_object_prefix_condition(self.connection, prefix)
+
+    def get_table_conditions(self, table):
+        '''Returns a list of SQL conditions that limit a table to the rows selected by the user.'''
+        conditions = []
+        if table == 'r_data_main' and self.args.data_object_prefix is not None:
+            conditions.append(self.get_data_object_prefix_condition())
+        if table == 'r_data_main' and self.shard_condition is not None:
+            conditions.append(self.shard_condition)
+        incremental_condition = self.get_incremental_condition(table)
+        if incremental_condition is not None:
+            conditions.append(incremental_condition)
+        return conditions
+
+    def is_table_checked(self, table):
+        '''Returns whether the sub-checks of a table are run, see checked_tables.'''
+        if self.checked_tables is None:
+            return True
+        return (table == 'r_data_main') == (self.checked_tables == 'r_data_main')
+
+    def get_incremental_condition(self, table):
+        '''Returns a condition that limits a table to the rows that have been created or modified since
+           the last completed run of the test, or None if all rows need to be checked.'''
+        if not self.incremental:
+            return None
+        return self.context.incremental_conditions.get(self.get_name(), {}).get(table)
+
+    def get_table_reference(self, table):
+        '''Returns a reference to a table that is checked, for the FROM clause of a query. In sampled
+           runs, it selects a sample of the table.'''
+        if self.sample_estimator is None:
+            return table
+        return "{} {}".format(table, sampling.get_table_sample_clause(
+            self.args.sample_method.value, self.args.sample, self.args.sample_seed))
+
+    def record_sampled_rows(self, sub_checks, number_rows):
+        '''Records the number of rows of a sample that have been checked by each of the sub-checks.'''
+        if self.sample_estimator is not None:
+            for sub_check in sub_checks:
+                self.sample_estimator.add_rows(sub_check, number_rows)
+
+    def count_sampled_rows(self, sub_checks, table, conditions=[]):
+        '''Counts the rows of the sample of a table that meet the conditions, for sub-checks that only
+           retrieve rows with issues. The sample of a seed is repeatable, so this is the same sample
+           that the checks use.'''
+        if self.sample_estimator is None:
+            return
+        cursor = self.connection.cursor()
+        cursor.execute("SELECT count(*) FROM {} {}".format(self.get_table_reference(table),
+                                                           self.get_where_clause(table, conditions)))
+        self.record_sampled_rows(sub_checks, cursor.fetchone()[0])
+        cursor.close()
+
+    def get_where_clause(self, table, conditions=[]):
+        '''Returns a WHERE clause that combines the given conditions with the conditions
+           selected by the user for the table, or an empty string if there are none.'''
+        all_conditions = list(conditions) + self.get_table_conditions(table)
+        if len(all_conditions) == 0:
+            return ""
+        else:
+            return "WHERE " + " AND ".join("( {} )".format(condition) for condition in all_conditions)
+
+    def register_scans(self, pipeline):
+        '''Registers the row-level checks of the detector with a shared scan pipeline, as an
+           alternative to run(). Returns False if the detector does not support this.'''
+        return False
+
+    def get_queries(self):
+        '''Returns the queries that run() would send to scan the catalog, as (sub-check, query) tuples,
+           for --explain. The sub-check is None for tests with a single query. Small lookups, such as
+           those of resources and of the names of reported objects, are not included.'''
+        return []
+
+    def can_check(self):
+        '''Returns whether the test checks the catalog with the current options and configuration. Tests
+           that return without checking anything, e.g. because there is nothing to check, cannot tell
+           whether issues of earlier runs have been resolved.'''
+        return True
+
     def get_name(self):
         return "detector_superclass"
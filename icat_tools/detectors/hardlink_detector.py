@@ -1,52 +1,273 @@
-from icat_tools import utils
+from icat_tools import vectorized
 from icat_tools.detectors.detector import Detector
+from icat_tools.duplicate_finder import DuplicateFinder
+from icat_tools.name_resolver import LOOKUP_BATCH_SIZE
+import collections
+import functools
 
 
 class HardlinkDetector(Detector):
+    shard_by = 'resc_id'
+
     def get_name(self):
         return "hardlinks"
 
-    def run(self):
+    def _get_issue_key(self, resource_name, issue):
+        # The ids are sorted, so that the key does not depend on the order in which entries are found
+        phy_path, this_id, other_id = issue
+        return [resource_name, phy_path, min(this_id, other_id), max(this_id, other_id)]
+
+    def _output_issues(self, resource_name, issues):
+        issues = self.filter_known_issues(issues, functools.partial(self._get_issue_key, resource_name))
+        data_ids = set()
+        for _, this_id, other_id in issues:
+            data_ids.add(this_id)
+            data_ids.add(other_id)
+        names = self.get_dataobject_names(data_ids)
+
+        for issue in issues:
+            phy_path, this_id, other_id = issue
+            this_object = names.get(this_id)
+            other_object = names.get(other_id)
+            if this_object == other_object:
+                self.output_item(
+                    {'type': 'duplicate_dataobject_entry',
+                     'object_name': this_object,
+                     'resource_name': resource_name,
+                     'phy_path': phy_path},
+                    self._get_issue_key(resource_name, issue))
+            else:
+                self.output_item(
+                    {'type': 'hardlink',
+                     'phy_path': phy_path,
+                     'resource_name': resource_name,
+                     'object1': this_object,
+                     'object2': other_object},
+                    self._get_issue_key(resource_name, issue))
+
+    def _get_where_clause(self, resc_condition):
+        '''Returns the WHERE clause for the paths to check. If the user has limited the data objects
+           to check, all entries with the same path as a selected data object are checked, so that hard
+           links between selected and other data objects are found as well.'''
+        table_conditions = self.get_table_conditions('r_data_main')
+        if len(table_conditions) == 0:
+            return "WHERE {}".format(resc_condition)
+        else:
+            return "WHERE {} AND data_path IN ( SELECT data_path FROM r_data_main WHERE {} AND {} )".format(
+                resc_condition, resc_condition, " AND ".join("( {} )".format(c) for c in table_conditions))
+
+    def _get_entry_hash(self, resc_id, data_path):
+        return hash((resc_id, data_path))
+
+    def _get_data_object_paths(self, data_ids):
+        '''Returns the resource ids and paths of the replicas of data objects, as a dictionary with a list
+           of (resc_id, data_path) tuples per data_id.'''
+        if self.args.snapshot is not None:
+            return self.connection.get_rows_by_key('r_data_main', data_ids, ['resc_id', 'data_path'])
+        paths = {}
+        data_ids = list(data_ids)
+        cursor = self.connection.cursor()
+        for start in range(0, len(data_ids), LOOKUP_BATCH_SIZE):
+            cursor.execute("SELECT data_id, resc_id, data_path FROM r_data_main WHERE data_id = ANY(%s)",
+                           (data_ids[start:start + LOOKUP_BATCH_SIZE],))
+            for data_id, resc_id, data_path in cursor.fetchall():
+                paths.setdefault(data_id, []).append((resc_id, data_path))
+        cursor.close()
+        return paths
+
+    def _confirm_duplicates(self, groups):
+        '''Looks up the paths of groups of entries that have the same hash of resource id and path, and
+           compares them. groups is a list of (hash, entries) tuples, where entries are (position, data_id)
+           tuples. Returns the issues per resource, in order of position. Entries with the same hash but
+           another resource or path are hash collisions, and are not reported. Every entry is reported
+           against the entry with the lowest data id, like the server engine does, so that the issues do
+           not depend on the order of the scan.'''
+        replica_paths = self._get_data_object_paths({data_id for _, entries in groups for _, data_id in entries})
+        issues = {}
+        for key_hash, entries in groups:
+            replica_entries = collections.OrderedDict()
+            # Replicas of a data object that have the same resource and path are separate entries
+            replica_numbers = collections.Counter()
+            for position, data_id in entries:
+                replicas = [(resc_id, data_path) for resc_id, data_path in replica_paths.get(data_id, [])
+                            if self._get_entry_hash(resc_id, data_path) == key_hash]
+                if replica_numbers[data_id] >= len(replicas):
+                    # The replica has been removed since the scan
+                    continue
+                replica = replicas[replica_numbers[data_id]]
+                replica_numbers[data_id] += 1
+                replica_entries.setdefault(replica, []).append((position, data_id))
+            for (resc_id, data_path), entries_of_replica in replica_entries.items():
+                first_position, first_data_id = min(entries_of_replica, key=lambda entry: (entry[1], entry[0]))
+                for position, data_id in entries_of_replica:
+                    if position != first_position:
+                        issues.setdefault(resc_id, []).append((position, (data_path, data_id, first_data_id)))
+        return {resc_id: [issue for _, issue in sorted(resc_issues)] for resc_id, resc_issues in issues.items()}
+
+    def _output_confirmed_issues(self, resource_name_lookup, vault_path_lookup, groups):
+        issues = self._confirm_duplicates(groups)
         issue_found = False
-        resource_name_lookup = utils.get_resource_name_dict(self.connection)
+        for resc_id in vault_path_lookup:
+            if resc_id in issues:
+                issue_found = True
+                self._output_issues(resource_name_lookup[resc_id], issues[resc_id])
+        return issue_found
+
+    def _output_duplicate_groups(self, resource_name_lookup, vault_path_lookup, finder):
+        '''Confirms and reports the duplicate groups of a finder in batches of about LOOKUP_BATCH_SIZE
+           entries, so that memory usage does not depend on the number of duplicates. Data object names
+           are resolved in bulk per batch, so that the number of lookup queries does not depend on the
+           number of issues found. Returns whether an issue has been found.'''
+        issue_found = False
+        groups = []
+        number_entries = 0
+        for group in finder.get_duplicate_groups():
+            groups.append(group)
+            number_entries += len(group[1])
+            if number_entries >= LOOKUP_BATCH_SIZE:
+                if self._output_confirmed_issues(resource_name_lookup, vault_path_lookup, groups):
+                    issue_found = True
+                groups = []
+                number_entries = 0
+        if len(groups) > 0 and self._output_confirmed_issues(resource_name_lookup, vault_path_lookup, groups):
+            issue_found = True
+        return issue_found
+
+    def _print_spill_progress(self, finder, resource):
+        if self.args.v and len(finder.runs) > 0:
+            self.print_progress("Hard link check of {} has reached the memory limit, and has written sorted entries to disk".format(
+                resource))
 
-        if self.args.data_object_prefix:
-            self.print_error("The hard links test does not support the --data-object-prefix option.")
-            self.print_error("Ignoring the --data-object-prefix option for this test.")
+    def _get_client_query(self, resc_id):
+        return "SELECT data_id, data_path FROM r_data_main {}".format(
+            self._get_where_clause("resc_id = {}".format(resc_id)))
 
+    def _run_client(self, resource_name_lookup, vault_path_lookup):
+        '''Finds duplicate paths with a compact index of path hashes, which is written to disk in sorted
+           runs if it does not fit in --hardlinks-memory-limit.'''
+        issue_found = False
 
-        for resc_id, resc_path in utils.get_resource_vault_path_dict(
-                self.connection).items():
+        for resc_id, resc_path in vault_path_lookup.items():
+            finder = DuplicateFinder(self.args.hardlinks_memory_limit)
+            try:
+                cursor = self.get_cursor()
+                cursor.execute(self._get_client_query(resc_id))
 
-            query = "SELECT data_id, data_path FROM r_data_main WHERE resc_id = {}".format(resc_id)
+                for row in cursor:
+                    finder.add(self._get_entry_hash(resc_id, row[1]), row[0])
 
-            lookup_path = {}
-            cursor = self.connection.cursor(self.get_name())
-            cursor.execute(query)
+                cursor.close()
+                self._print_spill_progress(finder, resource_name_lookup[resc_id])
 
-            for row in cursor:
-                if row[1] in lookup_path:
+                if self._output_duplicate_groups(resource_name_lookup, {resc_id: resc_path}, finder):
                     issue_found = True
-                    this_object = utils.get_dataobject_name(
-                        self.connection, row[0])
-                    other_object = utils.get_dataobject_name(
-                        self.connection, lookup_path[row[1]])
-                    if this_object == other_object:
-                        self.output_item(
-                            {'type': 'duplicate_dataobject_entry',
-                             'object_name': this_object,
-                             'resource_name': resource_name_lookup[resc_id],
-                             'phy_path': row[1]})
-                    else:
-                        self.output_item(
-                            {'type': 'hardlink',
-                             'phy_path': row[1],
-                             'resource_name': resource_name_lookup[resc_id],
-                             'object1': this_object,
-                             'object2': other_object})
-                else:
-                    lookup_path[row[1]] = row[0]
-
-            cursor.close()
+            finally:
+                finder.close()
+
+        return issue_found
+
+    def _get_server_query(self, vault_path_lookup):
+        resc_condition = "resc_id IN ({})".format(",".join(str(resc_id) for resc_id in vault_path_lookup))
+        return """SELECT resc_id, data_path, array_agg(data_id ORDER BY data_id) FROM r_data_main {}
+                  GROUP BY resc_id, data_path HAVING count(*) > 1
+                  ORDER BY resc_id""".format(self._get_where_clause(resc_condition))
+
+    def _run_server(self, resource_name_lookup, vault_path_lookup):
+        '''Lets the database search for duplicate paths, so that only colliding paths are retrieved.'''
+        issue_found = False
+
+        if len(vault_path_lookup) == 0:
+            return False
 
+        cursor = self.get_cursor()
+        cursor.execute(self._get_server_query(vault_path_lookup))
+
+        while True:
+            rows = cursor.fetchmany(LOOKUP_BATCH_SIZE)
+            if len(rows) == 0:
+                break
+            issue_found = True
+            issues_per_resource = {}
+            for resc_id, data_path, data_ids in rows:
+                # Report every entry against the one with the lowest data id, like the client engine does.
+                issues = issues_per_resource.setdefault(resc_id, [])
+                for data_id in data_ids[1:]:
+                    issues.append((data_path, data_id, data_ids[0]))
+            for resc_id, issues in issues_per_resource.items():
+                self._output_issues(resource_name_lookup[resc_id], issues)
+
+        cursor.close()
         return issue_found
+
+    def _collect_scanned_rows(self, vault_path_lookup, finder, rows, column_index):
+        data_id_column = column_index['data_id']
+        resc_id_column = column_index['resc_id']
+        data_path_column = column_index['data_path']
+        for row in rows:
+            resc_id = row[resc_id_column]
+            if resc_id in vault_path_lookup:
+                finder.add(self._get_entry_hash(resc_id, row[data_path_column]), row[data_id_column])
+
+    def _check_collected_rows(self, resource_name_lookup, vault_path_lookup, finder):
+        try:
+            self._print_spill_progress(finder, "all resources")
+            if self._output_duplicate_groups(resource_name_lookup, vault_path_lookup, finder):
+                self.scan_issue_found = True
+        finally:
+            finder.close()
+
+    def _collect_scanned_batch(self, vault_path_lookup, finder, batch):
+        '''Selects the entries of the resources to check in a batch as arrays, and adds them to the
+           duplicate finder, like _collect_scanned_rows does.'''
+        checked = vectorized.is_in(batch.get_int_array('resc_id'), vault_path_lookup)
+        finder.add_batch(batch.get_hash_array('resc_id', 'data_path')[checked].tolist(),
+                         batch.get_int_array('data_id')[checked].tolist())
+
+    def register_scans(self, pipeline):
+        # Only the client engine checks rows one by one. Hard link checks of a subset of data objects also
+        # need other entries with the same path, so they cannot share a scan with other detectors.
+        if self.get_engine('client') != 'client' or len(self.get_table_conditions('r_data_main')) > 0:
+            return False
+        resource_name_lookup = self.get_resource_name_dict()
+        vault_path_lookup = self.get_resource_vault_path_dict()
+        finder = DuplicateFinder(self.args.hardlinks_memory_limit)
+        collect_scanned = self._collect_scanned_batch if self.args.vectorized else self._collect_scanned_rows
+        pipeline.register(
+            'r_data_main',
+            self.get_where_clause('r_data_main'),
+            ['data_id', 'resc_id', 'data_path'],
+            functools.partial(collect_scanned, vault_path_lookup, finder),
+            functools.partial(self._check_collected_rows, resource_name_lookup, vault_path_lookup, finder),
+            name=self.get_name(),
+            columnar=self.args.vectorized)
+        return True
+
+    def _get_checked_resources(self):
+        '''Returns the vault paths of the resources to check, by id: all unix file system resources,
+           or those of the shard if the detector runs on a shard of resources.'''
+        vault_path_lookup = self.get_resource_vault_path_dict()
+        if self.shard_resources is None:
+            return vault_path_lookup
+        return {resc_id: vault_path for resc_id, vault_path in vault_path_lookup.items()
+                if resc_id in self.shard_resources}
+
+    def get_queries(self):
+        vault_path_lookup = self._get_checked_resources()
+        if self.get_engine('client') == 'server':
+            if len(vault_path_lookup) == 0:
+                return []
+            return [(None, self._get_server_query(vault_path_lookup))]
+        resource_name_lookup = self.get_resource_name_dict()
+        return [(resource_name_lookup[resc_id], self._get_client_query(resc_id)) for resc_id in vault_path_lookup]
+
+    def can_check(self):
+        return len(self.get_resource_vault_path_dict()) > 0
+
+    def run(self):
+        resource_name_lookup = self.get_resource_name_dict()
+        vault_path_lookup = self._get_checked_resources()
+
+        if self.get_engine('client') == 'server':
+            return self._run_server(resource_name_lookup, vault_path_lookup)
+        else:
+            return self._run_client(resource_name_lookup, vault_path_lookup)
@@ -1,22 +1,40 @@
-from icat_tools import utils
+from icat_tools import vectorized
 from icat_tools.detectors.detector import Detector
+import functools
+
+# Number of data objects with too few replicas that are reported per name lookup batch
+VIOLATOR_BATCH_SIZE = 1000
 
 
 class MinreplicaIssueDetector(Detector):
+    shard_by = 'data_id'
+
     def get_name(self):
         return 'minreplicas'
 
-    def run(self):
-        issue_found = False
+    def _get_issue_key(self, issue):
+        data_id, number_replicas = issue
+        return [data_id, number_replicas, self.args.min_replicas]
 
-        if self.args.data_object_prefix is None:
-            query_condition = ""
-        else:
-            query_condition = "WHERE concat ( ( select coll_name from r_coll_main where coll_id = r_data_main.coll_id ), '/', r_data_main.data_name) LIKE '{}%'".format(self.args.data_object_prefix)
+    def _output_issues(self, issues):
+        issues = self.filter_known_issues(issues, self._get_issue_key)
+        names = self.get_dataobject_names([data_id for data_id, _ in issues])
+        for issue in issues:
+            data_id, number_replicas = issue
+            self.output_item({
+                'object_name': names.get(data_id),
+                'number_replicas': number_replicas,
+                'min_replicas': self.args.min_replicas},
+                self._get_issue_key(issue))
+
+    def _get_client_query(self):
+        return "SELECT data_id, resc_id FROM r_data_main {}".format(self.get_where_clause('r_data_main'))
+
+    def _run_client(self):
+        issue_found = False
 
-        query = "SELECT data_id, resc_id FROM r_data_main {}".format(query_condition)
-        cursor = self.connection.cursor(self.get_name())
-        cursor.execute(query)
+        cursor = self.get_cursor()
+        cursor.execute(self._get_client_query())
         data_resc_lookup = {}
 
         for row in cursor:
@@ -25,16 +43,122 @@ class MinreplicaIssueDetector(Detector):
                     data_resc_lookup[row[0]][row[1]] = ""
             else:
                 data_resc_lookup[row[0]] = {row[1]: ""}
+        cursor.close()
 
+        issues = []
         for data_id, resc_dict in data_resc_lookup.items():
             number_replicas = len(resc_dict.keys())
             if number_replicas < self.args.min_replicas:
                 issue_found = True
-                object_name = utils.get_dataobject_name(
-                    self.connection, data_id)
-                self.output_item({
-                    'object_name': object_name,
-                    'number_replicas': number_replicas,
-                    'min_replicas': self.args.min_replicas})
+                issues.append((data_id, number_replicas))
+                if len(issues) == VIOLATOR_BATCH_SIZE:
+                    self._output_issues(issues)
+                    issues = []
+        if len(issues) > 0:
+            self._output_issues(issues)
 
         return issue_found
+
+    def _get_server_query(self):
+        return """SELECT data_id, count(DISTINCT resc_id) FROM r_data_main {}
+                  GROUP BY data_id HAVING count(DISTINCT resc_id) < {}
+                  ORDER BY data_id""".format(self.get_where_clause('r_data_main'), int(self.args.min_replicas))
+
+    def _run_server(self):
+        '''Lets the database count the replicas, and streams only the data objects that have too few
+           replicas. Names are resolved per batch of violators.'''
+        issue_found = False
+
+        if self.args.min_replicas <= 1:
+            # Every data object in r_data_main has at least one replica entry.
+            return False
+
+        cursor = self.get_cursor()
+        cursor.execute(self._get_server_query())
+
+        while True:
+            issues = cursor.fetchmany(VIOLATOR_BATCH_SIZE)
+            if len(issues) == 0:
+                break
+            issue_found = True
+            self._output_issues(issues)
+
+        cursor.close()
+        return issue_found
+
+    def _collect_scanned_rows(self, data_resc_lookup, rows, column_index):
+        data_id_column = column_index['data_id']
+        resc_id_column = column_index['resc_id']
+        for row in rows:
+            data_resc_lookup.setdefault(row[data_id_column], set()).add(row[resc_id_column])
+
+    def _check_collected_rows(self, data_resc_lookup):
+        issues = []
+        for data_id, resc_ids in data_resc_lookup.items():
+            if len(resc_ids) < self.args.min_replicas:
+                issues.append((data_id, len(resc_ids)))
+                if len(issues) == VIOLATOR_BATCH_SIZE:
+                    self._output_issues(issues)
+                    issues = []
+                self.scan_issue_found = True
+        if len(issues) > 0:
+            self._output_issues(issues)
+
+    def _collect_scanned_batch(self, data_ids, resc_ids, batch):
+        data_ids.append(batch.get_int_array('data_id'))
+        resc_ids.append(batch.get_int_array('resc_id'))
+
+    def _check_collected_batches(self, data_ids, resc_ids):
+        '''Counts the replicas of all collected data objects at once.'''
+        data_id_values, replica_counts = vectorized.get_distinct_pair_counts(
+            vectorized.concatenate(data_ids), vectorized.concatenate(resc_ids))
+        data_ids.clear()
+        resc_ids.clear()
+        violators = (replica_counts < self.args.min_replicas).nonzero()[0]
+        for start in range(0, len(violators), VIOLATOR_BATCH_SIZE):
+            positions = violators[start:start + VIOLATOR_BATCH_SIZE]
+            self._output_issues(list(zip(data_id_values[positions].tolist(), replica_counts[positions].tolist())))
+            self.scan_issue_found = True
+
+    def register_scans(self, pipeline):
+        # Only the client engine checks rows one by one
+        if self.get_engine('server') != 'client':
+            return False
+        if self.args.vectorized:
+            data_ids = []
+            resc_ids = []
+            pipeline.register(
+                'r_data_main',
+                self.get_where_clause('r_data_main'),
+                ['data_id', 'resc_id'],
+                functools.partial(self._collect_scanned_batch, data_ids, resc_ids),
+                functools.partial(self._check_collected_batches, data_ids, resc_ids),
+                name=self.get_name(),
+                columnar=True)
+            return True
+        data_resc_lookup = {}
+        pipeline.register(
+            'r_data_main',
+            self.get_where_clause('r_data_main'),
+            ['data_id', 'resc_id'],
+            functools.partial(self._collect_scanned_rows, data_resc_lookup),
+            functools.partial(self._check_collected_rows, data_resc_lookup),
+            name=self.get_name())
+        return True
+
+    def get_queries(self):
+        if self.get_engine('server') == 'client':
+            return [(None, self._get_client_query())]
+        if self.args.min_replicas <= 1:
+            return []
+        return [(None, self._get_server_query())]
+
+    def can_check(self):
+        # Every data object in r_data_main has at least one replica entry
+        return self.args.min_replicas > 1
+
+    def run(self):
+        if self.get_engine('server') == 'server':
+            return self._run_server()
+        else:
+            return self._run_client()
@@ -2,6 +2,9 @@ from icat_tools.detectors.detector import Detector
 import os
 import re
 
+# Query of the names of the indexes in the database
+ACTUAL_INDEXES_QUERY = "SELECT indexname FROM pg_indexes WHERE schemaname = 'public' ORDER BY indexname"
+
 
 class MissingIndexDetector(Detector):
 
@@ -12,10 +15,14 @@ class MissingIndexDetector(Detector):
         return "/var/lib/irods/packaging/sql/icatSysTables.sql"
 
     def _get_actual_indexes(self):
-        query = "SELECT indexname FROM pg_indexes WHERE schemaname = 'public' ORDER BY indexname"
-        cursor = self.connection.cursor("missing_indexes")
-        cursor.execute(query)
-        return [r[0] for r in list(cursor)]
+        if self.args.snapshot is not None:
+            return [row[0] for rows in self.connection.scan('pg_indexes', ['indexname'], self.args.fetch_size)
+                    for row in rows]
+        cursor = self.get_cursor("missing_indexes")
+        cursor.execute(ACTUAL_INDEXES_QUERY)
+        result = [r[0] for r in cursor]
+        cursor.close()
+        return result
 
     def _get_expected_indexes(self):
         results = []
@@ -27,10 +34,37 @@ class MissingIndexDetector(Detector):
                     results.append(index.group(1))
         return results
 
+    def _get_expected_index_definitions(self):
+        '''Returns the table (in lower case) and the columns of every index in the SQL file, by name.'''
+        results = {}
+        with open(self._get_expected_index_filename(), 'r') as sqlfile:
+            for line in sqlfile:
+                index = re.search(
+                    r"^create(?:\s+unique)?\s+index\s+(\S+)\s+on\s+(\w+)\s*\(([^)]*)\)", line)
+                if index is not None:
+                    results[index.group(1)] = (
+                        index.group(2).lower(), [column.strip().lower() for column in index.group(3).split(",")])
+        return results
+
+    def get_missing_index_definitions(self):
+        '''Returns the table and the columns of every index in the SQL file that is missing in the
+           database, by name, or None if the SQL file is not found.'''
+        if not os.path.isfile(self._get_expected_index_filename()):
+            return None
+        actual_indexes = self._get_actual_indexes()
+        return {index: definition for index, definition in self._get_expected_index_definitions().items()
+                if index not in actual_indexes}
+
+    def get_queries(self):
+        return [(None, ACTUAL_INDEXES_QUERY)]
+
+    def can_check(self):
+        return os.path.isfile(self._get_expected_index_filename())
+
     def run(self):
         issue_found = False
 
-        if not os.path.isfile(self._get_expected_index_filename()):
+        if not self.can_check():
             self.print_error(
                 "Index SQL file not found. Skipping missing index test.")
             return False
@@ -1,8 +1,21 @@
-from icat_tools import utils
 from icat_tools.detectors.detector import Detector
+import functools
+import psycopg2.extensions
+import re
+
+# Characters that iRODS processes incorrectly, as a regular expression for the database
+BUGGY_CHARACTERS_SQL_PATTERN = r"[\`\x01\x02\x03\x04\x05\x06\x07\x08\x0b\x0c\x0e\x0f\x10\x11\x12\x13\x14\x15\x16\x17\x18\x19\x1a\x1b\x1c\x1d\x1e\x1f]"
+
+# The same characters, for names that are checked in the checker. These are ASCII characters, which
+# cannot occur as part of a multibyte character in UTF-8, so undecoded names can be checked as well.
+BUGGY_CHARACTERS_PATTERN = re.compile('[`\x01-\x08\x0b\x0c\x0e-\x1f]')
+BUGGY_CHARACTERS_BYTES_PATTERN = re.compile(b'[`\x01-\x08\x0b\x0c\x0e-\x1f]')
 
 
 class NameIssueDetector(Detector):
+    incremental = True
+    sampled = True
+    chunk_data_objects = True
 
     def get_name(self):
         return "names"
@@ -29,70 +42,164 @@ class NameIssueDetector(Detector):
                 'table': 'r_zone_main',
                 'report_columns': ['zone_id', 'zone_name'],
                 'name': 'zone_name'}}
-        return data.items()
-
-    def _get_prefix_condition(self,table):
-        if table == 'r_data_main' and self.args.data_object_prefix is not None:
-            return "AND concat ( ( select coll_name from r_coll_main where coll_id = r_data_main.coll_id ), '/', r_data_main.data_name) LIKE '{}%'".format(self.args.data_object_prefix)
-        else:
-            return ""
-
-    def _check_name_empty(self, table, name, report_columns):
-        query = "SELECT {} FROM {} WHERE {} = '' {}".format(
-            ",".join(report_columns), table, name, self._get_prefix_condition(table))
-        cursor = self.connection.cursor("{}._check_name_empty".format(self.get_name()))
-        cursor.execute(query)
-        return cursor
-
-    def _check_name_buggy_characters(self, table, name, report_columns):
-        query = r"SELECT {} FROM {} WHERE {} ~ '[\`\x01\x02\x03\x04\x05\x06\x07\x08\x0b\x0c\x0e\x0f\x10\x11\x12\x13\x14\x15\x16\x17\x18\x19\x1a\x1b\x1c\x1d\x1e\x1f]' {}".format( ",".join(report_columns), table, name, self._get_prefix_condition(table))
-        cursor = self.connection.cursor("{}._check_buggy_characters".format(self.get_name()))
-        cursor.execute(query)
-        return cursor
+        return [(check_name, check_params) for check_name, check_params in data.items()
+                if self.is_table_checked(check_params['table'])]
 
-    def run(self):
+    def _get_names_query(self, table, name, report_columns):
+        '''Returns a query that selects the rows of a table with an empty name or a name with problematic
+           characters, in a single scan. The report columns are followed by a flag that tells whether
+           the name is empty.'''
+        condition = "{0} = '' OR {0} ~ '{1}'".format(name, BUGGY_CHARACTERS_SQL_PATTERN)
+        return "SELECT {}, {} = '' FROM {} {}".format(
+            ",".join(report_columns), name, self.get_table_reference(table), self.get_where_clause(table, [condition]))
+
+    def _get_issue_key(self, check_name, report_columns, column_index, issue):
+        issue_type, row = issue
+        return [check_name, issue_type, [str(row[column_index[report_column]]) for report_column in report_columns]]
+
+    def _output_issues(self, check_name, report_columns, issues, column_index):
+        '''Reports a list of issues, which are (type, row) tuples. Collection names are looked up
+           in bulk.'''
+        get_key = functools.partial(self._get_issue_key, check_name, report_columns, column_index)
+        issues = self.filter_known_issues(issues, get_key)
+        if 'coll_id' in report_columns:
+            coll_names = self.get_collection_names(
+                {row[column_index['coll_id']] for issue_type, row in issues if issue_type == 'buggy_characters'})
+        for issue in issues:
+            issue_type, row = issue
+            output = {'type': issue_type, 'check_name': check_name, 'report_columns': {}}
+            for report_column in report_columns:
+                if str(report_column) == 'coll_id' and issue_type == 'buggy_characters':
+                    coll_name = coll_names.get(row[column_index[report_column]])
+                    if coll_name is not None:
+                        output['report_columns']['Collection name'] = coll_name
+                else:
+                    output['report_columns'][str(report_column)] = str(row[column_index[report_column]])
+            self.output_item(output, get_key(issue))
+
+    def _check_scanned_rows(self, check_name, name, report_columns, rows, column_index):
+        name_column = column_index[name]
+        issues = []
+        for row in rows:
+            if row[name_column] == '':
+                issues.append(('empty_name', row))
+            elif row[name_column] is not None and BUGGY_CHARACTERS_PATTERN.search(row[name_column]):
+                issues.append(('buggy_characters', row))
+        if len(issues) > 0:
+            self._output_issues(check_name, report_columns, issues, column_index)
+            self.scan_issue_found = True
+
+    def _output_rows(self, check_name, report_columns, rows):
+        '''Reports the rows of a query of _get_names_query.'''
+        column_index = {column: index for index, column in enumerate(report_columns)}
+        issues = [('empty_name' if row[-1] else 'buggy_characters', row) for row in rows]
+        self._output_issues(check_name, report_columns, issues, column_index)
+
+    def _run_server(self, check_name, table, name, report_columns):
         issue_found = False
-        for check_name, check_params in self._get_name_check_data():
-            if self.args.v:
-                self.print_progress("Running empty name test for: " + check_name)
-
-            result_empty = self._check_name_empty(
-                check_params['table'],
-                check_params['name'],
-                check_params['report_columns'])
-            for row in result_empty:
-                output = {'type': 'empty_name', 'check_name' : check_name, 'report_columns': {}}
-                column_num = 0
-                for report_column in check_params['report_columns']:
-                    output['report_columns'][str(report_column)] = str(
-                        row[column_num])
-                    column_num = column_num + 1
-                self.output_item(output)
+        cursor = self.get_cursor("{}._check_names".format(self.get_name()))
+        cursor.execute(self._get_names_query(table, name, report_columns))
+        while True:
+            rows = cursor.fetchmany(self.args.fetch_size)
+            if len(rows) == 0:
+                break
+            self._output_rows(check_name, report_columns, rows)
+            issue_found = True
+        cursor.close()
+        self.count_sampled_rows([check_name], table)
+        return issue_found
+
+    def _run_concurrently(self):
+        issue_found = False
+        check_data = dict(self._get_name_check_data())
+        queries = [(check_name, [self._get_names_query(check_params['table'], check_params['name'],
+                                                       check_params['report_columns'])])
+                   for check_name, check_params in check_data.items()]
+
+        def output_rows(check_name, rows, alternative):
+            nonlocal issue_found
+            if len(rows) > 0:
+                self._output_rows(check_name, check_data[check_name]['report_columns'], rows)
                 issue_found = True
-            result_empty.close()
-
-            if self.args.v:
-                self.print_progress("Running problematic character name test for: " + check_name)
-
-            result_buggy_characters = self._check_name_buggy_characters(
-                check_params['table'],
-                check_params['name'],
-                check_params['report_columns'])
-            for row in result_buggy_characters:
-                output = {'type': 'buggy_characters', 'check_name' : check_name, 'report_columns': {}}
-                column_num = 0
-                for report_column in check_params['report_columns']:
-                    if str(report_column) == 'coll_id':
-                        coll_name = utils.get_collection_name(
-                            self.connection, str(row[column_num]))
-                        if coll_name is not None:
-                            output['report_columns']['Collection name'] = coll_name
-                    else:
-                        output['report_columns'][str(report_column)] = str(
-                            row[column_num])
-                    column_num = column_num + 1
-                self.output_item(output)
+
+        self.run_queries_concurrently(queries, output_rows)
+        return issue_found
+
+    def _get_client_columns(self, name, report_columns):
+        return report_columns + [name] if name not in report_columns else report_columns
+
+    def _get_client_query(self, table, columns):
+        return "SELECT {} FROM {} {}".format(",".join(columns), self.get_table_reference(table),
+                                             self.get_where_clause(table))
+
+    def _run_client(self, check_name, table, name, report_columns):
+        '''Retrieves the names of all rows, and checks them in the checker. Names are not decoded
+           unless they have an issue, so that this only takes little CPU time.'''
+        issue_found = False
+        columns = self._get_client_columns(name, report_columns)
+        column_index = {column: index for index, column in enumerate(columns)}
+        name_column = column_index[name]
+        encoding = psycopg2.extensions.encodings[self.connection.encoding]
+        cursor = self.get_cursor("{}._check_names".format(self.get_name()))
+        psycopg2.extensions.register_type(psycopg2.extensions.BYTES, cursor)
+        cursor.execute(self._get_client_query(table, columns))
+        while True:
+            rows = cursor.fetchmany(self.args.fetch_size)
+            if len(rows) == 0:
+                break
+            self.record_sampled_rows([check_name], len(rows))
+            issues = []
+            for row in rows:
+                if row[name_column] == b'':
+                    issues.append(('empty_name', row))
+                elif row[name_column] is not None and BUGGY_CHARACTERS_BYTES_PATTERN.search(row[name_column]):
+                    issues.append(('buggy_characters', row))
+            if len(issues) > 0:
+                issues = [(issue_type, [value.decode(encoding) if isinstance(value, bytes) else value for value in row])
+                          for issue_type, row in issues]
+                self._output_issues(check_name, report_columns, issues, column_index)
                 issue_found = True
-            result_buggy_characters.close()
+        cursor.close()
+        return issue_found
+
+    def register_scans(self, pipeline):
+        for check_name, check_params in self._get_name_check_data():
+            table = check_params['table']
+            pipeline.register(
+                table,
+                self.get_where_clause(table),
+                check_params['report_columns'] + [check_params['name']],
+                functools.partial(self._check_scanned_rows, check_name, check_params['name'],
+                                  check_params['report_columns']),
+                name=self.get_name())
+        return True
+
+    def get_queries(self):
+        queries = []
+        for check_name, check_params in self._get_name_check_data():
+            if self.get_engine('server') == 'server':
+                query = self._get_names_query(check_params['table'], check_params['name'], check_params['report_columns'])
+            else:
+                query = self._get_client_query(
+                    check_params['table'], self._get_client_columns(check_params['name'], check_params['report_columns']))
+            queries.append((check_name, query))
+        return queries
+
+    def run(self):
+        if self.args.concurrent_queries > 1 and self.get_engine('server') == 'server':
+            return self._run_concurrently()
+
+        issue_found = False
+        for check_name, check_params in self._get_name_check_data():
+            with self.measure(check_name):
+                if self.args.v:
+                    self.print_progress("Running empty name and problematic character name tests for: " + check_name)
+
+                if self.get_engine('server') == 'server':
+                    run_check = self._run_server
+                else:
+                    run_check = self._run_client
+                if run_check(check_name, check_params['table'], check_params['name'], check_params['report_columns']):
+                    issue_found = True
 
         return issue_found
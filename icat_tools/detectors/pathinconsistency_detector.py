@@ -1,43 +1,214 @@
 from icat_tools import utils
 from icat_tools.detectors.detector import Detector
+import functools
 import pathlib
 
 
+def is_path_consistent(vault_path, coll_name, data_path):
+    '''Checks whether the directory of a physical path corresponds with the collection name,
+       by comparing normalized paths. This is the reference implementation of the check.'''
+    vaultpath = pathlib.Path(vault_path)
+    dirname = pathlib.Path(*pathlib.Path(data_path).parts[:-1])
+    try:
+        dirname_without_vault = dirname.relative_to(vaultpath)
+    except ValueError:
+        # Physical path is not in the vault of the resource
+        return False
+    collname_parts = pathlib.Path(coll_name).parts
+    collname_parts_without_zone = list(collname_parts[2:])
+    collname_without_zone = pathlib.Path(*collname_parts_without_zone)
+    return collname_without_zone == dirname_without_vault
+
+
+class PathConsistencyChecker(object):
+    '''Checks path consistency using plain string comparisons. The expected directory of each
+       combination of resource and collection is computed only once. Paths that do not match the
+       expected directory exactly are checked again using is_path_consistent, so that paths which
+       are only written differently (e.g. with double slashes) are not reported.'''
+
+    def __init__(self, vault_path_lookup, coll_path_lookup):
+        self.vault_prefixes = {resc_id: str(pathlib.Path(vault_path))
+                               for resc_id, vault_path in vault_path_lookup.items()}
+        self.vault_path_lookup = vault_path_lookup
+        self.coll_path_lookup = coll_path_lookup
+        self.expected_dirs = {}
+
+    def _get_expected_dir(self, resc_id, coll_id):
+        key = (resc_id, coll_id)
+        expected_dir = self.expected_dirs.get(key)
+        if expected_dir is None:
+            coll_parts = pathlib.Path(self.coll_path_lookup[coll_id]).parts[2:]
+            if len(coll_parts) == 0:
+                expected_dir = self.vault_prefixes[resc_id]
+            else:
+                expected_dir = self.vault_prefixes[resc_id] + "/" + "/".join(coll_parts)
+            self.expected_dirs[key] = expected_dir
+        return expected_dir
+
+    def is_consistent(self, resc_id, coll_id, data_path):
+        if data_path[:data_path.rfind("/")] == self._get_expected_dir(resc_id, coll_id):
+            return True
+        return is_path_consistent(self.vault_path_lookup[resc_id],
+                                  self.coll_path_lookup[coll_id],
+                                  data_path)
+
+
 class PathInconsistencyDetector(Detector):
+    shard_by = 'data_id'
+    sampled = True
+    incremental = True
+
+    # Paths of all collections, by id, once they have been loaded
+    coll_path_lookup = None
+
     def get_name(self):
         return "path_consistency"
 
-    def run(self):
+    def get_incremental_condition(self, table):
+        condition = super().get_incremental_condition(table)
+        coll_condition = super().get_incremental_condition('r_coll_main')
+        if table == 'r_data_main' and condition is not None and coll_condition is not None:
+            # Renaming a collection changes the expected paths of its data objects
+            condition = "( {} ) OR r_data_main.coll_id IN ( SELECT coll_id FROM r_coll_main WHERE {} )".format(
+                condition, coll_condition)
+        return condition
+
+    def _get_resource_condition(self, resource_path_lookup):
+        return "r_data_main.resc_id IN ({})".format(
+            ",".join(str(resc_id) for resc_id in resource_path_lookup))
+
+    def _get_coll_path_lookup(self):
+        # Chunked runs call run() for every chunk, but only need to load the collections once
+        if self.coll_path_lookup is None:
+            self.coll_path_lookup = self.get_coll_path_dict()
+        return self.coll_path_lookup
+
+    def _is_known_collection(self, coll_path_lookup, coll_id):
+        '''Returns whether the collection of a data object exists. Data objects in collections that do not
+           exist are reported by the referential integrity test, and are skipped here, as in the
+           server engine, which joins them with their collections.'''
+        if coll_id not in coll_path_lookup:
+            # The collection may have been created after the collections were loaded
+            coll_path_lookup.update((coll_id, coll_name) for coll_id, coll_name
+                                    in self.get_collection_names([coll_id]).items() if coll_name is not None)
+        return coll_id in coll_path_lookup
+
+    def _get_client_query(self, resource_path_lookup):
+        return "SELECT data_name, coll_id, resc_id, data_path FROM {} {}".format(
+            self.get_table_reference('r_data_main'), self.get_where_clause('r_data_main', [self._get_resource_condition(resource_path_lookup)]))
+
+    def _run_client(self, resource_path_lookup, resource_name_lookup):
         issue_found = False
-        resource_path_lookup = utils.get_resource_vault_path_dict(
-            self.connection)
-        resource_name_lookup = utils.get_resource_name_dict(self.connection)
-        coll_path_lookup = utils.get_coll_path_dict(self.connection)
+        coll_path_lookup = self._get_coll_path_lookup()
+        checker = PathConsistencyChecker(resource_path_lookup, coll_path_lookup)
 
-        if self.args.data_object_prefix is None:
-            query_condition = ""
-        else:
-            query_condition = "WHERE concat ( ( select coll_name from r_coll_main where coll_id = r_data_main.coll_id ), '/', r_data_main.data_name) LIKE '{}%'".format(
-                        self.args.data_object_prefix)
+        cursor = self.get_cursor()
+        cursor.execute(self._get_client_query(resource_path_lookup))
 
-        query = "SELECT data_name, coll_id, resc_id, data_path FROM r_data_main {}".format(query_condition)
-        cursor = self.connection.cursor(self.get_name())
-        cursor.execute(query)
+        number_rows = 0
+        for row in cursor:
+            number_rows += 1
+            if not self._is_known_collection(coll_path_lookup, row[1]):
+                continue
+            if not checker.is_consistent(row[2], row[1], row[3]):
+                self.output_item({
+                    'resource_name': resource_name_lookup[row[2]],
+                    'phy_path': row[3],
+                    'data_name': "{}/{}".format(coll_path_lookup[row[1]], row[0])})
+                issue_found = True
+
+        cursor.close()
+        self.record_sampled_rows([None], number_rows)
+        return issue_found
+
+    def _get_server_query(self, resource_path_lookup):
+        vault_values = ",".join(
+            "({}, {})".format(resc_id, utils.quote_literal(self.connection, str(pathlib.Path(vault_path))))
+            for resc_id, vault_path in resource_path_lookup.items())
+        expected_dir = r"""vaults.vault_path || CASE WHEN regexp_replace(r_coll_main.coll_name, '^/[^/]*/?', '') = ''
+                           THEN '' ELSE '/' || regexp_replace(r_coll_main.coll_name, '^/[^/]*/?', '') END"""
+        mismatch_condition = "substring(r_data_main.data_path from '^(.*)/[^/]*$') IS DISTINCT FROM {}".format(expected_dir)
+        return """SELECT r_data_main.data_name, r_coll_main.coll_name, r_data_main.resc_id, r_data_main.data_path
+                  FROM {}
+                  JOIN r_coll_main ON r_coll_main.coll_id = r_data_main.coll_id
+                  JOIN ( VALUES {} ) AS vaults (resc_id, vault_path) ON vaults.resc_id = r_data_main.resc_id
+                  {}""".format(self.get_table_reference('r_data_main'), vault_values,
+                                self.get_where_clause('r_data_main', [mismatch_condition]))
+
+    def _run_server(self, resource_path_lookup, resource_name_lookup):
+        '''Lets the database compute the expected directory of each data object, so that only
+           data objects with a (potentially) inconsistent path are retrieved.'''
+        issue_found = False
+
+        cursor = self.get_cursor()
+        cursor.execute(self._get_server_query(resource_path_lookup))
 
         for row in cursor:
-            vaultpath = pathlib.Path(resource_path_lookup[row[2]])
-            dirname = pathlib.Path(*pathlib.Path(row[3]).parts[:-1])
-            dirname_without_vault = dirname.relative_to(vaultpath)
-            collname = coll_path_lookup[row[1]]
-            collname_parts = pathlib.Path(collname).parts
-            collname_parts_without_zone = list(collname_parts[2:])
-            collname_without_zone = pathlib.Path(*collname_parts_without_zone)
-            if collname_without_zone != dirname_without_vault:
+            # The database compares paths as strings. Confirm the mismatch with normalized paths.
+            if not is_path_consistent(resource_path_lookup[row[2]], row[1], row[3]):
                 self.output_item({
                     'resource_name': resource_name_lookup[row[2]],
                     'phy_path': row[3],
-                    'data_name': "{}/{}".format(collname,row[0])})
+                    'data_name': "{}/{}".format(row[1], row[0])})
                 issue_found = True
 
         cursor.close()
+        self.count_sampled_rows([None], 'r_data_main', [self._get_resource_condition(resource_path_lookup)])
         return issue_found
+
+    def _check_scanned_rows(self, checker, resource_name_lookup, coll_path_lookup, rows, column_index):
+        data_name_column = column_index['data_name']
+        coll_id_column = column_index['coll_id']
+        resc_id_column = column_index['resc_id']
+        data_path_column = column_index['data_path']
+        for row in rows:
+            if row[resc_id_column] not in checker.vault_path_lookup:
+                continue
+            if not self._is_known_collection(coll_path_lookup, row[coll_id_column]):
+                continue
+            if not checker.is_consistent(row[resc_id_column], row[coll_id_column], row[data_path_column]):
+                self.output_item({
+                    'resource_name': resource_name_lookup[row[resc_id_column]],
+                    'phy_path': row[data_path_column],
+                    'data_name': "{}/{}".format(coll_path_lookup[row[coll_id_column]], row[data_name_column])})
+                self.scan_issue_found = True
+
+    def register_scans(self, pipeline):
+        if self.get_engine('client') != 'client':
+            return False
+        resource_path_lookup = self.get_resource_vault_path_dict()
+        resource_name_lookup = self.get_resource_name_dict()
+        coll_path_lookup = self.get_coll_path_dict()
+        checker = PathConsistencyChecker(resource_path_lookup, coll_path_lookup)
+        pipeline.register(
+            'r_data_main',
+            self.get_where_clause('r_data_main'),
+            ['data_name', 'coll_id', 'resc_id', 'data_path'],
+            functools.partial(self._check_scanned_rows, checker, resource_name_lookup, coll_path_lookup),
+            name=self.get_name())
+        return True
+
+    def get_queries(self):
+        resource_path_lookup = self.get_resource_vault_path_dict()
+        if len(resource_path_lookup) == 0:
+            return []
+        if self.get_engine('client') == 'server':
+            return [(None, self._get_server_query(resource_path_lookup))]
+        else:
+            return [('collections', utils.COLL_PATH_QUERY),
+                    ('data objects', self._get_client_query(resource_path_lookup))]
+
+    def can_check(self):
+        return len(self.get_resource_vault_path_dict()) > 0
+
+    def run(self):
+        resource_path_lookup = self.get_resource_vault_path_dict()
+        resource_name_lookup = self.get_resource_name_dict()
+
+        if len(resource_path_lookup) == 0:
+            return False
+
+        if self.get_engine('client') == 'server':
+            return self._run_server(resource_path_lookup, resource_name_lookup)
+        else:
+            return self._run_client(resource_path_lookup, resource_name_lookup)
@@ -1,141 +1,284 @@
 from icat_tools.detectors.detector import Detector
+import functools
 
 
 class RefIntegrityIssueDetector(Detector):
+    sampled = True
+    chunk_data_objects = True
+
     def get_name(self):
         return "ref_integrity"
 
     def _get_ref_integrity_data(self):
+        '''Returns the referential integrity checks. A row of the table of a check has an issue if it
+           meets all conditions, if the values of all missing_references are not found in the
+           referenced tables, and if the values of all existing_references are found in the
+           referenced tables. References are (column, referenced table, referenced column) tuples.'''
         data = {
             'collection and data object have same id': {
                 'table': 'r_coll_main',
                 'report_columns': ['coll_id'],
-                'conditions': ['coll_id IN ( SELECT data_id FROM r_data_main)']},
+                'existing_references': [('coll_id', 'r_data_main', 'data_id')]},
             'parent of collection does not exist': {
                 'table': 'r_coll_main',
                 'report_columns': ['coll_name'],
-                'conditions': ['parent_coll_name NOT IN ( SELECT coll_name from r_coll_main)']},
+                'missing_references': [('parent_coll_name', 'r_coll_main', 'coll_name')]},
             'collection of data object does not exist': {
                 'table': 'r_data_main',
                 'report_columns': [
                     'coll_id',
                     'data_id',
                     'data_name'],
-                'conditions': ['coll_id NOT IN ( SELECT coll_id from r_coll_main)']},
+                'missing_references': [('coll_id', 'r_coll_main', 'coll_id')]},
             'resource of data object does not exist': {
                 'table': 'r_data_main',
                 'report_columns': [
                     'coll_id',
                     'data_id',
                     'data_name'],
-                'conditions': ['resc_id NOT IN ( SELECT resc_id from r_resc_main)']},
+                'missing_references': [('resc_id', 'r_resc_main', 'resc_id')]},
             'object of object access does not exist': {
                 'table': 'r_objt_access',
                 'report_columns': [
                     'object_id',
                     'user_id'],
-                'conditions': [
-                    'object_id not in ( SELECT coll_id from r_coll_main)',
-                    'object_id not in (SELECT data_id from r_data_main)']},
+                'missing_references': [
+                    ('object_id', 'r_coll_main', 'coll_id'),
+                    ('object_id', 'r_data_main', 'data_id')]},
             'user of object access does not exist': {
                 'table': 'r_objt_access',
                 'report_columns': [
                     'object_id',
                     'user_id'],
-                'conditions': ['user_id not in ( SELECT user_id from r_user_main)']},
+                'missing_references': [('user_id', 'r_user_main', 'user_id')]},
             'metamap refers no nonexistent object': {
                 'table': 'r_objt_metamap',
                 'report_columns': [
                     'object_id',
                     'meta_id'],
-                'conditions': [
-                    'object_id not in ( SELECT coll_id from r_coll_main)',
-                    'object_id not in (SELECT data_id from r_data_main)',
-                    'object_id not in (SELECT user_id from r_user_main)',
-                    'object_id not in (SELECT resc_id from r_resc_main)']},
+                'missing_references': [
+                    ('object_id', 'r_coll_main', 'coll_id'),
+                    ('object_id', 'r_data_main', 'data_id'),
+                    ('object_id', 'r_user_main', 'user_id'),
+                    ('object_id', 'r_resc_main', 'resc_id')]},
             'metamap refers to nonexistent metadata entry': {
                 'table': 'r_objt_metamap',
                 'report_columns': [
                     'object_id',
                     'meta_id'],
-                'conditions': ['meta_id not in (select meta_id from r_meta_main)']},
+                'missing_references': [('meta_id', 'r_meta_main', 'meta_id')]},
             'main quota table refers to nonexistent user': {
                 'table': 'r_quota_main',
                 'report_columns': [
                     'user_id',
                     'resc_id'],
-                'conditions': ['user_id not in (SELECT user_id from r_user_main)']},
+                'missing_references': [('user_id', 'r_user_main', 'user_id')]},
             'main quota table refers to nonexistent resource': {
                 'table': 'r_quota_main',
                 'report_columns': [
                     'user_id',
                     'resc_id'],
-                'conditions': ['resc_id not in (SELECT resc_id from r_resc_main)']},
+                'missing_references': [('resc_id', 'r_resc_main', 'resc_id')]},
             'quota usage table refers to nonexistent user': {
                 'table': 'r_quota_usage',
                 'report_columns': [
                     'user_id',
                     'resc_id'],
-                'conditions': ['user_id not in (SELECT user_id from r_user_main)']},
+                'missing_references': [('user_id', 'r_user_main', 'user_id')]},
             'quota usage table refers to nonexistent resource': {
                 'table': 'r_quota_usage',
                 'report_columns': [
                     'user_id',
                     'resc_id'],
-                'conditions': ['resc_id not in (SELECT resc_id from r_resc_main)']},
+                'missing_references': [('resc_id', 'r_resc_main', 'resc_id')]},
             'resource refers to nonexistent parent resource': {
                 'table': 'r_resc_main',
                 'report_columns': ['resc_name'],
-                'conditions': [
-                    '( resc_parent = \'\' ) IS FALSE',
-                    'CAST(resc_parent AS bigint) not in (SELECT resc_id from r_resc_main)']},
+                'conditions': ['r_resc_main.resc_parent <> \'\''],
+                'missing_references': [
+                    ('CAST(NULLIF(r_resc_main.resc_parent, \'\') AS bigint)', 'r_resc_main', 'resc_id')]},
             'user refers to nonexistent zone name': {
                 'table': 'r_user_main',
                 'report_columns': [
                     'user_id',
                     'zone_name'],
-                'conditions': ['zone_name not in (select zone_name from r_zone_main)']},
+                'missing_references': [('zone_name', 'r_zone_main', 'zone_name')]},
             'user password table refers to nonexistent user': {
                 'table': 'r_user_password',
                 'report_columns': ['user_id'],
-                'conditions': ['user_id not in (select user_id from r_user_main)']}}
+                'missing_references': [('user_id', 'r_user_main', 'user_id')]}}
 
-        return data.items()
+        return [(check_name, check_params) for check_name, check_params in data.items()
+                if self.is_table_checked(check_params['table'])]
 
-    def _check_ref_integrity(self, table, report_columns, conditions):
-        query = "SELECT {} FROM {} WHERE {}".format(
-                ",".join(report_columns),
-                table,
-                " AND ".join(conditions))
-        cursor = self.connection.cursor()
+    def _get_checks_per_table(self):
+        '''Returns the checks grouped by table, in order of first appearance.'''
+        checks_per_table = {}
+        for check_name, check_params in self._get_ref_integrity_data():
+            checks_per_table.setdefault(check_params['table'], []).append((check_name, check_params))
+        return checks_per_table.items()
+
+    def _get_column_expression(self, table, column):
+        if column.isidentifier():
+            return "{}.{}".format(table, column)
+        else:
+            return column
+
+    def _get_anti_join_condition(self, table, check_params):
+        '''Returns the condition of a check as EXISTS / NOT EXISTS subqueries, which the database can
+           run as (anti-)joins.'''
+        conditions = list(check_params.get('conditions', []))
+        for column, ref_table, ref_column in check_params.get('missing_references', []):
+            expression = self._get_column_expression(table, column)
+            if "{} IS NOT NULL".format(expression) not in conditions:
+                conditions.append("{} IS NOT NULL".format(expression))
+            conditions.append("NOT EXISTS ( SELECT 1 FROM {} AS ref WHERE ref.{} = {} )".format(
+                ref_table, ref_column, expression))
+        for column, ref_table, ref_column in check_params.get('existing_references', []):
+            conditions.append("EXISTS ( SELECT 1 FROM {} AS ref WHERE ref.{} = {} )".format(
+                ref_table, ref_column, self._get_column_expression(table, column)))
+        return " AND ".join(conditions)
+
+    def _get_single_check_query(self, table, check_params):
+        return "SELECT {} FROM {} {}".format(
+            ",".join("{}.{}".format(table, column) for column in check_params['report_columns']),
+            self.get_table_reference(table),
+            self.get_where_clause(table, [self._get_anti_join_condition(table, check_params)]))
+
+    def _get_combined_query(self, table, checks):
+        '''Returns a query that performs all checks on a table in a single scan. The query returns the
+           report columns of all checks, followed by a flag for each check that tells whether the row
+           fails it. The flags are evaluated with the EXISTS / NOT EXISTS subqueries of the single check
+           queries. The flags in the select list are only evaluated for rows that fail a check.'''
+        columns = []
+        for check_name, check_params in checks:
+            for column in check_params['report_columns']:
+                if column not in columns:
+                    columns.append(column)
+        check_conditions = [self._get_anti_join_condition(table, check_params) for _, check_params in checks]
+
+        select_list = ["{}.{}".format(table, column) for column in columns]
+        select_list += ["( {} ) IS TRUE".format(condition) for condition in check_conditions]
+        query = "SELECT {} FROM {} {}".format(
+            ",".join(select_list),
+            self.get_table_reference(table),
+            self.get_where_clause(table, [" OR ".join("( {} )".format(c) for c in check_conditions)]))
+        return columns, query
+
+    def _get_table_query(self, table, checks):
+        '''Returns the columns and the query of the checks of a table. Queries of several checks are
+           followed by a flag for each check, see _get_combined_query.'''
+        if len(checks) == 1:
+            check_name, check_params = checks[0]
+            return check_params['report_columns'], self._get_single_check_query(table, check_params)
+        else:
+            return self._get_combined_query(table, checks)
+
+    def _check_ref_integrity(self, query):
+        cursor = self.get_cursor()
         cursor.execute(query)
         return cursor
 
-    def run(self):
+    def _output_row(self, check_name, check_params, columns, row):
+        output = {'check_name': check_name, 'report_columns': {}}
+        for report_column in check_params['report_columns']:
+            output['report_columns'][str(report_column)] = str(
+                row[columns.index(report_column)])
+        self.output_item(output)
+
+    def _output_rows(self, checks, columns, rows):
         issue_found = False
+        for row in rows:
+            if len(checks) == 1:
+                check_name, check_params = checks[0]
+                self._output_row(check_name, check_params, columns, row)
+                issue_found = True
+            else:
+                for check_num, (check_name, check_params) in enumerate(checks):
+                    if row[len(columns) + check_num]:
+                        self._output_row(check_name, check_params, columns, row)
+                        issue_found = True
+        return issue_found
 
-        if self.args.data_object_prefix:
-            self.print_error("The referential integrity checks do not yet support the --data-object-prefix option.")
-            self.print_error("Ignoring this option for these tests.")
-        for check_name, check_params in self._get_ref_integrity_data():
-            if self.args.v:
-                self.print_progress("Running referential integrity check for: " + check_name)
-
-            result = self._check_ref_integrity(
-                check_params['table'],
-                check_params['report_columns'],
-                check_params['conditions'])
-
-            for row in result:
-                output = {'check_name': check_name, 'report_columns': {}}
-                column_num = 0
-                for report_column in check_params['report_columns']:
-                    output['report_columns'][str(report_column)] = str(
-                        row[column_num])
-                    column_num = column_num + 1
-                self.output_item(output)
+    def _check_scanned_rows(self, checks, rows, column_index):
+        '''Checks rows of a snapshot. Referenced values are looked up in the snapshot, and conditions
+           have been evaluated when it was exported.'''
+        snapshot = self.connection
+        columns = sorted(column_index, key=column_index.get)
+        for check_name, check_params in checks:
+            conditions = [column_index[condition] for condition in check_params.get('conditions', [])]
+            references = [(column_index[column], snapshot.get_lookup(ref_table, ref_column), reference_type)
+                          for reference_type in ['missing_references', 'existing_references']
+                          for column, ref_table, ref_column in check_params.get(reference_type, [])]
+            for row in rows:
+                if len(conditions) > 0 and not all(row[condition] == 1 for condition in conditions):
+                    continue
+                for column, lookup, reference_type in references:
+                    if reference_type == 'missing_references' and (row[column] is None or row[column] in lookup):
+                        break
+                    if reference_type == 'existing_references' and (row[column] is None or row[column] not in lookup):
+                        break
+                else:
+                    self._output_row(check_name, check_params, columns, row)
+                    self.scan_issue_found = True
+
+    def register_scans(self, pipeline):
+        # The checks are only done row by row on snapshots. On the database, they are done with joins.
+        if self.args.snapshot is None:
+            return False
+        for table, checks in self._get_checks_per_table():
+            columns = []
+            for check_name, check_params in checks:
+                columns += check_params['report_columns'] + check_params.get('conditions', [])
+                for reference_type in ['missing_references', 'existing_references']:
+                    columns += [column for column, _, _ in check_params.get(reference_type, [])]
+            pipeline.register(
+                table,
+                self.get_where_clause(table),
+                columns,
+                functools.partial(self._check_scanned_rows, checks),
+                name=self.get_name())
+        return True
+
+    def get_queries(self):
+        return [(", ".join(check_name for check_name, _ in checks), self._get_table_query(table, checks)[1])
+                for table, checks in self._get_checks_per_table()]
+
+    def _run_concurrently(self):
+        issue_found = False
+        queries = []
+        table_checks = {}
+        for table, checks in self._get_checks_per_table():
+            check_names = ", ".join(check_name for check_name, _ in checks)
+            columns, query = self._get_table_query(table, checks)
+            table_checks[check_names] = (checks, columns)
+            queries.append((check_names, [query]))
+
+        def output_rows(check_names, rows, alternative):
+            nonlocal issue_found
+            checks, columns = table_checks[check_names]
+            if self._output_rows(checks, columns, rows):
                 issue_found = True
 
-            result.close()
+        self.run_queries_concurrently(queries, output_rows)
+        return issue_found
+
+    def run(self):
+        if self.args.concurrent_queries > 1:
+            return self._run_concurrently()
+
+        issue_found = False
+        for table, checks in self._get_checks_per_table():
+            check_names = ", ".join(check_name for check_name, _ in checks)
+            with self.measure(check_names):
+                if self.args.v:
+                    self.print_progress("Running referential integrity check for: " + check_names)
+
+                columns, query = self._get_table_query(table, checks)
+                result = self._check_ref_integrity(query)
+                if self._output_rows(checks, columns, result):
+                    issue_found = True
+                result.close()
+                self.count_sampled_rows([check_name for check_name, _ in checks], table)
 
         return issue_found
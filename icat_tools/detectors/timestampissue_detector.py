@@ -1,7 +1,40 @@
 from icat_tools.detectors.detector import Detector
-import time
+import collections
+import functools
+import psycopg2
+
+# Timestamps that are numbers, with optional whitespace and sign. Other values are not checked.
+TIMESTAMP_PATTERN = r'^\s*[-+]?[0-9]+\s*$'
+
+# The index advice only recommends indexes for tables with at least this number of rows, of which at
+# most this fraction has a timestamp issue. Otherwise a sequential scan is about as fast.
+INDEX_ADVICE_MIN_ROWS = 100000
+INDEX_ADVICE_MAX_FRACTION = 0.01
+
+
+def _get_timestamp_value(column, safe):
+    '''Returns an SQL expression with the value of a timestamp column as a number. The safe expression
+       is NULL if the value is not a number, and uses numeric so that large values cannot overflow.
+       It is much slower than a plain cast, which fails on such values.'''
+    if safe:
+        return "CASE WHEN {0} ~ '{1}' THEN CAST({0} AS numeric) END".format(column, TIMESTAMP_PATTERN)
+    else:
+        return "CAST({} AS bigint)".format(column)
+
+
+def _get_timestamp_expressions(safe=False, first_ts='create_ts', second_ts='modify_ts'):
+    '''Returns the SQL expressions of the timestamp order condition and of the latest timestamp of a
+       row. Expression indexes on these let the check skip the rows without issues.'''
+    first_value = _get_timestamp_value(first_ts, safe)
+    second_value = _get_timestamp_value(second_ts, safe)
+    return {'order': "{} > {}".format(first_value, second_value),
+            'future': "GREATEST({}, {})".format(first_value, second_value)}
+
 
 class TimestampIssueDetector(Detector):
+    incremental = True
+    sampled = True
+    chunk_data_objects = True
 
     def get_name(self):
         return "timestamps"
@@ -30,65 +63,221 @@ class TimestampIssueDetector(Detector):
             {'table': 'r_zone_main',
              'report_columns': ['zone_name', "create_ts", "modify_ts"]}
         }
-        return data.items()
+        return [(check_name, check_params) for check_name, check_params in data.items()
+                if self.is_table_checked(check_params['table'])]
 
-    def _get_prefix_condition(self, table):
-        if table == 'r_data_main' and self.args.data_object_prefix is not None:
-            return "AND concat ( ( select coll_name from r_coll_main where coll_id = r_data_main.coll_id ), '/', r_data_main.data_name) LIKE '{}%'".format(self.args.data_object_prefix)
-        else:
-            return ""
+    def _get_timestamp_query(self, table, report_columns, max_ts, safe=False):
+        '''Returns a query that selects the rows of a table with a timestamp order issue, a timestamp
+           in the future, or both, in a single scan. The report columns are followed by two booleans
+           that tell which issues the row has.'''
+        expressions = _get_timestamp_expressions(safe)
+        order_condition = expressions['order']
+        future_condition = "{} > {}".format(expressions['future'], max_ts)
+        return "SELECT {}, COALESCE({}, FALSE), COALESCE({}, FALSE) FROM {} {}".format(
+            ",".join(report_columns), order_condition, future_condition, self.get_table_reference(table),
+            self.get_where_clause(table, ["{} OR {}".format(order_condition, future_condition)]))
 
-    def _check_timestamp_order(self, table, report_columns,
-                               first_ts='create_ts', second_ts='modify_ts'):
-        query = "SELECT {} FROM {} WHERE CAST ( {} AS INT ) > CAST ( {} AS INT ) {}".format(
-            ",".join(report_columns), table, first_ts, second_ts, self._get_prefix_condition(table))
-        cursor = self.connection.cursor()
+    def _output_rows(self, check_name, report_columns, rows, reported, skip_reported):
+        '''Reports the issues of the rows of a timestamp query. Reported issues are counted in the
+           reported counter, or skipped if they have been counted before. Returns the number of rows.'''
+        number_columns = len(report_columns)
+        number_rows = 0
+        for row in rows:
+            number_rows = number_rows + 1
+            for output_type, has_issue in [('order', row[number_columns]), ('future', row[number_columns + 1])]:
+                if not has_issue:
+                    continue
+                issue = (output_type, row[:number_columns])
+                if skip_reported and reported[issue] > 0:
+                    reported[issue] -= 1
+                    continue
+                if not skip_reported:
+                    reported[issue] += 1
+                output = { 'type' : output_type, 'check_name' : check_name, 'report_columns' : {} }
+                column_num = 0
+                for report_column in report_columns:
+                    output['report_columns'][str(report_column)] = str(row[column_num])
+                    column_num = column_num + 1
+                self.output_item(output)
+        return number_rows
+
+    def _output_issues(self, check_name, report_columns, query, reported, skip_reported):
+        '''Runs a timestamp query and reports the issues it finds, see _output_rows.'''
+        cursor = self.get_cursor()
         cursor.execute(query)
-        return cursor
+        number_rows = self._output_rows(check_name, report_columns, cursor, reported, skip_reported)
+        cursor.close()
+        return number_rows
+
+    def _check_timestamps(self, check_name, table, report_columns, max_ts):
+        '''Reports the timestamp issues of a table. Returns the number of rows with issues, and whether
+           all timestamps are numbers that fit in a bigint.'''
+        # The plain casts fail on values that are not numbers or that are too large. In that case, the
+        # table is checked again with the safe expressions, skipping the issues that have already
+        # been reported.
+        reported = collections.Counter()
+        savepoint = self.connection.cursor()
+        savepoint.execute("SAVEPOINT timestamp_check")
+        try:
+            number_rows = self._output_issues(
+                check_name, report_columns, self._get_timestamp_query(table, report_columns, max_ts),
+                reported, False)
+            savepoint.execute("RELEASE SAVEPOINT timestamp_check")
+            savepoint.close()
+            return number_rows, True
+        except psycopg2.DataError:
+            savepoint.execute("ROLLBACK TO SAVEPOINT timestamp_check")
+            savepoint.close()
+        if self.args.v:
+            self.print_progress("Some timestamps of {} are not numbers or are too large, checking them one by one".format(
+                check_name))
+        number_rows = self._output_issues(
+            check_name, report_columns, self._get_timestamp_query(table, report_columns, max_ts, safe=True),
+            reported, True)
+        return number_rows, False
+
+    def _uses_index(self, plan):
+        if 'Index' in plan['Node Type']:
+            return True
+        return any(self._uses_index(subplan) for subplan in plan.get('Plans', []))
 
-    def _check_timestamp_future(self, table, report_columns, max_ts,
-                                first_ts='create_ts', second_ts='modify_ts'):
-        query = "SELECT {} FROM {} WHERE CAST( {} AS INT) > {} OR CAST( {} AS INT) > {} {}".format(
-            ",".join(report_columns), table, first_ts, max_ts, second_ts, max_ts, self._get_prefix_condition(table))
+    def _advise_indexes(self, check_name, table, report_columns, max_ts, number_issues):
+        '''Prints whether expression indexes on the timestamps of a table would speed up the check.'''
         cursor = self.connection.cursor()
-        cursor.execute(query)
-        return cursor
+        cursor.execute("EXPLAIN (FORMAT JSON) " + self._get_timestamp_query(table, report_columns, max_ts))
+        plan = cursor.fetchone()[0][0]['Plan']
+        cursor.execute("SELECT reltuples FROM pg_class WHERE oid = %s::regclass", (table,))
+        number_rows = int(cursor.fetchone()[0])
+        cursor.close()
 
-    def run(self):
-        issue_found = False
-        max_ts = int(time.time()) + 1
+        if number_rows < 0:
+            self.print_progress("Index advice for {}: table {} has no statistics yet, run ANALYZE first.".format(
+                check_name, table))
+        elif self._uses_index(plan):
+            self.print_progress("Index advice for {}: the check already uses an index.".format(check_name))
+        elif number_rows < INDEX_ADVICE_MIN_ROWS:
+            self.print_progress("Index advice for {}: table {} has about {} rows, a sequential scan is fast enough.".format(
+                check_name, table, number_rows))
+        elif number_issues > number_rows * INDEX_ADVICE_MAX_FRACTION:
+            self.print_progress("Index advice for {}: {} of about {} rows have an issue, a sequential scan is faster than an index.".format(
+                check_name, number_issues, number_rows))
+        else:
+            expressions = _get_timestamp_expressions()
+            self.print_progress("Index advice for {}: {} of about {} rows have an issue, the check can use these indexes:".format(
+                check_name, number_issues, number_rows))
+            for index_type in ['order', 'future']:
+                self.print_progress("CREATE INDEX CONCURRENTLY {}_ts_{}_idx ON {} (({}));".format(
+                    table, index_type, table, expressions[index_type]))
+
+    def _parse_timestamp(self, value):
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return None
+
+    def _check_scanned_rows(self, check_name, report_columns, max_ts, rows, column_index):
+        create_ts_column = column_index['create_ts']
+        modify_ts_column = column_index['modify_ts']
+        for row in rows:
+            create_ts = self._parse_timestamp(row[create_ts_column])
+            modify_ts = self._parse_timestamp(row[modify_ts_column])
+            order_issue = create_ts is not None and modify_ts is not None and create_ts > modify_ts
+            future_issue = ((create_ts is not None and create_ts > max_ts) or
+                            (modify_ts is not None and modify_ts > max_ts))
+            for output_type, has_issue in [('order', order_issue), ('future', future_issue)]:
+                if has_issue:
+                    output = {'type': output_type, 'check_name': check_name, 'report_columns': {}}
+                    for report_column in report_columns:
+                        output['report_columns'][str(report_column)] = str(row[column_index[report_column]])
+                    self.output_item(output)
+                    self.scan_issue_found = True
+
+    def _check_scanned_batch(self, check_name, report_columns, max_ts, batch):
+        '''Compares the timestamps of a batch as arrays, and only checks the rows with issues one by one.'''
+        try:
+            create_ts = batch.get_int_array('create_ts')
+            modify_ts = batch.get_int_array('modify_ts')
+        except (TypeError, ValueError, OverflowError):
+            # Some timestamps of the batch are NULL, not numbers, or too large for an array
+            self._check_scanned_rows(check_name, report_columns, max_ts, batch.rows, batch.column_index)
+            return
+        issues = ((create_ts > modify_ts) | (create_ts > max_ts) | (modify_ts > max_ts)).nonzero()[0]
+        if len(issues) > 0:
+            self._check_scanned_rows(check_name, report_columns, max_ts, batch.get_rows(issues), batch.column_index)
+
+    def register_scans(self, pipeline):
+        max_ts = int(self.get_current_time()) + 1
+        check_scanned = self._check_scanned_batch if self.args.vectorized else self._check_scanned_rows
         for check_name, check_params in self._get_ts_check_data():
-           if self.args.v:
-               self.print_progress("Running timestamp order test for: " + check_name)
-
-           result_order = self._check_timestamp_order(
-                check_params['table'],
-                check_params['report_columns'])
-           for row in result_order:
-                output = { 'type' : 'order', 'check_name' : check_name, 'report_columns' : {} }
-                column_num = 0
-                for report_column in check_params['report_columns']:
-                    output['report_columns'][str(report_column)] = str(row[column_num])
-                    column_num = column_num + 1
-                self.output_item(output)
-                issue_found = True
-           result_order.close()
+            table = check_params['table']
+            pipeline.register(
+                table,
+                self.get_where_clause(table),
+                check_params['report_columns'] + ['create_ts', 'modify_ts'],
+                functools.partial(check_scanned, check_name, check_params['report_columns'], max_ts),
+                name=self.get_name(),
+                columnar=self.args.vectorized)
+        return True
 
-           if self.args.v:
-               self.print_progress("Running future timestamp test for: " + check_name)
+    def get_queries(self):
+        max_ts = int(self.get_current_time()) + 1
+        return [(check_name, self._get_timestamp_query(check_params['table'], check_params['report_columns'], max_ts))
+                for check_name, check_params in self._get_ts_check_data()]
 
-           result_future = self._check_timestamp_future(
-                check_params['table'],
-                check_params['report_columns'],
-                max_ts)
-           for row in result_future:
-                output = { 'type' : 'future', 'check_name' : check_name, 'report_columns' : {} }
-                column_num = 0
-                for report_column in check_params['report_columns']:
-                    output['report_columns'][str(report_column)] = str(row[column_num])
-                    column_num = column_num + 1
-                self.output_item(output)
+    def _run_concurrently(self, max_ts):
+        '''Checks all tables concurrently. Returns whether an issue has been found, and for every check
+           the number of rows with issues and whether all timestamps are numbers that fit in a bigint.'''
+        issue_found = False
+        check_data = dict(self._get_ts_check_data())
+        queries = [(check_name, [self._get_timestamp_query(check_params['table'], check_params['report_columns'], max_ts),
+                                 self._get_timestamp_query(check_params['table'], check_params['report_columns'], max_ts,
+                                                           safe=True)])
+                   for check_name, check_params in check_data.items()]
+        # Issues that the plain query has reported before it failed are skipped by the safe query
+        reported = {check_name: collections.Counter() for check_name in check_data}
+
+        def output_rows(check_name, rows, alternative):
+            nonlocal issue_found
+            if self._output_rows(check_name, check_data[check_name]['report_columns'], rows,
+                                 reported[check_name], alternative > 0) > 0:
                 issue_found = True
-           result_future.close()     
+
+        query_results = self.run_queries_concurrently(queries, output_rows, skip_repeated_rows=True)
+        results = {check_name: (number_rows, alternative == 0)
+                   for check_name, (number_rows, alternative) in query_results.items()}
+        return issue_found, results
+
+    def run(self):
+        issue_found = False
+        max_ts = int(self.get_current_time()) + 1
+        if self.args.concurrent_queries > 1:
+            issue_found, results = self._run_concurrently(max_ts)
+        else:
+            results = {}
+            for check_name, check_params in self._get_ts_check_data():
+                with self.measure(check_name):
+                    if self.args.v:
+                        self.print_progress("Running timestamp order and future timestamp tests for: " + check_name)
+
+                    results[check_name] = self._check_timestamps(
+                        check_name,
+                        check_params['table'],
+                        check_params['report_columns'],
+                        max_ts)
+                    self.count_sampled_rows([check_name], check_params['table'])
+                    if results[check_name][0] > 0:
+                        issue_found = True
+
+        if self.args.timestamp_index_advice:
+            for check_name, check_params in self._get_ts_check_data():
+                if check_name in self.failed_sub_checks:
+                    continue
+                number_issues, numeric_timestamps = results[check_name]
+                if numeric_timestamps:
+                    self._advise_indexes(check_name, check_params['table'], check_params['report_columns'],
+                                         max_ts, number_issues)
+                else:
+                    self.print_progress("Index advice for {}: no indexes can be created on the timestamps, since some are not numbers or are too large.".format(
+                        check_name))
 
         return issue_found
@@ -0,0 +1,112 @@
+'''Detection of duplicate keys in streams of entries that are too large to keep all keys in memory.
+
+Keys are reduced to 64-bit hashes, which are stored with a value (such as a data_id) in typed arrays.
+When the entries reach the memory limit, they are sorted by hash and written to a temporary file as a
+sorted run. Duplicates are then found by merging the runs. Entries with the same hash are only
+candidates: their keys still need to be compared, since different keys can have the same hash.'''
+from array import array
+import heapq
+import itertools
+import operator
+import tempfile
+
+# Default memory limit of a duplicate finder in megabytes
+DEFAULT_MEMORY_LIMIT_MB = 1024
+
+# Memory per entry in bytes: 16 bytes in the arrays, and about 90 bytes for the Python objects that
+# are created while the entries are sorted.
+BYTES_PER_ENTRY = 112
+
+# Number of entries that are written to or read from a run file at a time
+RUN_BUFFER_ENTRIES = 65536
+
+# Maximum number of run files. When it is reached, the runs are merged into one, so that the number
+# of open files stays limited.
+MAX_RUNS = 64
+
+
+class DuplicateFinder(object):
+
+    def __init__(self, memory_limit_mb=DEFAULT_MEMORY_LIMIT_MB):
+        self.max_entries = max(memory_limit_mb * 1024 * 1024 // BYTES_PER_ENTRY, 1)
+        self.hashes = array('q')
+        self.values = array('q')
+        # Position of the first entry in memory, in the order in which entries have been added
+        self.first_position = 0
+        self.runs = []
+
+    def add(self, key_hash, value):
+        self.hashes.append(key_hash)
+        self.values.append(value)
+        if len(self.hashes) >= self.max_entries:
+            self._spill()
+
+    def add_batch(self, key_hashes, values):
+        '''Adds the entries of two lists of hashes and values of the same length.'''
+        start = 0
+        while start < len(key_hashes):
+            end = min(start + self.max_entries - len(self.hashes), len(key_hashes))
+            self.hashes.extend(key_hashes[start:end])
+            self.values.extend(values[start:end])
+            start = end
+            if len(self.hashes) >= self.max_entries:
+                self._spill()
+
+    def _sort_entries(self):
+        '''Yields the entries in memory as (hash, position, value) tuples, sorted by hash and position.'''
+        hashes = self.hashes
+        values = self.values
+        # The sort is stable, so entries with the same hash stay in order of position
+        for index in sorted(range(len(hashes)), key=hashes.__getitem__):
+            yield hashes[index], self.first_position + index, values[index]
+
+    def _write_run(self, entries):
+        run = tempfile.TemporaryFile()
+        buffer = array('q')
+        for entry in entries:
+            buffer.extend(entry)
+            if len(buffer) >= 3 * RUN_BUFFER_ENTRIES:
+                buffer.tofile(run)
+                buffer = array('q')
+        buffer.tofile(run)
+        return run
+
+    def _spill(self):
+        self.runs.append(self._write_run(self._sort_entries()))
+        self.first_position += len(self.hashes)
+        self.hashes = array('q')
+        self.values = array('q')
+        if len(self.runs) >= MAX_RUNS:
+            merged_run = self._write_run(heapq.merge(*[self._read_run(run) for run in self.runs]))
+            self.close()
+            self.runs = [merged_run]
+
+    def _read_run(self, run):
+        run.seek(0)
+        while True:
+            buffer = array('q')
+            try:
+                buffer.fromfile(run, 3 * RUN_BUFFER_ENTRIES)
+            except EOFError:
+                # The last part of the run is shorter, but has been read
+                pass
+            if len(buffer) == 0:
+                return
+            yield from zip(buffer[0::3], buffer[1::3], buffer[2::3])
+
+    def get_duplicate_groups(self):
+        '''Yields the hashes that have been added more than once, each with a list of the
+           (position, value) tuples of its entries, in order of position.'''
+        entries = heapq.merge(*([self._read_run(run) for run in self.runs] + [self._sort_entries()]))
+        for key_hash, group in itertools.groupby(entries, key=operator.itemgetter(0)):
+            first_entry = next(group)
+            second_entry = next(group, None)
+            if second_entry is not None:
+                yield key_hash, [(position, value) for _, position, value
+                                 in itertools.chain([first_entry, second_entry], group)]
+
+    def close(self):
+        '''Removes the run files.'''
+        for run in self.runs:
+            run.close()
+        self.runs = []
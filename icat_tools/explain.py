@@ -0,0 +1,174 @@
+'''Dry runs, which estimate the cost of the tests before they are run. The queries that the tests would
+send to scan the catalog are explained with EXPLAIN (FORMAT JSON), which plans them without running them.
+For every query, the estimated number of rows, the total cost and the tables that the database would
+scan sequentially are reported, and for every test and all tests together the totals.
+
+Costs are in the arbitrary units of the PostgreSQL planner, and are only comparable within a database.'''
+import re
+
+# Keys of plan nodes that contain conditions, which an index could be used for
+CONDITION_KEYS = ['Filter', 'Join Filter', 'Hash Cond', 'Merge Cond', 'Index Cond', 'Recheck Cond']
+
+
+class QueryPlan(object):
+    '''Summary of the plan of a query: the estimated number of rows and total cost, and the sequential
+       scans of the plan as (plan node, conditions of the node, conditions of its parent nodes) tuples.
+       Conditions of joins are only passed on to their inner side, since the outer side of a join is
+       read completely anyway.'''
+
+    def __init__(self, plan):
+        self.rows = plan['Plan Rows']
+        self.cost = plan['Total Cost']
+        self.seq_scans = list(self._get_seq_scans(plan, []))
+
+    def _get_seq_scans(self, plan, parent_conditions):
+        conditions = [plan[key] for key in CONDITION_KEYS if key in plan]
+        if plan['Node Type'] == 'Seq Scan':
+            yield plan, conditions, parent_conditions
+        for subplan in plan.get('Plans', []):
+            if subplan.get('Parent Relationship') == 'Outer':
+                yield from self._get_seq_scans(subplan, parent_conditions)
+            else:
+                yield from self._get_seq_scans(subplan, parent_conditions + conditions)
+
+    def get_seq_scan_tables(self):
+        tables = []
+        for node, _, _ in self.seq_scans:
+            if node['Relation Name'] not in tables:
+                tables.append(node['Relation Name'])
+        return tables
+
+    def get_useful_indexes(self, index_definitions):
+        '''Returns the names of the indexes of a dictionary of (table, columns) tuples by index name,
+           that have a first column which is used in a condition on a table that is scanned
+           sequentially. Conditions of the scan itself refer to its columns without the name of the
+           table, conditions of joins refer to them with the alias of the table.'''
+        indexes = []
+        for node, conditions, parent_conditions in self.seq_scans:
+            for index, (table, columns) in index_definitions.items():
+                if table != node['Relation Name'] or index in indexes:
+                    continue
+                qualified_pattern = r"\b{}\.{}\b".format(re.escape(node['Alias']), re.escape(columns[0]))
+                own_pattern = r"(?<![.\w]){}\b|{}".format(re.escape(columns[0]), qualified_pattern)
+                if (any(re.search(own_pattern, condition) for condition in conditions) or
+                        any(re.search(qualified_pattern, condition) for condition in parent_conditions)):
+                    indexes.append(index)
+        return indexes
+
+
+class PlanTotals(object):
+    '''Totals of the plans of a number of queries.'''
+
+    def __init__(self):
+        self.number_queries = 0
+        self.rows = 0
+        self.cost = 0.0
+        self.number_seq_scan_queries = 0
+        self.seq_scan_tables = []
+
+    def add(self, query_plan):
+        self.number_queries += 1
+        self.rows += query_plan.rows
+        self.cost += query_plan.cost
+        tables = query_plan.get_seq_scan_tables()
+        if len(tables) > 0:
+            self.number_seq_scan_queries += 1
+        for table in tables:
+            if table not in self.seq_scan_tables:
+                self.seq_scan_tables.append(table)
+
+    def add_totals(self, totals):
+        self.number_queries += totals.number_queries
+        self.rows += totals.rows
+        self.cost += totals.cost
+        self.number_seq_scan_queries += totals.number_seq_scan_queries
+        for table in totals.seq_scan_tables:
+            if table not in self.seq_scan_tables:
+                self.seq_scan_tables.append(table)
+
+    def get_description(self):
+        description = "{} queries, about {} rows, total cost {:.0f}".format(
+            self.number_queries, self.rows, self.cost)
+        if self.number_seq_scan_queries > 0:
+            description += ", {} queries with sequential scans of {}".format(
+                self.number_seq_scan_queries, ", ".join(self.seq_scan_tables))
+        else:
+            description += ", no sequential scans"
+        return description
+
+
+class QueryExplainer(object):
+
+    def __init__(self, connection, output_processor, verbose=False, missing_indexes=None):
+        '''missing_indexes is a dictionary with the (table, columns) tuples of the indexes that are
+           missing in the database, by name, or None if they are not known.'''
+        self.connection = connection
+        self.output_processor = output_processor
+        self.verbose = verbose
+        self.missing_indexes = missing_indexes
+        self.table_sizes = {}
+
+    def _get_table_size(self, table):
+        '''Returns the estimated number of rows of a table, or None if it has no statistics yet.'''
+        if table not in self.table_sizes:
+            cursor = self.connection.cursor()
+            cursor.execute("SELECT reltuples FROM pg_class WHERE oid = %s::regclass", (table,))
+            number_rows = int(cursor.fetchone()[0])
+            cursor.close()
+            self.table_sizes[table] = number_rows if number_rows >= 0 else None
+        return self.table_sizes[table]
+
+    def explain_query(self, query):
+        cursor = self.connection.cursor()
+        cursor.execute("EXPLAIN (FORMAT JSON) " + query)
+        plan = cursor.fetchone()[0][0]['Plan']
+        cursor.close()
+        return QueryPlan(plan)
+
+    def _get_query_description(self, query_plan):
+        description = "about {} rows, cost {:.0f}".format(query_plan.rows, query_plan.cost)
+        tables = query_plan.get_seq_scan_tables()
+        if len(tables) == 0:
+            return description + ", no sequential scans"
+        table_descriptions = []
+        for table in tables:
+            table_size = self._get_table_size(table)
+            if table_size is None:
+                table_descriptions.append("{} (size unknown)".format(table))
+            else:
+                table_descriptions.append("{} (about {} rows)".format(table, table_size))
+        return description + ", sequential scans of " + ", ".join(table_descriptions)
+
+    def explain_detector(self, detector):
+        '''Explains the queries of a detector, and reports the plan of every query. Returns the totals
+           of the plans.'''
+        totals = PlanTotals()
+        for sub_check, query in detector.get_queries():
+            name = detector.get_name() if sub_check is None else "{} ({})".format(detector.get_name(), sub_check)
+            if self.verbose:
+                self.output_processor.print_progress("Query of {}: {}".format(name, " ".join(query.split())))
+            query_plan = self.explain_query(query)
+            totals.add(query_plan)
+            self.output_processor.print_progress("Plan of {}: {}".format(
+                name, self._get_query_description(query_plan)))
+            if self.missing_indexes is not None:
+                for index in query_plan.get_useful_indexes(self.missing_indexes):
+                    table, columns = self.missing_indexes[index]
+                    self.output_processor.print_progress(
+                        "  Missing index {} on {} ({}) could avoid a sequential scan of this query".format(
+                            index, table, ", ".join(columns)))
+        return totals
+
+    def explain_detectors(self, detectors):
+        '''Reports the plans of the queries of all detectors, with totals per detector and in total.'''
+        all_totals = PlanTotals()
+        for detector in detectors:
+            totals = self.explain_detector(detector)
+            self.output_processor.print_progress("Total of {}: {}".format(detector.get_name(), totals.get_description()))
+            all_totals.add_totals(totals)
+        self.output_processor.print_progress("Total of all tests: {}".format(all_totals.get_description()))
+        tables_without_statistics = [table for table, table_size in self.table_sizes.items() if table_size is None]
+        if len(tables_without_statistics) > 0:
+            self.output_processor.print_progress(
+                "Tables {} have no statistics yet, so the estimates can be far off. Run ANALYZE first.".format(
+                    ", ".join(tables_without_statistics)))
@@ -0,0 +1,69 @@
+'''Support for incremental runs, which only check rows that have been created or modified since
+the last completed run.
+
+For every test and table, the state file contains a high-water mark of the modification timestamp, and
+of the id for tables where new rows get increasing ids. The marks are kept per test, so that a run of
+one test does not skip rows that another test has not checked yet. The new marks are determined when a
+run starts, and are only saved for the tests that have completed.'''
+from icat_tools import utils
+import json
+import os
+
+# Tables with row-level checks that can be limited to new and modified rows
+TRACKED_TABLES = ['r_data_main', 'r_coll_main', 'r_objt_access', 'r_objt_metamap',
+                  'r_resc_main', 'r_rule_main', 'r_user_main', 'r_zone_main']
+
+# Id columns of tables where new rows get increasing ids
+ID_COLUMNS = {'r_data_main': 'data_id', 'r_coll_main': 'coll_id'}
+
+
+class IncrementalState(object):
+
+    def __init__(self, state_file):
+        self.state_file = state_file
+        # High-water marks by test and table. State files of older versions, which have marks per
+        # table only, are ignored, so that all rows are checked again.
+        self.watermarks = {}
+        self.new_watermarks = {}
+        if os.path.isfile(state_file):
+            with open(state_file) as statefile:
+                self.watermarks = json.load(statefile).get('tests', {})
+
+    def begin(self, connection):
+        '''Determines the high-water marks of the current run.'''
+        cursor = connection.cursor()
+        # iRODS stores timestamps as zero-padded numbers of seconds, which can be compared as strings
+        cursor.execute("SELECT lpad(CAST(floor(extract(epoch from now())) AS bigint)::text, 11, '0')")
+        now = cursor.fetchone()[0]
+        for table in TRACKED_TABLES:
+            watermark = {'modify_ts': now}
+            if table in ID_COLUMNS:
+                cursor.execute("SELECT max({}) FROM {}".format(ID_COLUMNS[table], table))
+                watermark['id'] = cursor.fetchone()[0]
+            self.new_watermarks[table] = watermark
+        cursor.close()
+
+    def get_conditions(self, connection):
+        '''Returns a dictionary with, for each test, a dictionary with a condition for each table that
+           selects rows that have been created or modified since the last completed run of the test.
+           Tests and tables that have not been checked before are not included.'''
+        conditions = {}
+        for test, test_watermarks in self.watermarks.items():
+            conditions[test] = {}
+            for table, watermark in test_watermarks.items():
+                table_conditions = ["{}.modify_ts >= {}".format(
+                    table, utils.quote_literal(connection, watermark['modify_ts']))]
+                if table in ID_COLUMNS and watermark.get('id') is not None:
+                    table_conditions.append("{}.{} > {}".format(table, ID_COLUMNS[table], int(watermark['id'])))
+                conditions[test][table] = " OR ".join(table_conditions)
+        return conditions
+
+    def save(self, tests):
+        '''Saves the high-water marks of the current run for the tests that have completed, so that their
+           next run starts from there. The marks of other tests are kept.'''
+        for test in tests:
+            self.watermarks[test] = self.new_watermarks
+        temp_filename = self.state_file + ".tmp"
+        with open(temp_filename, "w") as statefile:
+            json.dump({'tests': self.watermarks}, statefile, indent=2)
+        os.replace(temp_filename, self.state_file)
@@ -0,0 +1,89 @@
+'''Persistent store of the issues that have been found, so that a run can report only the issues that are
+new since the previous runs, or the issues that have been resolved since then.
+
+Every issue is identified by a fingerprint: a hash of the name of the test and of a key of the issue.
+The key consists of the values that identify the issue in the catalog, such as ids and paths, so that
+detectors can recognize known issues before they look up the names of the objects to report. The store
+is an SQLite database. All changes of a run are made in a single transaction, which is only committed
+when the run has completed, so an interrupted run does not change the store.'''
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+
+def get_fingerprint(test, key):
+    '''Returns the fingerprint of an issue of a test. The key is a list or dictionary of values that
+       identify the issue.'''
+    return hashlib.sha1(json.dumps([test, key], sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+class IssueStore(object):
+    '''Issues that have been found by earlier runs, with the number of the first and of the last run
+       that has found them. Issues that a complete run of their test no longer finds are resolved, and
+       are removed from the store.'''
+
+    def __init__(self, filename):
+        # Detectors that run in parallel threads share the store
+        self.connection = sqlite3.connect(filename, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS runs (
+                                     run_id INTEGER PRIMARY KEY, started REAL NOT NULL)""")
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS issues (
+                                     fingerprint TEXT PRIMARY KEY, test TEXT NOT NULL, item TEXT,
+                                     first_run INTEGER NOT NULL, last_run INTEGER NOT NULL)""")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS issues_test_idx ON issues (test, last_run)")
+        cursor = self.connection.execute("INSERT INTO runs (started) VALUES (?)", (time.time(),))
+        self.run_id = cursor.lastrowid
+
+    def record(self, test, fingerprint, values):
+        '''Records that an issue has been found in this run, with the values that are reported for it.
+           Returns whether the issue has been found by an earlier run.'''
+        item = json.dumps(values)
+        with self.lock:
+            row = self.connection.execute("SELECT first_run FROM issues WHERE fingerprint = ?",
+                                          (fingerprint,)).fetchone()
+            if row is None:
+                self.connection.execute(
+                    "INSERT INTO issues (fingerprint, test, item, first_run, last_run) VALUES (?, ?, ?, ?, ?)",
+                    (fingerprint, test, item, self.run_id, self.run_id))
+                return False
+            self.connection.execute("UPDATE issues SET item = ?, last_run = ? WHERE fingerprint = ?",
+                                    (item, self.run_id, fingerprint))
+            return row[0] < self.run_id
+
+    def mark_known(self, fingerprint):
+        '''Records that an issue has been found in this run if it has been found by an earlier run,
+           without updating its reported values. Returns whether this is the case.'''
+        with self.lock:
+            cursor = self.connection.execute(
+                "UPDATE issues SET last_run = ? WHERE fingerprint = ? AND first_run < ?",
+                (self.run_id, fingerprint, self.run_id))
+            return cursor.rowcount > 0
+
+    def has_new_issues(self):
+        '''Returns whether this run has found issues that earlier runs have not found.'''
+        with self.lock:
+            return self.connection.execute("SELECT 1 FROM issues WHERE first_run = ? LIMIT 1",
+                                           (self.run_id,)).fetchone() is not None
+
+    def get_resolved_issues(self, test):
+        '''Returns the reported values of the issues of a test that have been found by earlier runs, but
+           not by this run, in the order in which they have first been found.'''
+        with self.lock:
+            cursor = self.connection.execute(
+                "SELECT item FROM issues WHERE test = ? AND last_run < ? ORDER BY first_run, rowid",
+                (test, self.run_id))
+            return [json.loads(row[0]) for row in cursor]
+
+    def remove_resolved_issues(self, test):
+        with self.lock:
+            self.connection.execute("DELETE FROM issues WHERE test = ? AND last_run < ?", (test, self.run_id))
+
+    def commit(self):
+        with self.lock:
+            self.connection.commit()
+
+    def close(self):
+        self.connection.close()
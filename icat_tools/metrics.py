@@ -0,0 +1,283 @@
+'''Runtime metrics of tests, and reports of these metrics as JSON or in the Prometheus textfile format.
+
+Database time, rows fetched and queries are recorded by InstrumentedCursor, which is the cursor
+class of all database connections. They are attributed to the tests and sub-checks that are being
+measured on the connection of the cursor.'''
+import contextlib
+import json
+import os
+import psycopg2.extensions
+import resource
+import sys
+import threading
+import time
+
+# Stats objects that currently receive the metrics of the cursors of a connection, by connection id.
+# Tests that run in parallel threads change it at the same time.
+_active_stats = {}
+_active_stats_lock = threading.Lock()
+
+# Tests that are being measured in this process, e.g. by parallel threads
+_measured_tests = set()
+_measured_tests_lock = threading.Lock()
+
+# Prefix of the names of the metrics in Prometheus reports
+PROMETHEUS_PREFIX = 'icat_dbcheck_'
+
+# Metrics of tests and sub-checks: (name, Prometheus suffix, Prometheus help text)
+METRICS = [
+    ('wall_time', 'wall_time_seconds', 'Wall time'),
+    ('db_time', 'database_time_seconds', 'Time spent waiting for the database'),
+    ('python_time', 'python_time_seconds', 'Wall time not spent waiting for the database'),
+    ('rows_fetched', 'rows_fetched', 'Number of rows fetched from the database'),
+    ('queries', 'queries', 'Number of queries issued'),
+    ('issues', 'issues', 'Number of issues reported')]
+
+# Counters of the name caches: (name, Prometheus suffix, Prometheus help text)
+NAME_CACHE_METRICS = [
+    ('hits', 'name_cache_hits', 'Number of names found in a name cache'),
+    ('misses', 'name_cache_misses', 'Number of names not found in a name cache'),
+    ('size', 'name_cache_entries', 'Number of entries in a name cache')]
+
+
+def reset_peak_rss():
+    '''Resets the peak RSS of the process to its current RSS, if the platform supports this (Linux).'''
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+    except OSError:
+        pass
+
+
+def get_peak_rss():
+    '''Returns the peak RSS of the process in kB, since the last reset if the platform supports this.'''
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    # ru_maxrss is in bytes on macOS, and in kB elsewhere
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        peak_rss = peak_rss // 1024
+    return peak_rss
+
+
+class InstrumentedCursor(psycopg2.extensions.cursor):
+
+    def _record(self, start, rows=0, queries=0):
+        duration = time.perf_counter() - start
+        with _active_stats_lock:
+            active_stats = list(_active_stats.get(id(self.connection), []))
+        for stats in active_stats:
+            stats.db_time += duration
+            stats.rows_fetched += rows
+            stats.queries += queries
+
+    def execute(self, query, vars=None):
+        start = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            self._record(start, queries=1)
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._record(start, rows=0 if row is None else 1)
+        return row
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._record(start, rows=len(rows))
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._record(start, rows=len(rows))
+        return rows
+
+    def __iter__(self):
+        # Named cursors fetch itersize rows from the server at a time when they are iterated
+        while True:
+            rows = self.fetchmany(self.itersize)
+            if len(rows) == 0:
+                return
+            yield from rows
+
+
+class Stats(object):
+
+    def __init__(self):
+        self.wall_time = 0.0
+        self.db_time = 0.0
+        self.rows_fetched = 0
+        self.queries = 0
+        self.issues = 0
+
+    @property
+    def python_time(self):
+        return max(self.wall_time - self.db_time, 0.0)
+
+    def to_dict(self):
+        return {metric: getattr(self, metric) for metric, _, _ in METRICS}
+
+
+class TestStats(Stats):
+    '''Metrics of a test, with a breakdown per sub-check.'''
+
+    def __init__(self, name):
+        super().__init__()
+        self.name = name
+        self.peak_rss_kb = None
+        # Whether other tests have been measured in this process at the same time, so that the peak
+        # RSS of the test is not known
+        self.peak_rss_shared = False
+        self.sub_checks = {}
+        self._measured = []
+
+    @contextlib.contextmanager
+    def measure(self, connection, sub_check=None):
+        '''Records the metrics of the code in the context, for the whole test or for a sub-check.'''
+        if sub_check is None:
+            stats = self
+        else:
+            stats = self.sub_checks.setdefault(sub_check, Stats())
+        if len(self._measured) == 0:
+            self._start_peak_rss()
+        with _active_stats_lock:
+            _active_stats.setdefault(id(connection), []).append(stats)
+        self._measured.append(stats)
+        start = time.perf_counter()
+        try:
+            yield stats
+        finally:
+            stats.wall_time += time.perf_counter() - start
+            with _active_stats_lock:
+                connection_stats = _active_stats[id(connection)]
+                connection_stats.remove(stats)
+                if len(connection_stats) == 0:
+                    del _active_stats[id(connection)]
+            self._measured.remove(stats)
+            if len(self._measured) == 0:
+                self._end_peak_rss()
+
+    def _start_peak_rss(self):
+        '''Resets the peak RSS when a test starts, unless other tests are being measured at the same
+           time. The peak RSS covers the whole process, so the peaks of tests that run at the same
+           time are not known.'''
+        with _measured_tests_lock:
+            if len(_measured_tests) == 0:
+                reset_peak_rss()
+            else:
+                for stats in _measured_tests:
+                    stats.peak_rss_shared = True
+                self.peak_rss_shared = True
+            _measured_tests.add(self)
+
+    def _end_peak_rss(self):
+        with _measured_tests_lock:
+            _measured_tests.discard(self)
+            if self.peak_rss_shared:
+                self.peak_rss_kb = None
+            else:
+                self.peak_rss_kb = max(self.peak_rss_kb or 0, get_peak_rss())
+
+    def record_issue(self):
+        self.issues += 1
+        for stats in self._measured:
+            if stats is not self:
+                stats.issues += 1
+
+    def record_query(self, sub_check, duration, rows, queries=1):
+        '''Records queries that have not been run with an InstrumentedCursor, such as asynchronous
+           queries, for the test and one of its sub-checks. Since such queries can run concurrently,
+           the database time of a test can exceed its wall time.'''
+        sub_stats = self.sub_checks.setdefault(sub_check, Stats())
+        sub_stats.wall_time += duration
+        for stats in [self, sub_stats]:
+            stats.db_time += duration
+            stats.rows_fetched += rows
+            stats.queries += queries
+
+    def add_worker_stats(self, worker_stats):
+        '''Adds the database metrics of a worker process that has checked part of the data. Wall time is
+           not added, since workers run in parallel.'''
+        self.db_time += worker_stats.db_time
+        self.rows_fetched += worker_stats.rows_fetched
+        self.queries += worker_stats.queries
+        if worker_stats.peak_rss_kb is not None:
+            self.peak_rss_kb = max(self.peak_rss_kb or 0, worker_stats.peak_rss_kb)
+
+    def to_dict(self):
+        data = super().to_dict()
+        data['peak_rss_kb'] = self.peak_rss_kb
+        data['sub_checks'] = {name: stats.to_dict() for name, stats in self.sub_checks.items()}
+        return data
+
+
+def _write_file(filename, contents):
+    # Write the report atomically, so that e.g. the Prometheus textfile collector never reads a
+    # partially written file
+    temp_filename = filename + ".tmp"
+    with open(temp_filename, "w") as statsfile:
+        statsfile.write(contents)
+    os.replace(temp_filename, filename)
+
+
+def _format_json(all_stats, name_cache_stats, end_time):
+    data = {
+        'timestamp': end_time,
+        'tests': {stats.name: stats.to_dict() for stats in all_stats}}
+    if name_cache_stats is not None:
+        data['name_cache'] = name_cache_stats
+    return json.dumps(data, indent=2) + "\n"
+
+
+def _format_label(value):
+    return '"{}"'.format(value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+
+
+def _format_prometheus(all_stats, name_cache_stats, end_time):
+    lines = []
+    for metric, suffix, help_text in METRICS:
+        name = PROMETHEUS_PREFIX + suffix
+        lines.append("# HELP {} {} of a test or sub-check of the ICAT database checker.".format(name, help_text))
+        lines.append("# TYPE {} gauge".format(name))
+        for stats in all_stats:
+            lines.append("{}{{test={},sub_check=\"\"}} {}".format(name, _format_label(stats.name), getattr(stats, metric)))
+            for sub_check, sub_stats in stats.sub_checks.items():
+                lines.append("{}{{test={},sub_check={}}} {}".format(
+                    name, _format_label(stats.name), _format_label(sub_check), getattr(sub_stats, metric)))
+    name = PROMETHEUS_PREFIX + 'peak_rss_bytes'
+    lines.append("# HELP {} Peak RSS of the checker process during a test.".format(name))
+    lines.append("# TYPE {} gauge".format(name))
+    for stats in all_stats:
+        if stats.peak_rss_kb is not None:
+            lines.append("{}{{test={}}} {}".format(name, _format_label(stats.name), stats.peak_rss_kb * 1024))
+    if name_cache_stats is not None:
+        for metric, suffix, help_text in NAME_CACHE_METRICS:
+            name = PROMETHEUS_PREFIX + suffix
+            lines.append("# HELP {} {} of the ICAT database checker.".format(name, help_text))
+            lines.append("# TYPE {} gauge".format(name))
+            for cache, cache_stats in sorted(name_cache_stats.items()):
+                lines.append("{}{{cache={}}} {}".format(name, _format_label(cache), cache_stats[metric]))
+    name = PROMETHEUS_PREFIX + 'last_run_timestamp_seconds'
+    lines.append("# HELP {} Time at which the last run of the ICAT database checker finished.".format(name))
+    lines.append("# TYPE {} gauge".format(name))
+    lines.append("{} {}".format(name, end_time))
+    return "\n".join(lines) + "\n"
+
+
+def write_stats_file(filename, all_stats, name_cache_stats=None):
+    '''Writes the metrics of all tests, and the counters of the name caches if any, to a file, in the
+       Prometheus textfile format if the file name ends with .prom, and as JSON otherwise.'''
+    end_time = time.time()
+    if filename.endswith(".prom"):
+        _write_file(filename, _format_prometheus(all_stats, name_cache_stats, end_time))
+    else:
+        _write_file(filename, _format_json(all_stats, name_cache_stats, end_time))
@@ -0,0 +1,142 @@
+'''Resolution of collection and data object ids to names, for reporting issues.
+
+Names are kept in bounded LRU caches that are shared by all detectors of a run. Ids that are not
+cached are looked up in bulk, using prepared statements with an array parameter.'''
+import collections
+import threading
+import weakref
+
+# Default maximum number of names per cache
+DEFAULT_CACHE_SIZE = 100000
+
+# Maximum number of ids per lookup query
+LOOKUP_BATCH_SIZE = 50000
+
+# Prepared lookup statements, by cache: (statement name, query)
+LOOKUP_STATEMENTS = {
+    'collection': (
+        'icat_dbcheck_collection_names',
+        "SELECT coll_id, coll_name FROM r_coll_main WHERE coll_id = ANY($1)"),
+    'data_object': (
+        'icat_dbcheck_data_object_names',
+        "SELECT DISTINCT ON (data_id) data_id, coll_id, data_name FROM r_data_main WHERE data_id = ANY($1)")}
+
+
+def _batches(values, batch_size):
+    values = list(values)
+    for start in range(0, len(values), batch_size):
+        yield values[start:start + batch_size]
+
+
+class LRUCache(object):
+    '''Cache that keeps the max_size most recently used entries. Ids that do not exist are cached as
+       well, with value None.'''
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, keys):
+        '''Returns a dictionary with the cached entries of the keys, and a set of keys that are
+           not in the cache.'''
+        found = {}
+        missing = set()
+        for key in keys:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                found[key] = self.entries[key]
+                self.hits += 1
+            else:
+                missing.add(key)
+                self.misses += 1
+        return found, missing
+
+    def add(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def get_stats(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self.entries), 'max_size': self.max_size}
+
+
+class NameResolver(object):
+    '''Resolves ids to names. A resolver can be shared by detectors that run in parallel threads,
+       each with their own connection.'''
+
+    def __init__(self, max_size=DEFAULT_CACHE_SIZE):
+        self.caches = {cache: LRUCache(max_size) for cache in LOOKUP_STATEMENTS}
+        self.lock = threading.Lock()
+        # Names of the statements that have been prepared, by connection
+        self.prepared_statements = weakref.WeakKeyDictionary()
+
+    def _prepare(self, connection, cursor, cache):
+        statement_name, query = LOOKUP_STATEMENTS[cache]
+        with self.lock:
+            prepared_statements = self.prepared_statements.setdefault(connection, set())
+            if statement_name in prepared_statements:
+                return statement_name
+        # Prepared statements belong to the database session. The connection may have been used
+        # by another resolver before.
+        cursor.execute("SELECT 1 FROM pg_prepared_statements WHERE name = %s", (statement_name,))
+        if cursor.fetchone() is None:
+            cursor.execute("PREPARE {} (bigint[]) AS {}".format(statement_name, query))
+        with self.lock:
+            prepared_statements.add(statement_name)
+        return statement_name
+
+    def _resolve(self, connection, cache, ids):
+        '''Returns a dictionary with the cached entries of the ids, and the database rows of the ids
+           that are not cached.'''
+        with self.lock:
+            found, missing = self.caches[cache].lookup(set(ids))
+        rows = []
+        if len(missing) > 0:
+            cursor = connection.cursor()
+            statement_name = self._prepare(connection, cursor, cache)
+            for batch in _batches(missing, LOOKUP_BATCH_SIZE):
+                cursor.execute("EXECUTE {} (%s)".format(statement_name), (batch,))
+                rows.extend(cursor.fetchall())
+            cursor.close()
+        return found, missing, rows
+
+    def get_collection_names(self, connection, coll_ids):
+        '''Returns a dictionary with collection ids (keys) and collection names (values). The name is
+           None for ids of collections that do not exist.'''
+        result, missing, rows = self._resolve(connection, 'collection', coll_ids)
+        for coll_id, coll_name in rows:
+            result[coll_id] = coll_name
+        with self.lock:
+            for coll_id in missing:
+                result.setdefault(coll_id, None)
+                self.caches['collection'].add(coll_id, result[coll_id])
+        return result
+
+    def get_dataobject_names(self, connection, data_ids):
+        '''Returns a dictionary with data object ids (keys) and full data object names (values). The name
+           is None for ids of data objects that do not exist, or that are in a collection that does not
+           exist.'''
+        result, missing, rows = self._resolve(connection, 'data_object', data_ids)
+        coll_names = self.get_collection_names(connection, {coll_id for _, coll_id, _ in rows})
+        for data_id, coll_id, data_name in rows:
+            if coll_names.get(coll_id) is not None:
+                result[data_id] = coll_names[coll_id] + "/" + data_name
+        with self.lock:
+            for data_id in missing:
+                result.setdefault(data_id, None)
+                self.caches['data_object'].add(data_id, result[data_id])
+        return result
+
+    def prefetch_collection_names(self, connection, coll_ids):
+        '''Adds the names of collections to the cache, so that they can be resolved without queries
+           later on.'''
+        self.get_collection_names(connection, coll_ids)
+
+    def get_stats(self):
+        '''Returns the hit and miss counters and the size of each cache.'''
+        with self.lock:
+            return {cache: self.caches[cache].get_stats() for cache in self.caches}
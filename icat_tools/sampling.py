@@ -0,0 +1,84 @@
+'''Support for sampled runs, which check a random sample of the rows of the catalog tables with
+TABLESAMPLE, and estimate the number of issues of each check in the whole table from the issues in the
+sample.
+
+SYSTEM sampling reads a random subset of the blocks of a table, so that its cost is proportional to
+the sample size. BERNOULLI sampling selects individual rows, so it reads the whole table, but rows
+are sampled independently. The confidence intervals assume independently sampled rows. With SYSTEM
+sampling, they are too narrow if rows with issues are clustered in blocks, e.g. because they have
+been created together.'''
+import math
+
+# Default seed of the sample, so that repeated runs check the same rows
+DEFAULT_SEED = 1
+
+# Quantile of the standard normal distribution for 95% confidence intervals
+CONFIDENCE_Z = 1.96
+
+
+def get_table_sample_clause(method, percent, seed):
+    return "TABLESAMPLE {} ({}) REPEATABLE ({})".format(method.upper(), float(percent), int(seed))
+
+
+def get_confidence_interval(number_issues, number_rows, z=CONFIDENCE_Z):
+    '''Returns the Wilson score interval of the fraction of rows with issues, which unlike the normal
+       approximation is also meaningful when there are few or no issues in the sample.'''
+    fraction = number_issues / number_rows
+    denominator = 1 + z * z / number_rows
+    center = (fraction + z * z / (2 * number_rows)) / denominator
+    half_width = z * math.sqrt(fraction * (1 - fraction) / number_rows +
+                               z * z / (4 * number_rows * number_rows)) / denominator
+    return max(center - half_width, 0.0), min(center + half_width, 1.0)
+
+
+class SampleEstimator(object):
+    '''Numbers of sampled rows per sub-check, and numbers of issues per sub-check and type of issue.
+       Sub-checks are the check names of the issues, or None for tests with a single check.'''
+
+    def __init__(self, percent):
+        self.percent = percent
+        self.sampled_rows = {}
+        self.issues = {}
+
+    def add_rows(self, sub_check, number_rows):
+        self.sampled_rows[sub_check] = self.sampled_rows.get(sub_check, 0) + number_rows
+
+    def add_issue(self, sub_check, issue_type):
+        key = (sub_check, issue_type)
+        self.issues[key] = self.issues.get(key, 0) + 1
+
+    def get_estimates(self):
+        '''Returns (sub-check, type of issue, number of sampled rows, number of issues, estimated rows,
+           estimated issues, lower bound, upper bound) tuples for all sub-checks. Sub-checks without
+           issues have type None.'''
+        estimates = []
+        scale = 100.0 / self.percent
+        for sub_check, number_rows in self.sampled_rows.items():
+            issue_types = sorted(issue_type for check, issue_type in self.issues
+                                 if check == sub_check and issue_type is not None)
+            if (sub_check, None) in self.issues or len(issue_types) == 0:
+                issue_types.insert(0, None)
+            for issue_type in issue_types:
+                number_issues = self.issues.get((sub_check, issue_type), 0)
+                estimated_rows = number_rows * scale
+                if number_rows == 0:
+                    low, high = 0.0, 0.0
+                else:
+                    low, high = get_confidence_interval(number_issues, number_rows)
+                estimates.append((sub_check, issue_type, number_rows, number_issues, estimated_rows,
+                                  number_issues * scale, low * estimated_rows, high * estimated_rows))
+        return estimates
+
+    def print_estimates(self, output_processor, test):
+        for (sub_check, issue_type, number_rows, number_issues, estimated_rows, estimated_issues,
+             low, high) in self.get_estimates():
+            name = ", ".join(str(part) for part in [sub_check, issue_type] if part is not None)
+            name = test if name == "" else "{} ({})".format(test, name)
+            if number_rows == 0:
+                output_processor.print_progress("Estimate for {}: no rows in the sample".format(name))
+                continue
+            output_processor.print_progress(
+                "Estimate for {}: about {:.0f} issues in about {:.0f} rows ({:.2f}%), 95% confidence interval "
+                "{:.0f} to {:.0f}, from {} issues in a sample of {} rows".format(
+                    name, estimated_issues, estimated_rows, 100.0 * number_issues / number_rows,
+                    low, high, number_issues, number_rows))
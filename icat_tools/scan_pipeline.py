@@ -0,0 +1,93 @@
+'''Shared scans of catalog tables, for detectors that can check rows one by one.
+
+Detectors register the columns they need and a callback for each table. The pipeline then reads each
+table once, with a projection of the columns of all detectors, and passes every batch of rows to all
+callbacks of the table.'''
+from icat_tools import metrics, utils
+from icat_tools.vectorized import ColumnBatch
+
+
+class ScanPipeline(object):
+
+    def __init__(self, connection, output_processor, verbose=False, fetch_size=utils.DEFAULT_FETCH_SIZE):
+        self.connection = connection
+        self.output_processor = output_processor
+        self.verbose = verbose
+        # Number of rows that are fetched and passed to the callbacks at a time
+        self.fetch_size = fetch_size
+        self.scans = {}
+        # Metrics of the scans. The checks of the detectors are included, but their issues are
+        # only counted in the metrics of the detectors.
+        self.stats = metrics.TestStats('shared_scan')
+
+    def register(self, table, where_clause, columns, callback, finish_callback=None, name=None, columnar=False):
+        '''Registers a callback for rows of a table. The callback is called with a list of rows and a
+           dictionary with the position of each column in the rows, or with a ColumnBatch if columnar
+           is set. Callbacks that use the same table and where clause share a scan. The finish callback
+           is called after the scan has completed.'''
+        key = (table, where_clause)
+        if key not in self.scans:
+            self.scans[key] = {'columns': [], 'callbacks': [], 'finish_callbacks': [], 'names': []}
+        scan = self.scans[key]
+        for column in columns:
+            if column not in scan['columns']:
+                scan['columns'].append(column)
+        scan['callbacks'].append((callback, columnar))
+        if finish_callback is not None:
+            scan['finish_callbacks'].append(finish_callback)
+        if name is not None and name not in scan['names']:
+            scan['names'].append(name)
+
+    def _run_callbacks(self, scan, batch):
+        for callback, columnar in scan['callbacks']:
+            if columnar:
+                callback(batch)
+            else:
+                callback(batch.rows, batch.column_index)
+
+    def run(self):
+        for (table, where_clause), scan in self.scans.items():
+            if self.verbose:
+                self.output_processor.print_progress("Running shared scan of {} for: {}".format(
+                    table, ", ".join(scan['names'])))
+
+            columns = scan['columns']
+            column_index = {column: position for position, column in enumerate(columns)}
+            query = "SELECT {} FROM {} {}".format(",".join(columns), table, where_clause)
+            with self.stats.measure(self.connection), self.stats.measure(self.connection, table):
+                cursor = utils.get_server_side_cursor(self.connection, "scan_pipeline", self.fetch_size)
+                cursor.execute(query)
+
+                while True:
+                    rows = cursor.fetchmany(self.fetch_size)
+                    if len(rows) == 0:
+                        break
+                    self._run_callbacks(scan, ColumnBatch(column_index, rows=rows))
+
+                cursor.close()
+
+                for finish_callback in scan['finish_callbacks']:
+                    finish_callback()
+
+
+class SnapshotScanPipeline(ScanPipeline):
+    '''Scan pipeline that reads the tables from a snapshot file instead of the database. The
+       connection is a Snapshot.'''
+
+    def run(self):
+        for (table, where_clause), scan in self.scans.items():
+            if self.verbose:
+                self.output_processor.print_progress("Running scan of {} in snapshot for: {}".format(
+                    table, ", ".join(scan['names'])))
+
+            columns = scan['columns']
+            column_index = {column: position for position, column in enumerate(columns)}
+            with self.stats.measure(self.connection), self.stats.measure(self.connection, table) as table_stats:
+                for column_values in self.connection.scan_columns(table, columns, self.fetch_size):
+                    batch = ColumnBatch(column_index, columns=column_values)
+                    self.stats.rows_fetched += len(batch)
+                    table_stats.rows_fetched += len(batch)
+                    self._run_callbacks(scan, batch)
+
+                for finish_callback in scan['finish_callbacks']:
+                    finish_callback()
@@ -0,0 +1,155 @@
+'''Support for running detectors on shards of r_data_main in parallel worker processes. Shards are
+either ranges of data_id values or groups of resources.
+
+All workers import the same snapshot, which is exported by a coordinating connection, so that
+the merged results are consistent with a single-process run.'''
+from argparse import Namespace
+from icat_tools import utils
+from icat_tools.dbcheck_outputprocessors import CollectingOutputProcessor
+from icat_tools.detectors.detector import RunContext
+import multiprocessing
+
+_worker_connection = None
+
+
+def _init_worker(config, snapshot_id):
+    global _worker_connection
+    _worker_connection = utils.get_connection_database(config)
+    _worker_connection.set_session(isolation_level='REPEATABLE READ', readonly=True)
+    cursor = _worker_connection.cursor()
+    cursor.execute("SET TRANSACTION SNAPSHOT %s", (snapshot_id,))
+    cursor.close()
+
+
+def _run_shard(task):
+    detector_class, args, prefix_conditions, incremental_conditions, shard_condition, shard_resources = task
+    output_processor = CollectingOutputProcessor()
+    context = RunContext(args, incremental_conditions, prefix_conditions)
+    detector = detector_class(args, _worker_connection, output_processor, context)
+    detector.shard_condition = shard_condition
+    detector.shard_resources = shard_resources
+    with detector.measure():
+        issue_found = detector.run()
+    return issue_found, output_processor.output_list, detector.stats
+
+
+def _get_data_id_bounds(connection, number_shards):
+    '''Returns number_shards - 1 data_id values that split r_data_main into shards of about equal
+       size. The bounds are based on the statistics of the table if they are available, otherwise
+       on the range of data_id values.'''
+    cursor = connection.cursor()
+    cursor.execute("""SELECT histogram_bounds::text::bigint[] FROM pg_stats
+                      WHERE tablename = 'r_data_main' AND attname = 'data_id'""")
+    row = cursor.fetchone()
+    if row is not None and row[0] is not None and len(row[0]) > number_shards:
+        histogram = row[0]
+        bounds = [histogram[(len(histogram) - 1) * shard // number_shards]
+                  for shard in range(1, number_shards)]
+    else:
+        cursor.execute("SELECT min(data_id), max(data_id) FROM r_data_main")
+        min_id, max_id = cursor.fetchone()
+        if min_id is None:
+            min_id, max_id = 0, 0
+        bounds = [min_id + (max_id - min_id + 1) * shard // number_shards
+                  for shard in range(1, number_shards)]
+    cursor.close()
+    return sorted(set(bounds))
+
+
+def get_shard_conditions(connection, shard_by, number_shards):
+    '''Returns a list of conditions on r_data_main, one for each shard of data_id values.'''
+    if shard_by != 'data_id':
+        raise ValueError("Unknown shard key: {}".format(shard_by))
+    bounds = _get_data_id_bounds(connection, number_shards)
+    conditions = []
+    for shard in range(len(bounds) + 1):
+        shard_conditions = []
+        if shard > 0:
+            shard_conditions.append("r_data_main.data_id >= {}".format(bounds[shard - 1]))
+        if shard < len(bounds):
+            shard_conditions.append("r_data_main.data_id < {}".format(bounds[shard]))
+        conditions.append(" AND ".join(shard_conditions) if len(shard_conditions) > 0 else "TRUE")
+    return conditions
+
+
+def get_resource_shards(connection, resc_ids, number_shards):
+    '''Splits a list of resources in at most number_shards groups of consecutive resources with about the
+       same number of replicas, so that every shard only reads the entries of its own resources, and the
+       output of the shards is in the same order as that of a single-process run. The sizes of the
+       resources are based on the statistics of r_data_main if they are available. Returns a list of
+       lists of resource ids.'''
+    cursor = connection.cursor()
+    cursor.execute("""SELECT most_common_vals::text::bigint[], most_common_freqs FROM pg_stats
+                      WHERE tablename = 'r_data_main' AND attname = 'resc_id'""")
+    row = cursor.fetchone()
+    cursor.close()
+    frequencies = {}
+    if row is not None and row[0] is not None:
+        frequencies = dict(zip(row[0], row[1]))
+    # Resources that are not among the most common values have at most as many replicas as those that are
+    default_frequency = min(frequencies.values()) if len(frequencies) > 0 else 1.0
+    sizes = [frequencies.get(resc_id, default_frequency) for resc_id in resc_ids]
+
+    shards = [[] for _ in range(number_shards)]
+    total_size = sum(sizes)
+    size_before = 0.0
+    for resc_id, size in zip(resc_ids, sizes):
+        # Every resource goes to the shard that contains the middle of its part of the total size
+        shard = min(int((size_before + size / 2) * number_shards / total_size), number_shards - 1)
+        shards[shard].append(resc_id)
+        size_before += size
+    return [shard for shard in shards if len(shard) > 0]
+
+
+def run_sharded(detector):
+    '''Runs a detector on shards of r_data_main in a pool of worker processes, each with their own
+       database connection. Output of the shards is passed on in shard order.'''
+    args = detector.args
+    number_processes = args.shards
+    config = utils.read_database_config(args.config_file)
+
+    # The output file cannot be passed to worker processes. They don't need it, since their output
+    # is collected and passed on by this process.
+    worker_args = Namespace(**vars(args))
+    worker_args.output = None
+
+    prefix_conditions = {}
+    if args.data_object_prefix is not None:
+        prefix_conditions[args.data_object_prefix] = detector.get_data_object_prefix_condition()
+
+    coordinator = utils.get_connection_database(config)
+    coordinator.set_session(isolation_level='REPEATABLE READ', readonly=True)
+    issue_found = False
+    try:
+        cursor = coordinator.cursor()
+        cursor.execute("SELECT pg_export_snapshot()")
+        snapshot_id = cursor.fetchone()[0]
+        if detector.shard_by == 'resc_id':
+            # Only the resources that the detector checks are divided over the shards
+            shards = [(None, shard_resources) for shard_resources in get_resource_shards(
+                coordinator, list(detector.get_resource_vault_path_dict()), number_processes)]
+        else:
+            shards = [(shard_condition, None)
+                      for shard_condition in get_shard_conditions(coordinator, detector.shard_by, number_processes)]
+        tasks = [(type(detector), worker_args, prefix_conditions, detector.context.incremental_conditions,
+                  shard_condition, shard_resources) for shard_condition, shard_resources in shards]
+
+        if args.v:
+            detector.print_progress("Running test {} on {} shards in {} processes".format(
+                detector.get_name(), len(tasks), number_processes))
+
+        context = multiprocessing.get_context('spawn')
+        with context.Pool(number_processes, initializer=_init_worker, initargs=(config, snapshot_id)) as pool:
+            for shard_issue_found, output_list, shard_stats in pool.imap(_run_shard, tasks):
+                if shard_issue_found:
+                    issue_found = True
+                detector.stats.add_worker_stats(shard_stats)
+                for output_type, values in output_list:
+                    if output_type == 'item':
+                        detector.output_item(values)
+                    else:
+                        detector.output_message(values)
+    finally:
+        coordinator.close()
+
+    return issue_found
@@ -1,54 +1,71 @@
+from icat_tools import metrics
+import itertools
 import json
 import psycopg2
+import psycopg2.pool
+import psycopg2.sql
 import sys
 
+# Default number of rows that server-side cursors fetch from the database at a time
+DEFAULT_FETCH_SIZE = 10000
+
+# Query of the names of all collections
+COLL_PATH_QUERY = "SELECT coll_id, coll_name FROM r_coll_main"
+
+# Numbers that make the names of server-side cursors unique
+_cursor_numbers = itertools.count()
+
+
 def read_database_config(config_filename):
     with open(config_filename) as configfile:
         data = json.load(configfile)
     return data['plugin_configuration']['database']['postgres']
 
 
+def _get_connection_parameters(config):
+    return {'user': config['db_username'],
+            'password': config['db_password'],
+            'host': config['db_host'],
+            'port': config['db_port'],
+            'database': config['db_name']}
+
+
 def get_connection_database(config):
     try:
-        connection = psycopg2.connect(user=config['db_username'],
-                                      password=config['db_password'],
-                                      host=config['db_host'],
-                                      port=config['db_port'],
-                                      database=config['db_name'])
+        connection = psycopg2.connect(cursor_factory=metrics.InstrumentedCursor,
+                                      **_get_connection_parameters(config))
     except (Exception, psycopg2.Error) as error:
         print("Error while connecting to database: ", error)
         sys.exit(1)
     return connection
 
 
-def get_collection_name(connection, search_coll_id):
-    query = "SELECT coll_name FROM r_coll_main WHERE coll_id = {}".format(
-        str(search_coll_id))
-    cursor = connection.cursor()
-    cursor.execute(query)
-    if cursor.rowcount == 1:
-        collection = cursor.fetchone()
-        return collection[0]
-    elif cursor.rowcount > 1:
-        raise ValueError(
-            "Unexpected duplicate result when retrieving collection name.")
-    else:
-        return None
+def get_server_side_cursor(connection, name, fetch_size=DEFAULT_FETCH_SIZE):
+    '''Returns a named (server-side) cursor. The database keeps the result set, and the cursor fetches
+       fetch_size rows at a time while it is iterated, so that memory usage of the checker does not
+       depend on the size of the result. A number is added to the name, so that cursors with the same
+       name can be open at the same time.'''
+    cursor = connection.cursor("{}_{}".format(name, next(_cursor_numbers)))
+    cursor.itersize = fetch_size
+    return cursor
 
 
-def get_dataobject_name(connection, search_data_id):
-    query = "SELECT data_name, coll_id FROM r_data_main WHERE data_id = {}".format(
-        str(search_data_id))
-    cursor = connection.cursor()
-    cursor.execute(query)
-    
-    if cursor.rowcount >= 1:
-        # It is possible that we get multiple matches for the dataobject id, because the table
-        # has separate entries for replicas
-        data_entry = cursor.fetchone()
-        return get_collection_name(connection, data_entry[1]) + "/" + data_entry[0]
-    else:
-        return None
+def get_connection_pool(config, max_connections):
+    ''' Returns a thread-safe pool of up to max_connections database connections. '''
+    try:
+        pool = psycopg2.pool.ThreadedConnectionPool(
+            1, max_connections, cursor_factory=metrics.InstrumentedCursor,
+            **_get_connection_parameters(config))
+    except (Exception, psycopg2.Error) as error:
+        print("Error while connecting to database: ", error)
+        sys.exit(1)
+    return pool
+
+
+def get_async_connection(config):
+    '''Returns an asynchronous connection, which needs to be polled until it is ready. Asynchronous
+       connections are always in autocommit mode.'''
+    return psycopg2.connect(async_=1, **_get_connection_parameters(config))
 
 
 def get_resource_vault_path_dict(connection):
@@ -73,12 +90,85 @@ def get_resource_name_dict(connection):
     return result
 
 
-def get_coll_path_dict(connection):
+def get_coll_path_dict(connection, fetch_size=DEFAULT_FETCH_SIZE):
     '''Returns a dictionary with collection ids (keys) and collection names (values) of all collections. '''
-    query = "SELECT coll_id, coll_name FROM r_coll_main"
     result = {}
-    cursor = connection.cursor('get_coll_path_dict')
-    cursor.execute(query)
+    cursor = get_server_side_cursor(connection, 'get_coll_path_dict', fetch_size)
+    cursor.execute(COLL_PATH_QUERY)
     for row in cursor:
         result[row[0]] = row[1]
+    cursor.close()
     return result
+
+
+def quote_literal(connection, value):
+    ''' Returns a value as a quoted SQL literal, for use in queries that are composed as strings. '''
+    return psycopg2.sql.Literal(value).as_string(connection)
+
+
+def _is_byte_ordered(connection):
+    '''Returns whether the collation of the database sorts text by byte value, like the C collation.'''
+    cursor = connection.cursor()
+    cursor.execute("SELECT datcollate FROM pg_database WHERE datname = current_database()")
+    collation = cursor.fetchone()[0]
+    cursor.close()
+    return collation in ('C', 'POSIX') or collation.startswith('C.')
+
+
+def _get_prefix_upper_bound(prefix):
+    '''Returns the lowest string that sorts after all strings that start with prefix in byte order, or
+       None if there is no such string.'''
+    while len(prefix) > 0:
+        code_point = ord(prefix[-1]) + 1
+        # Surrogates cannot be encoded in UTF-8
+        if 0xD800 <= code_point <= 0xDFFF:
+            code_point = 0xE000
+        if code_point <= 0x10FFFF:
+            return prefix[:-1] + chr(code_point)
+        prefix = prefix[:-1]
+    return None
+
+
+def _get_prefix_range_condition(connection, column, prefix, collation):
+    conditions = ["{}{} >= {}".format(column, collation, quote_literal(connection, prefix))]
+    upper_bound = _get_prefix_upper_bound(prefix)
+    if upper_bound is not None:
+        conditions.append("{}{} < {}".format(column, collation, quote_literal(connection, upper_bound)))
+    return " AND ".join(conditions)
+
+
+def get_data_object_prefix_condition(connection, prefix):
+    ''' Returns an SQL condition on r_data_main that selects data objects with a full name (collection
+        name, slash, data object name) that starts with prefix. Matching collections are selected in a
+        subquery with a range condition on the collection name, which the coll_name index can serve if
+        the database sorts text by byte value. Other collations sort names with a common prefix differently,
+        so the range is then compared in the C collation, and r_coll_main is scanned once. The database can
+        join the selected collections with r_data_main using its coll_id index, rather than look up the
+        collection name of every data object. '''
+    collation = "" if _is_byte_ordered(connection) else ' COLLATE "C"'
+
+    # Collections where all data objects match the prefix
+    coll_conditions = [_get_prefix_range_condition(connection, "coll_name", prefix, collation)]
+    if prefix.endswith("/"):
+        coll_conditions.append("coll_name = {}".format(quote_literal(connection, prefix[:-1])))
+
+    # Collection where only data objects with names that start with the remainder of the prefix match.
+    # Data object names cannot contain slashes, so only the part of the prefix before the last slash
+    # can be a collection name.
+    name_condition = None
+    parent_end = prefix.rfind("/")
+    if parent_end >= 0 and parent_end < len(prefix) - 1:
+        parent_name = quote_literal(connection, prefix[:parent_end])
+        coll_conditions.append("coll_name = {}".format(parent_name))
+        name_condition = ("r_data_main.coll_id IS DISTINCT FROM ( SELECT coll_id FROM r_coll_main " +
+                          "WHERE coll_name = {} ) OR ( {} )").format(
+            parent_name,
+            _get_prefix_range_condition(connection, "r_data_main.data_name", prefix[parent_end + 1:], collation))
+
+    # All collections are selected in a single subquery, so that the database can use a semi-join
+    condition = "r_data_main.coll_id IN ( SELECT coll_id FROM r_coll_main WHERE {} )".format(
+        " OR ".join("( {} )".format(coll_condition) for coll_condition in coll_conditions))
+    if name_condition is None:
+        return "( {} )".format(condition)
+    else:
+        return "( {} AND ( {} ) )".format(condition, name_condition)
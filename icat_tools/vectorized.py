@@ -0,0 +1,83 @@
+'''Columnar batches of rows for vectorized checks, which process the rows of a shared scan with NumPy
+instead of one by one. Only the rows with issues are converted back to Python objects.
+
+NumPy is an optional dependency. It is only needed with --vectorized.'''
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class ColumnBatch(object):
+    '''A batch of rows of a shared scan. Columns are converted to NumPy arrays when a check first
+       uses them, so that checks that use the same column share the conversion.'''
+
+    def __init__(self, column_index, rows=None, columns=None):
+        '''A batch is created from either a list of rows, or a list of values per column.'''
+        self.column_index = column_index
+        self._rows = rows
+        self._columns = columns
+        self._arrays = {}
+
+    @property
+    def rows(self):
+        if self._rows is None:
+            self._rows = list(zip(*self._columns))
+        return self._rows
+
+    def __len__(self):
+        return len(self.rows) if self._columns is None else len(self._columns[0])
+
+    def get_values(self, column):
+        '''Returns the values of a column as a sequence.'''
+        if self._columns is None:
+            self._columns = list(zip(*self._rows))
+        return self._columns[self.column_index[column]]
+
+    def get_int_array(self, column):
+        '''Returns the values of a column as an array of 64-bit integers. Text is converted like int()
+           does. Raises ValueError, TypeError or OverflowError if a value cannot be converted, for
+           example if it is NULL.'''
+        if column not in self._arrays:
+            self._arrays[column] = numpy.array(self.get_values(column), dtype=numpy.int64)
+        return self._arrays[column]
+
+    def get_hash_array(self, *columns):
+        '''Returns the Python hash values of the tuples of the values of columns, as an array of 64-bit
+           integers. Equal values have equal hashes, but values with equal hashes still need to be
+           compared.'''
+        key = ('hash',) + columns
+        if key not in self._arrays:
+            values = zip(*(self.get_values(column) for column in columns))
+            self._arrays[key] = numpy.fromiter(map(hash, values), dtype=numpy.int64, count=len(self))
+        return self._arrays[key]
+
+    def get_rows(self, positions):
+        '''Returns the rows at the positions of an array.'''
+        return [self.rows[position] for position in positions.tolist()]
+
+
+def concatenate(arrays):
+    '''Concatenates the arrays of a column that have been collected from several batches.'''
+    if len(arrays) == 0:
+        return numpy.empty(0, dtype=numpy.int64)
+    return numpy.concatenate(arrays)
+
+
+def is_in(values, allowed_values):
+    '''Returns an array of booleans that tell which values of an array of integers are in a collection
+       of allowed values.'''
+    return numpy.isin(values, numpy.array(list(allowed_values), dtype=numpy.int64))
+
+
+def get_distinct_pair_counts(keys, values):
+    '''Returns the distinct keys of two arrays of pairs, in ascending order, with the number of distinct
+       values of each key.'''
+    order = numpy.lexsort((values, keys))
+    keys = keys[order]
+    values = values[order]
+    distinct = numpy.ones(len(keys), dtype=bool)
+    distinct[1:] = (keys[1:] != keys[:-1]) | (values[1:] != values[:-1])
+    return numpy.unique(keys[distinct], return_counts=True)
+
@@ -5,7 +5,7 @@ setup(
    author_email="s.t.snel@uu.nl",
    description=('Toolkit to detect issues in iRODS ICAT-database'),
    install_requires=[
-       'psycopg2-binary>=2.7.7',
+       'psycopg2-binary>=2.8',
    ],
    name='icat_tools',
    packages=['icat_tools','icat_tools.detectors'],
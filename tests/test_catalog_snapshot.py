@@ -0,0 +1,169 @@
+from icat_tools import catalog_snapshot
+from icat_tools.catalog_snapshot import (Snapshot, SnapshotError, SnapshotNameResolver, SNAPSHOT_TABLES,
+                                         export_snapshot)
+from unittest import mock
+import os
+import re
+import tempfile
+import unittest
+
+RESC_PARENT_COLUMN = "CAST(NULLIF(r_resc_main.resc_parent, '') AS bigint)"
+
+TABLES = {
+    'r_coll_main': [
+        (1, "/zone", "/", "01600000000", "01600000000"),
+        (2, "/zone/home", "/zone", "01600000000", None),
+        (3, "/zone/home/tab\tnew\nline\\", "/zone/home", "01600000000", "01600000000")],
+    'r_data_main': [
+        (10, 2, "a.txt", 5, "/vault/a.txt", "01600000000", "01600000000"),
+        (10, 2, "a.txt", 6, "/vault2/a.txt", "01600000000", "01600000000"),
+        (11, 3, "é.txt", 5, None, "01600000000", "01600000000"),
+        (12, 4, "", 5, "", "01600000000", "01600000000")],
+    'r_resc_main': [
+        (5, "demoResc", "unixfilesystem", "/vault", "01600000000", "01600000000", 0, None),
+        (6, "child", "unixfilesystem", "/vault2", "01600000000", "01600000000", 1, 5),
+        (7, "root", "passthru", "", "01600000000", "01600000000", 0, None)],
+    'r_meta_main': [(100,), (101,)]}
+
+
+def format_field(value):
+    if value is None:
+        return b'\\N'
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').encode('utf-8')
+
+
+class FakeCursor(object):
+    '''Cursor that passes the rows of tables in memory to COPY, a line at a time.'''
+
+    def copy_expert(self, query, output):
+        table = re.search(r" FROM (\w+)", query).group(1)
+        for row in TABLES.get(table, []):
+            output.write(b'\t'.join(format_field(value) for value in row) + b'\n')
+
+    def close(self):
+        pass
+
+
+class FailingCursor(FakeCursor):
+
+    def copy_expert(self, query, output):
+        if "r_objt_access" in query:
+            raise KeyboardInterrupt()
+        super().copy_expert(query, output)
+
+
+class FakeConnection(object):
+
+    def __init__(self, cursor_class=FakeCursor):
+        self.cursor_class = cursor_class
+        self.rolled_back = False
+
+    def set_session(self, **kwargs):
+        self.session = kwargs
+
+    def set_client_encoding(self, encoding):
+        pass
+
+    def cursor(self):
+        return self.cursor_class()
+
+    def rollback(self):
+        self.rolled_back = True
+
+
+class SnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, "catalog.snapshot")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def _export(self):
+        connection = FakeConnection()
+        progress = []
+        export_snapshot(connection, self.filename, progress.append)
+        self.assertTrue(connection.rolled_back)
+        self.assertEqual(connection.session, {'isolation_level': 'REPEATABLE READ', 'readonly': True})
+        self.assertEqual(len(progress), len(SNAPSHOT_TABLES))
+        self.assertEqual(os.listdir(self.directory.name), ["catalog.snapshot"])
+        return Snapshot(self.filename)
+
+    def test_round_trip(self):
+        snapshot = self._export()
+        for table, rows in TABLES.items():
+            columns = [column for column, _, _ in SNAPSHOT_TABLES[table]['columns']]
+            self.assertEqual([row for batch in snapshot.scan(table, columns, 2) for row in batch], rows, table)
+        self.assertEqual(snapshot.get_row_count('r_objt_access'), 0)
+        self.assertEqual(list(snapshot.scan('r_objt_access', ['object_id', 'create_ts'], 10)), [])
+        self.assertGreater(snapshot.exported_at, 0)
+
+    @mock.patch.object(catalog_snapshot, 'COPY_BUFFER_SIZE', 1)
+    def test_round_trip_of_small_copy_buffers(self):
+        snapshot = self._export()
+        self.assertEqual([row for batch in snapshot.scan('r_data_main', ['data_id', 'data_name', 'data_path'], 3)
+                          for row in batch],
+                         [(10, "a.txt", "/vault/a.txt"), (10, "a.txt", "/vault2/a.txt"), (11, "é.txt", None),
+                          (12, "", "")])
+
+    def test_get_column(self):
+        snapshot = self._export()
+        self.assertEqual(snapshot.get_column('r_coll_main', 'coll_name').get(2), "/zone/home/tab\tnew\nline\\")
+        self.assertIsNone(snapshot.get_column('r_coll_main', 'modify_ts').get(1))
+        self.assertIsNone(snapshot.get_column('r_resc_main', RESC_PARENT_COLUMN).get(0))
+        self.assertEqual(snapshot.get_column('r_resc_main', RESC_PARENT_COLUMN).get(1), 5)
+        with self.assertRaises(SnapshotError):
+            snapshot.get_column('r_coll_main', 'unknown')
+
+    def test_lookups(self):
+        snapshot = self._export()
+        self.assertEqual(snapshot.get_lookup('r_data_main', 'resc_id'), {5, 6})
+        self.assertEqual(snapshot.get_lookup('r_resc_main', RESC_PARENT_COLUMN), {5})
+        with mock.patch.object(catalog_snapshot, 'LOOKUP_SET_MAX_ROWS', 0):
+            lookup = snapshot.get_lookup('r_meta_main', 'meta_id')
+        self.assertIsInstance(lookup, catalog_snapshot._SortedColumnLookup)
+        self.assertIn(101, lookup)
+        self.assertNotIn(102, lookup)
+
+    def test_rows_by_key(self):
+        snapshot = self._export()
+        self.assertEqual(snapshot.find_row('r_data_main', 11), 2)
+        self.assertIsNone(snapshot.find_row('r_data_main', 9))
+        self.assertEqual(snapshot.get_rows_by_key('r_data_main', [10, 13], ['resc_id']), {10: [(5,), (6,)]})
+        self.assertEqual(snapshot.get_coll_path_dict(2),
+                         {1: "/zone", 2: "/zone/home", 3: "/zone/home/tab\tnew\nline\\"})
+        self.assertEqual(snapshot.get_resource_name_dict(), {5: "demoResc", 6: "child", 7: "root"})
+        self.assertEqual(snapshot.get_resource_vault_path_dict(), {5: "/vault", 6: "/vault2"})
+
+    def test_name_resolver(self):
+        snapshot = self._export()
+        resolver = SnapshotNameResolver()
+        self.assertEqual(resolver.get_collection_names(snapshot, [2, 4]), {2: "/zone/home", 4: None})
+        self.assertEqual(resolver.get_dataobject_names(snapshot, [10, 12, 13]),
+                         {10: "/zone/home/a.txt", 12: None, 13: None})
+
+    def test_failed_export(self):
+        with self.assertRaises(KeyboardInterrupt):
+            export_snapshot(FakeConnection(FailingCursor), self.filename)
+        self.assertEqual(os.listdir(self.directory.name), [])
+
+    def test_incomplete_file(self):
+        self._export()
+        with open(self.filename, 'rb') as snapshot_file:
+            data = snapshot_file.read()
+        with open(self.filename, 'wb') as snapshot_file:
+            snapshot_file.write(data[:-1])
+        with self.assertRaises(SnapshotError):
+            Snapshot(self.filename)
+
+    def test_other_byte_order(self):
+        other_byteorder = 'big' if catalog_snapshot.sys.byteorder == 'little' else 'little'
+        with mock.patch.object(catalog_snapshot.sys, 'byteorder', other_byteorder):
+            self._export()
+        with self.assertRaises(SnapshotError):
+            Snapshot(self.filename)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+from argparse import Namespace
+from icat_tools.chunking import Checkpoint, CheckpointMismatchError
+import os
+import tempfile
+import unittest
+
+
+def get_args(min_replicas=2):
+    return Namespace(run_test='all', data_object_prefix=None, min_replicas=min_replicas, engine=None)
+
+
+class CheckpointTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, "checkpoint.json")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_new_checkpoint(self):
+        checkpoint = Checkpoint(self.filename, get_args(), resume=True)
+        self.assertFalse(checkpoint.is_completed("names"))
+        self.assertIsNone(checkpoint.get_last_data_id("names"))
+        self.assertFalse(checkpoint.are_other_tables_completed("names"))
+        self.assertFalse(checkpoint.issue_found)
+        self.assertFalse(os.path.exists(self.filename))
+
+    def test_resume(self):
+        checkpoint = Checkpoint(self.filename, get_args(), resume=False)
+        checkpoint.record_progress("names", last_data_id=10, other_tables_completed=True)
+        checkpoint.record_progress("timestamps", completed=True, issue_found=True)
+
+        resumed = Checkpoint(self.filename, get_args(), resume=True)
+        self.assertEqual(resumed.get_last_data_id("names"), 10)
+        self.assertFalse(resumed.is_completed("names"))
+        self.assertTrue(resumed.are_other_tables_completed("names"))
+        self.assertTrue(resumed.is_completed("timestamps"))
+        self.assertTrue(resumed.issue_found)
+
+    def test_start_over(self):
+        Checkpoint(self.filename, get_args(), resume=False).record_progress("names", completed=True)
+        checkpoint = Checkpoint(self.filename, get_args(), resume=False)
+        self.assertFalse(checkpoint.is_completed("names"))
+
+    def test_other_options(self):
+        Checkpoint(self.filename, get_args(), resume=False).record_progress("minreplicas", last_data_id=10)
+        with self.assertRaises(CheckpointMismatchError):
+            Checkpoint(self.filename, get_args(min_replicas=3), resume=True)
+        # Starting over is always possible
+        Checkpoint(self.filename, get_args(min_replicas=3), resume=False)
+
+    def test_other_tables_completed_is_kept(self):
+        checkpoint = Checkpoint(self.filename, get_args(), resume=False)
+        checkpoint.record_progress("names", other_tables_completed=True)
+        checkpoint.record_progress("names", last_data_id=10)
+        checkpoint.record_progress("names", last_data_id=20, issue_found=True)
+        self.assertTrue(checkpoint.are_other_tables_completed("names"))
+        self.assertEqual(checkpoint.get_last_data_id("names"), 20)
+        self.assertTrue(checkpoint.issue_found)
+        self.assertFalse(os.path.exists(self.filename + ".tmp"))
+
+
+if __name__ == '__main__':
+    unittest.main()
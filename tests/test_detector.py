@@ -0,0 +1,54 @@
+from argparse import Namespace
+from icat_tools.detectors.detector import RunContext
+from icat_tools.detectors.nameissue_detector import NameIssueDetector
+from icat_tools.detectors.timestampissue_detector import TimestampIssueDetector
+import unittest
+
+
+def get_args():
+    return Namespace(sample=None, snapshot=None, name_cache_size=100, data_object_prefix=None)
+
+
+class RunContextTest(unittest.TestCase):
+
+    def test_shared_by_detectors_of_a_run(self):
+        args = get_args()
+        context = RunContext(args, {'names': {'r_data_main': "modify_ts > '1'"}})
+        names = NameIssueDetector(args, None, None, context)
+        timestamps = TimestampIssueDetector(args, None, None, context)
+        self.assertIs(names.get_name_resolver(), timestamps.get_name_resolver())
+        self.assertEqual(names.get_incremental_condition('r_data_main'), "modify_ts > '1'")
+        self.assertIsNone(timestamps.get_incremental_condition('r_data_main'))
+
+    def test_runs_are_separate(self):
+        args = get_args()
+        first = NameIssueDetector(args, None, None, RunContext(args, {'names': {'r_data_main': "TRUE"}}))
+        second = NameIssueDetector(args, None, None)
+        self.assertIsNone(second.context.get_name_cache_stats())
+        self.assertIsNot(first.get_name_resolver(), second.get_name_resolver())
+        self.assertIsNone(second.get_incremental_condition('r_data_main'))
+
+    def test_prefix_conditions_are_resolved_once(self):
+        args = get_args()
+        args.data_object_prefix = "/tempZone/home"
+        context = RunContext(args, prefix_conditions={"/tempZone/home": "coll_id IN (1)"})
+        self.assertEqual(NameIssueDetector(args, None, None, context).get_data_object_prefix_condition(),
+                         "coll_id IN (1)")
+
+    def test_detector_flags(self):
+        args = get_args()
+        context = RunContext(args)
+        names = NameIssueDetector(args, None, None, context)
+        timestamps = TimestampIssueDetector(args, None, None, context)
+        names.shard_condition = "r_data_main.data_id < 10"
+        names.checked_tables = 'r_data_main'
+        names.scan_issue_found = True
+        self.assertEqual(names.get_table_conditions('r_data_main'), ["r_data_main.data_id < 10"])
+        self.assertEqual(timestamps.get_table_conditions('r_data_main'), [])
+        self.assertTrue(timestamps.is_table_checked('r_coll_main'))
+        self.assertFalse(names.is_table_checked('r_coll_main'))
+        self.assertFalse(timestamps.scan_issue_found)
+
+
+if __name__ == '__main__':
+    unittest.main()
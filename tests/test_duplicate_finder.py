@@ -0,0 +1,99 @@
+from icat_tools import duplicate_finder
+from icat_tools.duplicate_finder import DuplicateFinder
+import random
+import unittest
+
+
+def get_expected_groups(entries):
+    '''Returns the duplicate groups of a list of (hash, value) entries, like
+       DuplicateFinder.get_duplicate_groups yields them.'''
+    groups = {}
+    for position, (key_hash, value) in enumerate(entries):
+        groups.setdefault(key_hash, []).append((position, value))
+    return [(key_hash, group) for key_hash, group in sorted(groups.items()) if len(group) > 1]
+
+
+def get_random_entries(number_entries, number_hashes, seed=1):
+    generator = random.Random(seed)
+    hashes = [generator.randint(-2 ** 63, 2 ** 63 - 1) for _ in range(number_hashes)]
+    return [(generator.choice(hashes), value) for value in range(number_entries)]
+
+
+class DuplicateFinderTest(unittest.TestCase):
+
+    def _find_duplicates(self, entries, max_entries=None, batch_size=None):
+        finder = DuplicateFinder()
+        if max_entries is not None:
+            finder.max_entries = max_entries
+        try:
+            if batch_size is None:
+                for key_hash, value in entries:
+                    finder.add(key_hash, value)
+            else:
+                for start in range(0, len(entries), batch_size):
+                    batch = entries[start:start + batch_size]
+                    finder.add_batch([key_hash for key_hash, _ in batch], [value for _, value in batch])
+            return list(finder.get_duplicate_groups()), len(finder.runs)
+        finally:
+            finder.close()
+
+    def test_in_memory(self):
+        entries = [(5, 1), (3, 2), (5, 3), (-7, 4), (3, 5), (5, 6), (8, 7)]
+        groups, number_runs = self._find_duplicates(entries)
+        self.assertEqual(number_runs, 0)
+        self.assertEqual(groups, [(3, [(1, 2), (4, 5)]), (5, [(0, 1), (2, 3), (5, 6)])])
+
+    def test_no_duplicates(self):
+        groups, _ = self._find_duplicates([(key_hash, key_hash) for key_hash in range(100)], max_entries=7)
+        self.assertEqual(groups, [])
+
+    def test_spill(self):
+        entries = get_random_entries(1000, 300)
+        groups, number_runs = self._find_duplicates(entries, max_entries=100)
+        self.assertEqual(number_runs, 10)
+        self.assertEqual(groups, get_expected_groups(entries))
+
+    def test_equal_hashes_across_runs(self):
+        # Every run contains one entry of each hash, so all groups are spread over all runs
+        entries = [(key_hash, run * 10 + key_hash) for run in range(5) for key_hash in range(10)]
+        groups, number_runs = self._find_duplicates(entries, max_entries=10)
+        self.assertEqual(number_runs, 5)
+        self.assertEqual(groups, get_expected_groups(entries))
+        for _, group in groups:
+            self.assertEqual([position for position, _ in group], sorted(position for position, _ in group))
+
+    def test_merge_runs(self):
+        entries = get_random_entries(3 * duplicate_finder.MAX_RUNS, duplicate_finder.MAX_RUNS)
+        groups, number_runs = self._find_duplicates(entries, max_entries=2)
+        self.assertLess(number_runs, duplicate_finder.MAX_RUNS)
+        self.assertEqual(groups, get_expected_groups(entries))
+
+    def test_minimum_memory_limit(self):
+        finder = DuplicateFinder(memory_limit_mb=0)
+        self.assertEqual(finder.max_entries, 1)
+        finder.close()
+
+    def test_one_entry_limit(self):
+        entries = get_random_entries(200, 50)
+        groups, _ = self._find_duplicates(entries, max_entries=1)
+        self.assertEqual(groups, get_expected_groups(entries))
+
+    def test_add_batch(self):
+        entries = get_random_entries(1000, 300)
+        for batch_size in [1, 33, 100, 1000]:
+            groups, _ = self._find_duplicates(entries, max_entries=70, batch_size=batch_size)
+            self.assertEqual(groups, get_expected_groups(entries))
+
+    def test_close(self):
+        finder = DuplicateFinder()
+        finder.max_entries = 1
+        finder.add(1, 1)
+        finder.add(1, 2)
+        runs = list(finder.runs)
+        finder.close()
+        self.assertEqual(finder.runs, [])
+        self.assertTrue(all(run.closed for run in runs))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+from icat_tools import utils
+from icat_tools.incremental import IncrementalState, TRACKED_TABLES
+from unittest import mock
+import json
+import os
+import tempfile
+import unittest
+
+
+class FakeCursor(object):
+    '''Cursor that returns the current time, and the same maximum id for every table.'''
+
+    def __init__(self, now, max_id):
+        self.now = now
+        self.max_id = max_id
+        self.row = None
+
+    def execute(self, query, parameters=None):
+        self.row = (self.now,) if "now()" in query else (self.max_id,)
+
+    def fetchone(self):
+        return self.row
+
+    def close(self):
+        pass
+
+
+class FakeConnection(object):
+
+    def __init__(self, now, max_id):
+        self.now = now
+        self.max_id = max_id
+
+    def cursor(self):
+        return FakeCursor(self.now, self.max_id)
+
+
+def quote_literal(connection, value):
+    '''Replaces utils.quote_literal, which needs a database connection.'''
+    return "'{}'".format(value)
+
+
+@mock.patch.object(utils, 'quote_literal', quote_literal)
+class IncrementalStateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, "state.json")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def _run(self, now, max_id, tests):
+        '''Runs the tests incrementally, and returns the conditions of the run.'''
+        connection = FakeConnection(now, max_id)
+        state = IncrementalState(self.filename)
+        state.begin(connection)
+        conditions = state.get_conditions(connection)
+        state.save(tests)
+        return conditions
+
+    def test_first_run(self):
+        self.assertEqual(self._run("01600000000", 100, ["names"]), {})
+        conditions = self._run("01600000100", 200, [])
+        self.assertEqual(set(conditions), {"names"})
+        self.assertEqual(set(conditions["names"]), set(TRACKED_TABLES))
+        self.assertEqual(conditions["names"]["r_data_main"],
+                         "r_data_main.modify_ts >= '01600000000' OR r_data_main.data_id > 100")
+        self.assertEqual(conditions["names"]["r_coll_main"],
+                         "r_coll_main.modify_ts >= '01600000000' OR r_coll_main.coll_id > 100")
+        self.assertEqual(conditions["names"]["r_objt_metamap"], "r_objt_metamap.modify_ts >= '01600000000'")
+
+    def test_marks_per_test(self):
+        self._run("01600000000", 100, ["names", "timestamps"])
+        self._run("01600000100", 200, ["names"])
+        conditions = self._run("01600000200", 300, [])
+        self.assertEqual(conditions["names"]["r_user_main"], "r_user_main.modify_ts >= '01600000100'")
+        self.assertEqual(conditions["timestamps"]["r_user_main"], "r_user_main.modify_ts >= '01600000000'")
+
+    def test_empty_tables(self):
+        self._run("01600000000", None, ["names"])
+        conditions = self._run("01600000100", None, [])
+        self.assertEqual(conditions["names"]["r_data_main"], "r_data_main.modify_ts >= '01600000000'")
+
+    def test_save(self):
+        self._run("01600000000", 100, ["names"])
+        with open(self.filename) as statefile:
+            state = json.load(statefile)
+        self.assertEqual(state["tests"]["names"]["r_data_main"], {'modify_ts': "01600000000", 'id': 100})
+        self.assertFalse(os.path.exists(self.filename + ".tmp"))
+
+    def test_old_state_file(self):
+        with open(self.filename, "w") as statefile:
+            json.dump({'r_data_main': {'modify_ts': "01600000000", 'id': 100}}, statefile)
+        self.assertEqual(self._run("01600000100", 200, ["names"]), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
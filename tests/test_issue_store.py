@@ -0,0 +1,86 @@
+from icat_tools.issue_store import IssueStore, get_fingerprint
+import os
+import tempfile
+import unittest
+
+
+class IssueStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, "issues.db")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def _run(self, issues, complete=True):
+        '''Records the issues of a run of the test "names", and returns the resolved issues and
+           whether the run has found new issues.'''
+        store = IssueStore(self.filename)
+        known = [store.record("names", get_fingerprint("names", key), values) for key, values in issues]
+        resolved = store.get_resolved_issues("names")
+        new_issues_found = store.has_new_issues()
+        if complete:
+            store.remove_resolved_issues("names")
+            store.commit()
+        store.close()
+        return known, resolved, new_issues_found
+
+    def test_new_known_and_resolved_issues(self):
+        issue1 = ([1], {'object': 'a'})
+        issue2 = ([2], {'object': 'b'})
+        issue3 = ([3], {'object': 'c'})
+
+        self.assertEqual(self._run([issue1, issue2]), ([False, False], [], True))
+        self.assertEqual(self._run([issue2, issue3]), ([True, False], [{'object': 'a'}], True))
+        self.assertEqual(self._run([issue2, issue3]), ([True, True], [], False))
+        self.assertEqual(self._run([]), ([], [{'object': 'b'}, {'object': 'c'}], False))
+
+    def test_interrupted_run(self):
+        self._run([([1], {'object': 'a'})])
+        # A run that is not committed does not change the store
+        self.assertEqual(self._run([], complete=False), ([], [{'object': 'a'}], False))
+        self.assertEqual(self._run([([1], {'object': 'a'})]), ([True], [], False))
+
+    def test_issue_found_twice_in_a_run(self):
+        store = IssueStore(self.filename)
+        fingerprint = get_fingerprint("names", [1])
+        self.assertFalse(store.record("names", fingerprint, {}))
+        self.assertFalse(store.record("names", fingerprint, {}))
+        store.close()
+
+    def test_mark_known(self):
+        store = IssueStore(self.filename)
+        store.record("names", get_fingerprint("names", [1]), {'object': 'a'})
+        self.assertFalse(store.mark_known(get_fingerprint("names", [1])))
+        store.commit()
+        store.close()
+
+        store = IssueStore(self.filename)
+        self.assertTrue(store.mark_known(get_fingerprint("names", [1])))
+        self.assertFalse(store.mark_known(get_fingerprint("names", [2])))
+        self.assertEqual(store.get_resolved_issues("names"), [])
+        self.assertFalse(store.has_new_issues())
+        store.close()
+
+    def test_tests_are_separate(self):
+        store = IssueStore(self.filename)
+        store.record("names", get_fingerprint("names", [1]), {'object': 'a'})
+        store.record("timestamps", get_fingerprint("timestamps", [1]), {'object': 'a'})
+        store.commit()
+        store.close()
+
+        store = IssueStore(self.filename)
+        store.record("names", get_fingerprint("names", [1]), {'object': 'a'})
+        self.assertEqual(store.get_resolved_issues("names"), [])
+        self.assertEqual(store.get_resolved_issues("timestamps"), [{'object': 'a'}])
+        store.close()
+
+    def test_fingerprint(self):
+        self.assertEqual(get_fingerprint("names", {'a': 1, 'b': 2}), get_fingerprint("names", {'b': 2, 'a': 1}))
+        self.assertNotEqual(get_fingerprint("names", [1]), get_fingerprint("timestamps", [1]))
+        self.assertNotEqual(get_fingerprint("names", [1, 2]), get_fingerprint("names", [2, 1]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+from icat_tools import metrics
+from icat_tools.metrics import TestStats
+import json
+import os
+import tempfile
+import unittest
+
+
+def get_stats():
+    stats = TestStats("names")
+    stats.wall_time = 2.5
+    stats.db_time = 1.0
+    stats.rows_fetched = 100
+    stats.queries = 3
+    stats.issues = 2
+    stats.peak_rss_kb = 1000
+    stats.record_query('r_data_main', 0.5, 40)
+    return stats
+
+
+NAME_CACHE_STATS = {'collection': {'hits': 5, 'misses': 2, 'size': 2, 'max_size': 10}}
+
+
+class MeasureTest(unittest.TestCase):
+
+    def test_sub_checks(self):
+        stats = TestStats("names")
+        connection = object()
+        with stats.measure(connection):
+            with stats.measure(connection, 'r_coll_main'):
+                stats.record_issue()
+            stats.record_issue()
+        self.assertEqual(stats.issues, 2)
+        self.assertEqual(stats.sub_checks['r_coll_main'].issues, 1)
+        self.assertGreaterEqual(stats.wall_time, stats.sub_checks['r_coll_main'].wall_time)
+        self.assertEqual(metrics._active_stats, {})
+
+    def test_peak_rss(self):
+        stats = TestStats("names")
+        with stats.measure(object()):
+            pass
+        self.assertGreater(stats.peak_rss_kb, 0)
+        self.assertFalse(stats.peak_rss_shared)
+
+    def test_peak_rss_of_concurrent_tests(self):
+        first = TestStats("names")
+        second = TestStats("timestamps")
+        third = TestStats("hardlinks")
+        with first.measure(object()):
+            with second.measure(object()):
+                pass
+        with third.measure(object()):
+            pass
+        self.assertIsNone(first.peak_rss_kb)
+        self.assertIsNone(second.peak_rss_kb)
+        self.assertGreater(third.peak_rss_kb, 0)
+
+
+class StatsFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_json(self):
+        data = json.loads(metrics._format_json([get_stats()], NAME_CACHE_STATS, 1600000000.0))
+        self.assertEqual(data['timestamp'], 1600000000.0)
+        self.assertEqual(data['name_cache'], NAME_CACHE_STATS)
+        test = data['tests']['names']
+        self.assertEqual(test['wall_time'], 2.5)
+        self.assertEqual(test['db_time'], 1.5)
+        self.assertEqual(test['python_time'], 1.0)
+        self.assertEqual(test['rows_fetched'], 140)
+        self.assertEqual(test['queries'], 4)
+        self.assertEqual(test['peak_rss_kb'], 1000)
+        self.assertEqual(test['sub_checks']['r_data_main']['rows_fetched'], 40)
+        self.assertNotIn('name_cache', json.loads(metrics._format_json([], None, 1600000000.0)))
+
+    def test_prometheus(self):
+        stats = get_stats()
+        stats.sub_checks['bad "name"\n'] = metrics.Stats()
+        lines = metrics._format_prometheus([stats], NAME_CACHE_STATS, 1600000000.0).splitlines()
+        self.assertIn('icat_dbcheck_wall_time_seconds{test="names",sub_check=""} 2.5', lines)
+        self.assertIn('icat_dbcheck_rows_fetched{test="names",sub_check="r_data_main"} 40', lines)
+        self.assertIn('icat_dbcheck_issues{test="names",sub_check="bad \\"name\\"\\n"} 0', lines)
+        self.assertIn('icat_dbcheck_peak_rss_bytes{test="names"} 1024000', lines)
+        self.assertIn('icat_dbcheck_name_cache_hits{cache="collection"} 5', lines)
+        self.assertIn('icat_dbcheck_last_run_timestamp_seconds 1600000000.0', lines)
+        self.assertIn('# TYPE icat_dbcheck_queries gauge', lines)
+        for line in lines:
+            if not line.startswith('#'):
+                self.assertEqual(len(line.rsplit(' ', 1)), 2, line)
+
+    def test_prometheus_without_peak_rss(self):
+        stats = get_stats()
+        stats.peak_rss_kb = None
+        output = metrics._format_prometheus([stats], None, 1600000000.0)
+        self.assertNotIn('icat_dbcheck_peak_rss_bytes{', output)
+        self.assertNotIn('name_cache', output)
+
+    def test_write_stats_file(self):
+        prom_filename = os.path.join(self.directory.name, "stats.prom")
+        json_filename = os.path.join(self.directory.name, "stats.json")
+        for filename in [prom_filename, json_filename]:
+            metrics.write_stats_file(filename, [get_stats()])
+            self.assertFalse(os.path.exists(filename + ".tmp"))
+        with open(prom_filename) as statsfile:
+            self.assertTrue(statsfile.read().startswith("# HELP icat_dbcheck_wall_time_seconds"))
+        with open(json_filename) as statsfile:
+            self.assertEqual(json.load(statsfile)['tests']['names']['issues'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+from icat_tools.name_resolver import LRUCache, NameResolver
+import unittest
+
+
+class LRUCacheTest(unittest.TestCase):
+
+    def test_lookup(self):
+        cache = LRUCache(10)
+        cache.add(1, "a")
+        cache.add(2, None)
+        self.assertEqual(cache.lookup([1, 2, 3]), ({1: "a", 2: None}, {3}))
+        self.assertEqual(cache.get_stats(), {'hits': 2, 'misses': 1, 'size': 2, 'max_size': 10})
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = LRUCache(2)
+        cache.add(1, "a")
+        cache.add(2, "b")
+        cache.lookup([1])
+        cache.add(3, "c")
+        self.assertEqual(cache.lookup([1, 2, 3]), ({1: "a", 3: "c"}, {2}))
+
+    def test_add_again(self):
+        cache = LRUCache(2)
+        cache.add(1, "a")
+        cache.add(2, "b")
+        cache.add(1, "x")
+        cache.add(3, "c")
+        self.assertEqual(cache.lookup([1, 2, 3]), ({1: "x", 3: "c"}, {2}))
+        self.assertEqual(cache.get_stats()['size'], 2)
+
+
+class FakeCursor(object):
+    '''Cursor that runs the lookup statements of the name resolver on tables in memory.'''
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.rows = []
+
+    def execute(self, query, parameters=None):
+        self.connection.queries.append(query)
+        if query.startswith("SELECT 1 FROM pg_prepared_statements"):
+            self.rows = [(1,)] if parameters[0] in self.connection.prepared else []
+        elif query.startswith("PREPARE"):
+            self.connection.prepared.add(query.split()[1])
+        elif "collection" in query:
+            self.rows = [(coll_id, self.connection.collections[coll_id]) for coll_id in parameters[0]
+                         if coll_id in self.connection.collections]
+        else:
+            self.rows = [(data_id,) + self.connection.data_objects[data_id] for data_id in parameters[0]
+                         if data_id in self.connection.data_objects]
+
+    def fetchone(self):
+        return self.rows[0] if len(self.rows) > 0 else None
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+class FakeConnection(object):
+
+    def __init__(self):
+        self.collections = {1: "/zone", 2: "/zone/home"}
+        self.data_objects = {10: (2, "a.txt"), 11: (3, "orphan.txt")}
+        self.prepared = set()
+        self.queries = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+
+class NameResolverTest(unittest.TestCase):
+
+    def test_names(self):
+        connection = FakeConnection()
+        resolver = NameResolver(10)
+        self.assertEqual(resolver.get_collection_names(connection, [1, 5]), {1: "/zone", 5: None})
+        self.assertEqual(resolver.get_dataobject_names(connection, [10, 11, 12]),
+                         {10: "/zone/home/a.txt", 11: None, 12: None})
+
+    def test_cached_names(self):
+        connection = FakeConnection()
+        resolver = NameResolver(10)
+        resolver.get_dataobject_names(connection, [10, 12])
+        number_queries = len(connection.queries)
+        self.assertEqual(resolver.get_dataobject_names(connection, [10, 12]), {10: "/zone/home/a.txt", 12: None})
+        self.assertEqual(resolver.get_collection_names(connection, [2]), {2: "/zone/home"})
+        self.assertEqual(len(connection.queries), number_queries)
+        self.assertEqual(resolver.get_stats()['data_object']['hits'], 2)
+
+    def test_statements_are_prepared_once_per_session(self):
+        connection = FakeConnection()
+        NameResolver(10).get_collection_names(connection, [1])
+        NameResolver(10).get_collection_names(connection, [2])
+        self.assertEqual(len([query for query in connection.queries if query.startswith("PREPARE")]), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
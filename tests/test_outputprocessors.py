@@ -0,0 +1,134 @@
+from icat_tools import dbcheck_outputprocessors
+from icat_tools.dbcheck_outputprocessors import (CheckOutputProcessorCSV, CheckOutputProcessorHuman,
+                                                 CheckOutputProcessorJSONL, OUTPUT_ITEM_FORMATS)
+import contextlib
+import gzip
+import io
+import json
+import os
+import tempfile
+import unittest
+
+
+def get_values(check, item_type):
+    '''Returns the values of an item of a check, with the name of each field as its value.'''
+    values = {} if item_type is None else {'type': item_type}
+    for field in OUTPUT_ITEM_FORMATS[(check, item_type)]['fields']:
+        if field == 'report_columns':
+            values[field] = {'coll_id': '10', 'check': 'column named check', 'type': 'column named type'}
+        else:
+            values[field] = field
+    return values
+
+
+class OutputItemFormatsTest(unittest.TestCase):
+
+    def test_all_formats(self):
+        for (check, item_type), item_format in OUTPUT_ITEM_FORMATS.items():
+            values = get_values(check, item_type)
+            human = io.StringIO()
+            CheckOutputProcessorHuman(human).output_item(check, values)
+            csv = io.StringIO()
+            CheckOutputProcessorCSV(csv).output_item(check, values)
+            jsonl = io.BytesIO()
+            processor = CheckOutputProcessorJSONL(jsonl)
+            processor.output_item(check, values)
+            processor.close()
+            for field in item_format['fields']:
+                if field != 'report_columns':
+                    self.assertIn(field, human.getvalue(), check)
+                    self.assertIn(field, csv.getvalue(), check)
+            self.assertTrue(csv.getvalue().startswith(check + ","))
+            record = json.loads(jsonl.getvalue().decode('utf-8'))
+            self.assertEqual(record['check'], check)
+            self.assertEqual(record.get('type'), item_type)
+
+    def test_human(self):
+        output = io.StringIO()
+        CheckOutputProcessorHuman(output).output_item(
+            'minreplicas', {'object_name': '/zone/a', 'number_replicas': 1, 'min_replicas': 2})
+        CheckOutputProcessorHuman(output).output_item(
+            'ref_integrity', {'check_name': 'user password table refers to nonexistent user',
+                              'report_columns': {'user_id': '5'}})
+        self.assertEqual(output.getvalue(),
+                         "Number of replicas for data object /zone/a is 1 (less than 2)\n" +
+                         "Potential referential integrity issue found for " +
+                         "user password table refers to nonexistent user.\n  user_id : 5\n")
+
+    def test_csv(self):
+        output = io.StringIO()
+        processor = CheckOutputProcessorCSV(output)
+        processor.output_item('hardlinks', {'type': 'duplicate_dataobject_entry', 'object_name': '/zone/a',
+                                            'resource_name': 'demoResc', 'phy_path': '/vault/a'})
+        processor.output_item('timestamps', {'type': 'future', 'check_name': 'data object',
+                                             'report_columns': {'modify_ts': '09999999999', 'data_id': '1'}})
+        self.assertEqual(output.getvalue().splitlines(), [
+            "hardlinks,duplicate_dataobject,/vault/a,demoResc,/zone/a",
+            "timestamps,future,data object,data_id,1,modify_ts,09999999999"])
+
+    def test_unknown_items(self):
+        for check, values in [('unknown', {}), ('names', {'type': 'unknown'}), ('names', {})]:
+            for processor in [CheckOutputProcessorHuman(io.StringIO()), CheckOutputProcessorCSV(io.StringIO()),
+                              CheckOutputProcessorJSONL(io.BytesIO())]:
+                with contextlib.redirect_stderr(io.StringIO()):
+                    with self.assertRaises(SystemExit):
+                        processor.output_item(check, values)
+
+
+class JSONLTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def _write_items(self, output):
+        processor = CheckOutputProcessorJSONL(output)
+        processor.output_item('names', get_values('names', 'empty_name'))
+        processor.output_item('path_consistency', {'resource_name': 'demoResc', 'phy_path': '/vault/é',
+                                                   'data_name': '/zone/é'})
+        processor.close()
+        # Closing again, e.g. after an interrupt, does not write anything
+        processor.close()
+
+    def _check_records(self, data):
+        records = [json.loads(line) for line in data.decode('utf-8').splitlines()]
+        self.assertEqual(records, [
+            {'check': 'names', 'type': 'empty_name', 'check_name': 'check_name',
+             'report_columns': {'coll_id': '10', 'check': 'column named check', 'type': 'column named type'}},
+            {'check': 'path_consistency', 'resource_name': 'demoResc', 'phy_path': '/vault/é',
+             'data_name': '/zone/é'}])
+
+    def test_uncompressed(self):
+        output = io.BytesIO()
+        self._write_items(output)
+        self._check_records(output.getvalue())
+        self.assertIn('/zone/é'.encode('utf-8'), output.getvalue())
+
+    def test_buffered(self):
+        output = io.BytesIO()
+        processor = CheckOutputProcessorJSONL(output)
+        processor.output_item('indexes', {'type': 'missing_index', 'index': 'idx'})
+        self.assertEqual(output.getvalue(), b"")
+        processor.close()
+        self.assertEqual(output.getvalue(), b'{"check": "indexes", "type": "missing_index", "index": "idx"}\n')
+
+    def test_gzip(self):
+        filename = os.path.join(self.directory.name, "report.jsonl.gz")
+        with open(filename, "wb") as output:
+            self._write_items(output)
+        with gzip.open(filename, "rb") as report:
+            self._check_records(report.read())
+
+    @unittest.skipIf(dbcheck_outputprocessors.zstandard is None, "the zstandard module is needed for zstd output")
+    def test_zstd(self):
+        filename = os.path.join(self.directory.name, "report.jsonl.zst")
+        with open(filename, "wb") as output:
+            self._write_items(output)
+        with open(filename, "rb") as report:
+            self._check_records(dbcheck_outputprocessors.zstandard.ZstdDecompressor().stream_reader(report).read())
+
+
+if __name__ == '__main__':
+    unittest.main()
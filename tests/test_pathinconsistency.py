@@ -0,0 +1,57 @@
+from icat_tools.detectors.pathinconsistency_detector import is_path_consistent, PathConsistencyChecker
+import unittest
+
+
+VAULT_PATHS = {1: "/var/lib/irods/Vault", 2: "/data/vault/", 3: "/"}
+COLL_PATHS = {10: "/tempZone", 11: "/tempZone/home", 12: "/tempZone/home/rods/dir"}
+
+
+class PathConsistencyCheckerTest(unittest.TestCase):
+
+    def _assert_same_result(self, checker, resc_id, coll_id, data_path):
+        expected = is_path_consistent(VAULT_PATHS[resc_id], COLL_PATHS[coll_id], data_path)
+        self.assertEqual(checker.is_consistent(resc_id, coll_id, data_path), expected,
+                         (resc_id, coll_id, data_path))
+        return expected
+
+    def test_consistent_paths(self):
+        checker = PathConsistencyChecker(VAULT_PATHS, COLL_PATHS)
+        for resc_id, coll_id, data_path in [(1, 12, "/var/lib/irods/Vault/home/rods/dir/file"),
+                                            (1, 11, "/var/lib/irods/Vault/home/file"),
+                                            (1, 10, "/var/lib/irods/Vault/file"),
+                                            (2, 12, "/data/vault/home/rods/dir/file"),
+                                            (3, 12, "/home/rods/dir/file")]:
+            self.assertTrue(self._assert_same_result(checker, resc_id, coll_id, data_path))
+
+    def test_inconsistent_paths(self):
+        checker = PathConsistencyChecker(VAULT_PATHS, COLL_PATHS)
+        for resc_id, coll_id, data_path in [(1, 12, "/var/lib/irods/Vault/home/rods/other/file"),
+                                            (1, 11, "/var/lib/irods/Vault/home/rods/dir/file"),
+                                            (1, 12, "/var/lib/irods/Vault/home/rods/dir/sub/file"),
+                                            (2, 10, "/data/vault2/file"),
+                                            (1, 12, "/elsewhere/home/rods/dir/file"),
+                                            (1, 10, "file")]:
+            self.assertFalse(self._assert_same_result(checker, resc_id, coll_id, data_path))
+
+    def test_paths_written_differently(self):
+        checker = PathConsistencyChecker(VAULT_PATHS, COLL_PATHS)
+        for resc_id, coll_id, data_path in [(1, 12, "/var/lib/irods/Vault//home/rods/dir/file"),
+                                            (1, 12, "/var/lib/irods/Vault/home/rods/./dir/file"),
+                                            (2, 11, "/data/vault/home//file")]:
+            self.assertTrue(self._assert_same_result(checker, resc_id, coll_id, data_path))
+
+    def test_expected_dirs_are_memoized(self):
+        checker = PathConsistencyChecker(VAULT_PATHS, COLL_PATHS)
+        for number in range(3):
+            self._assert_same_result(checker, 1, 12, "/var/lib/irods/Vault/home/rods/dir/file{}".format(number))
+            self._assert_same_result(checker, 2, 12, "/data/vault/home/rods/other/file{}".format(number))
+        self.assertEqual(checker.expected_dirs, {(1, 12): "/var/lib/irods/Vault/home/rods/dir",
+                                                 (2, 12): "/data/vault/home/rods/dir"})
+
+        # Memoized directories are used, rather than the lookups
+        checker.coll_path_lookup = {}
+        self.assertTrue(checker.is_consistent(1, 12, "/var/lib/irods/Vault/home/rods/dir/file"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+from icat_tools import sampling
+import unittest
+
+
+class ConfidenceIntervalTest(unittest.TestCase):
+
+    def test_known_interval(self):
+        lower, upper = sampling.get_confidence_interval(10, 100)
+        self.assertAlmostEqual(lower, 0.0552, places=4)
+        self.assertAlmostEqual(upper, 0.1744, places=4)
+
+    def test_no_issues(self):
+        lower, upper = sampling.get_confidence_interval(0, 100)
+        self.assertAlmostEqual(lower, 0.0)
+        # Upper bound of the Wilson interval without issues: z^2 / (n + z^2)
+        self.assertAlmostEqual(upper, 1.96 ** 2 / (100 + 1.96 ** 2))
+
+    def test_all_issues(self):
+        lower, upper = sampling.get_confidence_interval(100, 100)
+        self.assertAlmostEqual(lower, 100 / (100 + 1.96 ** 2))
+        self.assertAlmostEqual(upper, 1.0)
+
+    def test_symmetric(self):
+        lower, upper = sampling.get_confidence_interval(500, 1000)
+        self.assertAlmostEqual(lower + upper, 1.0)
+
+    def test_contains_fraction(self):
+        for number_issues, number_rows in [(1, 10), (3, 7), (1, 100000), (99999, 100000)]:
+            lower, upper = sampling.get_confidence_interval(number_issues, number_rows)
+            self.assertLessEqual(0.0, lower)
+            self.assertLess(lower, number_issues / number_rows)
+            self.assertLess(number_issues / number_rows, upper)
+            self.assertLessEqual(upper, 1.0)
+
+    def test_narrows_with_sample_size(self):
+        small_lower, small_upper = sampling.get_confidence_interval(10, 100)
+        large_lower, large_upper = sampling.get_confidence_interval(1000, 10000)
+        self.assertLess(large_upper - large_lower, small_upper - small_lower)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+from icat_tools import utils
+import unittest
+
+
+class FakeCursor(object):
+
+    def __init__(self, row):
+        self.row = row
+        self.queries = []
+
+    def execute(self, query, parameters=None):
+        self.queries.append(query)
+
+    def fetchone(self):
+        return self.row
+
+    def close(self):
+        pass
+
+
+class FakeConnection(object):
+    '''Connection that returns the same row for every query.'''
+
+    def __init__(self, row):
+        self.row = row
+
+    def cursor(self):
+        return FakeCursor(self.row)
+
+
+class PrefixUpperBoundTest(unittest.TestCase):
+
+    def test_upper_bound(self):
+        self.assertEqual(utils._get_prefix_upper_bound("/tempZone/home/"), "/tempZone/home0")
+        self.assertEqual(utils._get_prefix_upper_bound("/tempZone/home/a"), "/tempZone/home/b")
+
+    def test_sorts_after_prefixed_strings(self):
+        for prefix in ["/zone/coll", "/zone/coll/", "/zone/\u00e9", "a\u007f", "a\ud7ff"]:
+            upper_bound = utils._get_prefix_upper_bound(prefix)
+            for name in [prefix, prefix + "\u0000", prefix + "zzz", prefix + "\U0010ffff"]:
+                self.assertLess(name.encode('utf-8'), upper_bound.encode('utf-8'))
+            self.assertLess(prefix, upper_bound)
+
+    def test_surrogates_are_skipped(self):
+        self.assertEqual(utils._get_prefix_upper_bound("a\ud7ff"), "a\ue000")
+
+    def test_last_code_point(self):
+        self.assertEqual(utils._get_prefix_upper_bound("ab\U0010ffff"), "ac")
+        self.assertIsNone(utils._get_prefix_upper_bound("\U0010ffff\U0010ffff"))
+
+    def test_empty_prefix(self):
+        self.assertIsNone(utils._get_prefix_upper_bound(""))
+
+
+class ByteOrderedTest(unittest.TestCase):
+
+    def test_byte_ordered_collations(self):
+        for collation in ["C", "POSIX", "C.UTF-8", "C.utf8"]:
+            self.assertTrue(utils._is_byte_ordered(FakeConnection((collation,))), collation)
+
+    def test_other_collations(self):
+        for collation in ["en_US.UTF-8", "nl_NL.utf8", "Croatian"]:
+            self.assertFalse(utils._is_byte_ordered(FakeConnection((collation,))), collation)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,35 @@
+from icat_tools import vectorized
+from icat_tools.vectorized import numpy
+import unittest
+
+
+@unittest.skipIf(numpy is None, "the numpy module is needed for vectorized checks")
+class VectorizedTest(unittest.TestCase):
+
+    def _array(self, values):
+        return numpy.array(values, dtype=numpy.int64)
+
+    def test_distinct_pair_counts(self):
+        keys, counts = vectorized.get_distinct_pair_counts(self._array([3, 1, 3, 1, 2, 3, 3]),
+                                                           self._array([5, 5, 5, 6, 7, 8, 5]))
+        self.assertEqual(keys.tolist(), [1, 2, 3])
+        self.assertEqual(counts.tolist(), [2, 1, 2])
+
+    def test_distinct_pair_counts_equal_values(self):
+        keys, counts = vectorized.get_distinct_pair_counts(self._array([4, 4, 4]), self._array([9, 9, 9]))
+        self.assertEqual(keys.tolist(), [4])
+        self.assertEqual(counts.tolist(), [1])
+
+    def test_distinct_pair_counts_empty(self):
+        keys, counts = vectorized.get_distinct_pair_counts(self._array([]), self._array([]))
+        self.assertEqual(keys.tolist(), [])
+        self.assertEqual(counts.tolist(), [])
+
+    def test_is_in(self):
+        self.assertEqual(vectorized.is_in(self._array([1, 2, 3, 2]), {2: 'a', 3: 'b'}).tolist(),
+                         [False, True, True, True])
+        self.assertEqual(vectorized.is_in(self._array([1, 2]), []).tolist(), [False, False])
+
+
+if __name__ == '__main__':
+    unittest.main()